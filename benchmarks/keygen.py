@@ -0,0 +1,29 @@
+"""Key pairs per second of keygen_many() by the number of worker processes.
+
+python -m benchmarks.keygen [COUNT]
+"""
+
+import os
+import sys
+import time
+
+from wg_gen.keygen import keygen_many
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    cpus = os.cpu_count() or 1
+    workers = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+
+    baseline = 0.0
+    print(f"{'workers':>8} {'keys/s':>10} {'speedup':>8}")
+    for worker_count in workers:
+        started = time.perf_counter()
+        keys = keygen_many(count, workers=worker_count)
+        rate = len(keys) / (time.perf_counter() - started)
+        baseline = baseline or rate
+        print(f"{worker_count:>8} {rate:>10.0f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Preshared keys per second, the X25519 derivation the keys were made
+with before against batched CSPRNG reads.
+
+    python -m benchmarks.psk [COUNT]
+"""
+
+import base64
+import sys
+import time
+from typing import Callable
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+from wg_gen.keygen import preshared_keygen, preshared_keygen_many
+
+
+def x25519_psk() -> str:
+    return base64.b64encode(
+        X25519PrivateKey.generate().public_key().public_bytes_raw()
+    ).decode()
+
+
+def measure(name: str, count: int, generate: Callable[[int], list[str]]) -> float:
+    started = time.perf_counter()
+    keys = generate(count)
+    rate = len(keys) / (time.perf_counter() - started)
+    print(f"{name:>24} {rate:>12.0f}")
+    return rate
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"{'generator':>24} {'keys/s':>12}")
+    baseline = measure("x25519", count, lambda n: [x25519_psk() for _ in range(n)])
+    measure("preshared_keygen", count, lambda n: [preshared_keygen() for _ in range(n)])
+    rate = measure("preshared_keygen_many", count, preshared_keygen_many)
+    print(f"batched speedup: {rate / baseline:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
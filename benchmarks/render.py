@@ -0,0 +1,82 @@
+"""Peak traced memory of rendering a wg-quick config, building it in a
+string against streaming it to the output file.
+
+    python -m benchmarks.render [PEERS]
+"""
+
+import io
+import ipaddress
+import os
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from wg_gen.cli.render import RenderOutput, render_wgquick, write_wgquick_config
+from wg_gen.db import Interface, db_connection, load_interface_tuples, take_keys
+
+
+def setup(path: Path, count: int) -> None:
+    with db_connection(path) as conn:
+        [(private_key, public_key)] = take_keys(conn, 1)
+        Interface(
+            name="wg0",
+            ipv4=ipaddress.IPv4Interface("10.0.0.1/8"),
+            ipv6=None,
+            mtu=1420,
+            listen_port=51820,
+            endpoint="vpn.example.com",
+            dns=[],
+            public_key=public_key,
+            private_key=private_key,
+        ).save(conn)
+        # Random bytes stand in for keys, generating them is not measured
+        conn.executemany(
+            "INSERT INTO clients"
+            "(interface, alias, public_key, preshared_key, ipv4, created_at) "
+            "VALUES ('wg0', ?, ?, ?, ?, 0)",
+            (
+                (f"client{idx}", os.urandom(32), os.urandom(32), 0x0A000002 + idx)
+                for idx in range(count)
+            ),
+        )
+
+
+def in_string(path: Path, output: Path) -> None:
+    with db_connection(path, readonly=True) as conn:
+        for interface, clients in load_interface_tuples(conn):
+            with io.StringIO() as f:
+                write_wgquick_config(f, interface, clients)
+                (output / f"{interface.name}.conf").write_text(f.getvalue())
+
+
+def streamed(path: Path, output: Path) -> None:
+    with db_connection(path, readonly=True) as conn:
+        with RenderOutput(output, ".wg-gen-wgquick.json") as render_output:
+            for interface, clients in load_interface_tuples(conn):
+                render_wgquick(render_output.open, interface, clients)
+
+
+def measure(name: str, method: Callable[[Path, Path], None], path: Path) -> None:
+    with tempfile.TemporaryDirectory() as output:
+        tracemalloc.start()
+        method(path, Path(output))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        size = (Path(output) / "wg0.conf").stat().st_size
+    print(f"{name:>12} {size / 2**20:>10.1f} {peak / 2**20:>10.1f}")
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "db.sqlite"
+        setup(path, count)
+        print(f"{'method':>12} {'file MiB':>10} {'peak MiB':>10}")
+        measure("in string", in_string, path)
+        measure("streamed", streamed, path)
+
+
+if __name__ == "__main__":
+    main()
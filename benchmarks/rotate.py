@@ -0,0 +1,64 @@
+"""Seconds to rotate the keys of every client of an interface, one
+``client add``-style save per client against ``keys rotate``.
+
+    python -m benchmarks.rotate [COUNT]
+"""
+
+import ipaddress
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from wg_gen.db import Interface, db_connection, take_keys
+from wg_gen.keygen import keygen, preshared_keygen
+
+
+def setup(path: Path, count: int) -> None:
+    with db_connection(path) as conn:
+        [(private_key, public_key)] = take_keys(conn, 1)
+        interface = Interface(
+            name="wg0",
+            ipv4=ipaddress.IPv4Interface("10.0.0.1/16"),
+            ipv6=None,
+            mtu=1420,
+            listen_port=51820,
+            endpoint="vpn.example.com",
+            dns=[],
+            public_key=public_key,
+            private_key=private_key,
+        )
+        interface.save(conn)
+        interface.create_clients(conn, [(f"client{idx}", True) for idx in range(count)])
+
+
+def one_by_one(path: Path) -> None:
+    with db_connection(path) as conn:
+        interface = Interface.load(conn, "wg0")
+        for client in list(interface.clients(conn)):
+            client.public_key = keygen()[1]
+            client.preshared_key = preshared_keygen()
+            client.save(conn)
+
+
+def rotate(path: Path) -> None:
+    with db_connection(path) as conn:
+        interface = Interface.load(conn, "wg0")
+        for _ in interface.rotate_client_keys(conn):
+            pass
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "db.sqlite"
+        setup(path, count)
+        print(f"{'method':>12} {'seconds':>10}")
+        for name, method in (("one by one", one_by_one), ("rotate", rotate)):
+            started = time.perf_counter()
+            method(path)
+            print(f"{name:>12} {time.perf_counter() - started:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
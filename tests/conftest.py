@@ -1,5 +1,7 @@
+import contextlib
+import logging
 from dataclasses import dataclass
-from typing import Callable
+from typing import Callable, ContextManager
 
 import pytest
 
@@ -36,6 +38,27 @@ def cli(tmp_path, capsys) -> Callable[[*[str, ...]], CallResult]:
     return run
 
 
+@pytest.fixture
+def real_logging() -> Callable[[], ContextManager[None]]:
+    """Let ``main()`` set up its own log handlers instead of the ones of
+    pytest, which make ``logging.basicConfig()`` do nothing"""
+
+    @contextlib.contextmanager
+    def configure():
+        root = logging.getLogger()
+        handlers, level = root.handlers[:], root.level
+        root.handlers.clear()
+        try:
+            yield
+        finally:
+            for handler in root.handlers:
+                handler.close()
+            root.handlers[:] = handlers
+            root.setLevel(level)
+
+    return configure
+
+
 @pytest.fixture
 def add_interface(cli):
     def _add(name="wg0", ipv4="10.0.0.1/24", ipv6="fd00::1/64"):
@@ -1,5 +1,8 @@
+import io
 import json
 
+import pytest
+
 
 def test_client_help(cli):
     result = cli("client", "--help")
@@ -148,16 +151,53 @@ def test_client_ipv6_increments(cli, add_interface):
     assert ips["bob"] == "fd00::3"
 
 
-def test_client_add_after_remove_ip_does_not_reuse(cli, add_interface):
-    """address_shift keeps incrementing even after client removal"""
+def test_client_add_after_remove_reuses_ip(cli, add_interface):
+    """Addresses of removed clients go back to the pool"""
     add_interface()
     cli("client", "add", "wg0", "alice")  # 10.0.0.2
     cli("client", "remove", "wg0", "alice")
-    cli("client", "add", "wg0", "bob")  # 10.0.0.3, not 10.0.0.2
+    cli("client", "add", "wg0", "bob")  # 10.0.0.2 again
 
     result = cli("-f", "json", "client", "list")
     data = json.loads(result.stdout)
-    assert data[0]["ipv4"] == "10.0.0.3"
+    assert data[0]["ipv4"] == "10.0.0.2"
+    assert data[0]["ipv6"] == "fd00::2"
+
+
+def test_client_add_reuses_lowest_free_ip(cli, add_interface):
+    add_interface()
+    for alias in ("c1", "c2", "c3", "c4", "c5"):
+        cli("client", "add", "wg0", alias)  # .2 - .6
+    cli("client", "remove", "wg0", "c4", "c2", "c3")
+
+    cli("client", "add", "wg0", "d1")
+    cli("client", "add", "wg0", "d2")
+    cli("client", "add", "wg0", "d3")
+    cli("client", "add", "wg0", "d4")
+
+    result = cli("-f", "json", "client", "list")
+    data = json.loads(result.stdout)
+    ips = {d["client"]: d["ipv4"] for d in data}
+    assert ips == {
+        "c1": "10.0.0.2",
+        "c5": "10.0.0.6",
+        "d1": "10.0.0.3",
+        "d2": "10.0.0.4",
+        "d3": "10.0.0.5",
+        "d4": "10.0.0.7",
+    }
+
+
+def test_client_remove_last_shrinks_address_shift(cli, add_interface):
+    add_interface()
+    cli("client", "add", "wg0", "alice")
+    cli("client", "add", "wg0", "bob")
+    cli("client", "remove", "wg0", "alice")
+    cli("client", "remove", "wg0", "bob")
+
+    result = cli("-f", "json", "interface", "list")
+    data = json.loads(result.stdout)
+    assert data[0]["address_shift"] == "1"
 
 
 def test_same_alias_different_interfaces(cli, add_interface):
@@ -412,9 +452,9 @@ def test_pool_exhausted_ipv6_only(cli):
     assert cli("client", "add", "wg0", "c3").code == 1
 
 
-def test_pool_not_reclaimed_after_remove(cli):
-    """Removing a client does NOT free its IP for reuse, so pool
-    still exhausts at the same point."""
+def test_pool_reclaimed_after_remove(cli):
+    """Removing a client frees its IP, so an exhausted pool accepts
+    new clients again."""
     cli(
         "interface",
         "add",
@@ -428,12 +468,16 @@ def test_pool_not_reclaimed_after_remove(cli):
     )
     cli("client", "add", "wg0", "c1")
     cli("client", "add", "wg0", "c2")
+    assert cli("client", "add", "wg0", "c3").code == 1
+
     cli("client", "remove", "wg0", "c1")
-    cli("client", "remove", "wg0", "c2")
+    assert cli("client", "add", "wg0", "c3").code == 0
+    assert cli("client", "add", "wg0", "c4").code == 1
 
-    # shift is already at 3, next IP would be .4 — out of range
-    r = cli("client", "add", "wg0", "c3")
-    assert r.code == 1
+    result = cli("-f", "json", "client", "list")
+    data = json.loads(result.stdout)
+    ips = {d["client"]: d["ipv4"] for d in data}
+    assert ips == {"c2": "10.0.0.3", "c3": "10.0.0.2"}
 
 
 def test_client_preshared_key_not_private_key(cli, add_interface):
@@ -478,7 +522,7 @@ def test_client_list_tsv_empty(cli):
 
 
 def test_client_force_readd_gets_new_ip(cli, add_interface):
-    """--force re-add increments address_shift, giving a new IP"""
+    """--force re-add allocates a new IP before freeing the old one"""
     add_interface()
     cli("client", "add", "wg0", "alice")
 
@@ -501,3 +545,313 @@ def test_client_config_no_ips_interface(cli, add_interface):
     result = cli("client", "add", "wg0", "alice")
     assert result.code == 0
     assert "Address = " in result.stdout
+
+
+def test_client_force_readd_frees_old_ip(cli, add_interface):
+    add_interface()
+    cli("client", "add", "wg0", "alice")  # 10.0.0.2
+    cli("client", "add", "wg0", "alice", "--force")  # 10.0.0.3
+    cli("client", "add", "wg0", "bob")
+
+    result = cli("-f", "json", "client", "list")
+    data = json.loads(result.stdout)
+    ips = {d["client"]: d["ipv4"] for d in data}
+    assert ips == {"alice": "10.0.0.3", "bob": "10.0.0.2"}
+
+
+# --- Bulk import ---
+
+
+def test_client_import_csv(cli, add_interface, tmp_path):
+    add_interface()
+    source = tmp_path / "clients.csv"
+    source.write_text("alias,preshared_key\nalice,\nbob,yes\ncarol,0\n")
+    output_dir = tmp_path / "configs"
+
+    result = cli("client", "import", "wg0", str(source), "--output", str(output_dir))
+    assert result.code == 0
+
+    assert sorted(p.name for p in output_dir.iterdir()) == [
+        "alice.conf",
+        "bob.conf",
+        "carol.conf",
+    ]
+    assert "PresharedKey" in (output_dir / "bob.conf").read_text()
+    assert "PresharedKey" not in (output_dir / "alice.conf").read_text()
+    assert (output_dir / "alice.conf").stat().st_mode & 0o777 == 0o600
+
+    result = cli("-f", "json", "client", "list")
+    data = json.loads(result.stdout)
+    ips = {d["client"]: d["ipv4"] for d in data}
+    assert ips == {"alice": "10.0.0.2", "bob": "10.0.0.3", "carol": "10.0.0.4"}
+
+
+def test_client_import_jsonl_stdin(cli, add_interface, monkeypatch):
+    add_interface()
+    cli("client", "add", "wg0", "first")
+    cli("client", "remove", "wg0", "first")
+    monkeypatch.setattr(
+        "sys.stdin",
+        io.StringIO('{"alias": "alice"}\n\n{"alias": "bob", "preshared_key": true}\n'),
+    )
+
+    result = cli("client", "import", "wg0", "--preshared-key")
+    assert result.code == 0
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [r["client"] for r in records] == ["alice", "bob"]
+    assert [r["ipv4"] for r in records] == ["10.0.0.2", "10.0.0.3"]
+    assert all("PresharedKey" in r["config"] for r in records)
+    assert all("PrivateKey" in r["config"] for r in records)
+
+
+def test_client_import_logs_to_stderr(cli, add_interface, tmp_path, real_logging):
+    add_interface()
+    source = tmp_path / "clients.csv"
+    source.write_text("alias\nalice\nbob\n")
+    with real_logging():
+        result = cli("client", "import", "wg0", str(source))
+    assert result.code == 0
+    # Configs streamed to stdout stay parsable line by line
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [r["client"] for r in records] == ["alice", "bob"]
+    assert "Imported 2 clients" in result.stderr
+
+
+def test_client_import_duplicate_in_input(cli, add_interface, tmp_path):
+    add_interface()
+    source = tmp_path / "clients.jsonl"
+    source.write_text('{"alias": "alice"}\n{"alias": "alice"}\n')
+
+    result = cli("client", "import", "wg0", str(source))
+    assert result.code == 1
+
+    result = cli("-f", "json", "client", "list")
+    assert json.loads(result.stdout) == []
+
+
+def test_client_import_existing_alias(cli, add_interface, tmp_path):
+    add_interface()
+    cli("client", "add", "wg0", "alice")
+    source = tmp_path / "clients.csv"
+    source.write_text("alias\nbob\nalice\n")
+
+    result = cli("client", "import", "wg0", str(source))
+    assert result.code == 1
+
+    result = cli("-f", "json", "client", "list")
+    assert [d["client"] for d in json.loads(result.stdout)] == ["alice"]
+
+
+def test_client_import_pool_exhausted(cli, tmp_path):
+    cli(
+        "interface",
+        "add",
+        "wg0",
+        "--ipv4",
+        "10.0.0.1/30",
+        "--endpoint",
+        "vpn.example.com:51820",
+    )
+    source = tmp_path / "clients.csv"
+    source.write_text("alias\nc1\nc2\nc3\n")
+
+    result = cli("client", "import", "wg0", str(source))
+    assert result.code == 1
+
+    result = cli("-f", "json", "client", "list")
+    assert json.loads(result.stdout) == []
+    assert cli("client", "add", "wg0", "c1").stdout.count("10.0.0.2") == 1
+
+
+def test_client_import_nonexistent_interface(cli, tmp_path):
+    source = tmp_path / "clients.csv"
+    source.write_text("alias\nalice\n")
+    result = cli("client", "import", "wg999", str(source))
+    assert result.code == 1
+
+
+def test_client_import_fills_free_addresses_first(cli, add_interface, tmp_path):
+    add_interface()
+    for alias in ("c1", "c2", "c3", "c4", "c5", "c6"):
+        cli("client", "add", "wg0", alias)  # .2 - .7
+    cli("client", "remove", "wg0", "c2", "c4", "c5")
+    source = tmp_path / "clients.csv"
+    source.write_text("alias\nd1\nd2\nd3\nd4\n")
+
+    result = cli("client", "import", "wg0", str(source))
+    assert result.code == 0
+    ips = [json.loads(line)["ipv4"] for line in result.stdout.splitlines()]
+    assert ips == ["10.0.0.3", "10.0.0.5", "10.0.0.6", "10.0.0.8"]
+
+
+def test_client_find(cli, add_interface):
+    add_interface(name="wg0", ipv4="10.0.0.1/24", ipv6="fd00::1/64")
+    add_interface(name="wg1", ipv4="10.1.0.1/24", ipv6="fd01::1/64")
+    for interface, alias in [("wg0", "alice"), ("wg1", "alina"), ("wg1", "bob")]:
+        assert cli("client", "add", interface, alias).code == 0
+
+    def find(query):
+        result = cli("-f", "json", "client", "find", query)
+        assert result.code == 0
+        return [(row["interface"], row["client"]) for row in json.loads(result.stdout)]
+
+    assert find("10.1.0.3") == [("wg1", "bob")]
+    assert find("fd00::2") == [("wg0", "alice")]
+    assert find("al") == [("wg0", "alice"), ("wg1", "alina")]
+    assert find("alin") == [("wg1", "alina")]
+
+    public_key = json.loads(cli("-f", "json", "client", "list").stdout)[2]["public_key"]
+    assert find(public_key) == [("wg1", "bob")]
+
+    assert cli("client", "find", "10.0.0.99").code == 1
+    assert cli("client", "find", "carol").code == 1
+
+
+def test_client_find_alias_prefix_last_character(cli, add_interface):
+    add_interface()
+    aliases = ["x\U0010ffff", "x\U0010ffffy", "x\ud7ff", "x\ud7ffy", "x\ue000", "z"]
+    for alias in aliases:
+        assert cli("client", "add", "wg0", alias).code == 0
+
+    def find(query):
+        result = cli("-f", "json", "client", "find", query)
+        assert result.code == 0
+        return [row["client"] for row in json.loads(result.stdout)]
+
+    # No character follows U+10FFFF and U+D7FF is followed by a surrogate
+    assert find("x\U0010ffff") == ["x\U0010ffff", "x\U0010ffffy"]
+    assert find("x\ud7ff") == ["x\ud7ff", "x\ud7ffy"]
+
+
+def test_client_add_public_key(cli, add_interface):
+    add_interface()
+    public_key = "x" * 42 + "A="
+    result = cli("client", "add", "wg0", "phone", "--public-key", public_key)
+    assert result.code == 0
+    assert "PrivateKey" not in result.stdout
+
+    clients = json.loads(cli("-f", "json", "client", "list").stdout)
+    assert clients[0]["public_key"] == public_key
+
+    # Keys are unique, a replaced client may keep its own
+    assert cli("client", "add", "wg0", "tablet", "--public-key", public_key).code == 1
+    args = ["client", "add", "wg0", "phone", "--public-key", public_key, "--force"]
+    assert cli(*args).code == 0
+
+    for invalid in ["x" * 43 + "=", "x" * 42 + "B=", "not a key"]:
+        assert cli("client", "add", "wg0", "tv", "--public-key", invalid).code == 1
+
+
+@pytest.mark.parametrize("layout", [[], ["--partitioned"]])
+def test_client_public_key_unique_across_interfaces(cli, layout):
+    def wg_gen(*args):
+        return cli(*layout, *args)
+
+    for name, ipv4 in [("wg0", "10.0.0.1/24"), ("wg1", "10.1.0.1/24")]:
+        args = ["interface", "add", name, "--endpoint", "vpn:51820", "--ipv4", ipv4]
+        assert wg_gen(*args).code == 0
+
+    public_key = "x" * 42 + "A="
+    assert wg_gen("client", "add", "wg0", "phone", "--public-key", public_key).code == 0
+    assert wg_gen("client", "add", "wg1", "phone", "--public-key", public_key).code == 1
+    clients = json.loads(wg_gen("-f", "json", "client", "list").stdout)
+    assert [(c["interface"], c["client"]) for c in clients] == [("wg0", "phone")]
+
+
+def test_client_import_public_keys(cli, add_interface, tmp_path):
+    add_interface()
+    keys = [f"{idx:042d}" + "A=" for idx in range(3)]
+    source = tmp_path / "clients.csv"
+    source.write_text(f"alias,public_key\na,{keys[0]}\nb,\nc,{keys[1]}\n")
+    result = cli("client", "import", "wg0", str(source))
+    assert result.code == 0
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [r["public_key"] for r in records[::2]] == keys[:2]
+    assert "PrivateKey" not in records[0]["config"]
+    assert "PrivateKey" in records[1]["config"]
+
+    for rows in [
+        f"d,{keys[2]}\ne,{keys[2]}\n",  # Duplicated in the input
+        f"d,{keys[2]}\ne,{keys[0]}\n",  # Already in use
+        "d,bad\n",
+    ]:
+        source.write_text("alias,public_key\n" + rows)
+        assert cli("client", "import", "wg0", str(source)).code == 1
+
+    # A line break inside a key must not pass as two keys of the batch check
+    source = tmp_path / "clients.jsonl"
+    for key in [f"{keys[2]}\n{keys[0]}", f"{keys[2]}\n", f" {keys[2]}"]:
+        records = [
+            {"alias": "d", "public_key": keys[2]},
+            {"alias": "e", "public_key": key},
+        ]
+        source.write_text("".join(json.dumps(record) + "\n" for record in records))
+        assert cli("client", "import", "wg0", str(source)).code == 1
+    assert cli("client", "add", "wg0", "d", "--public-key", f"{keys[2]}\n").code == 1
+
+    clients = json.loads(cli("-f", "json", "client", "list").stdout)
+    assert [client["client"] for client in clients] == ["a", "b", "c"]
+
+
+def test_client_config_derived_keys(cli, tmp_path):
+    args = ["interface", "add", "wg0", "--endpoint", "vpn.example.com:51820"]
+    assert cli(*args, "--ipv4", "10.0.0.1/24", "--derive-keys").code == 0
+    source = tmp_path / "clients.csv"
+    source.write_text("alias,preshared_key\nalice,\nbob,yes\n")
+    result = cli("client", "import", "wg0", str(source))
+    assert result.code == 0
+    imported = [json.loads(line) for line in result.stdout.splitlines()]
+
+    # Configs are rebuilt with the same private keys
+    result = cli("client", "config", "wg0")
+    assert result.code == 0
+    assert [json.loads(line) for line in result.stdout.splitlines()] == imported
+
+    # The device made key of carol can not be rebuilt
+    device_key = "xTIBA5rboUvnH4htodjb6e697QjLERt1NAB4mZqp8Dg="
+    assert cli("client", "add", "wg0", "carol", "--public-key", device_key).code == 0
+    assert cli("client", "config", "wg0", "carol").code == 1
+    result = cli("client", "config", "wg0", "bob", "-o", str(tmp_path / "configs"))
+    assert result.code == 0
+    assert (tmp_path / "configs" / "bob.conf").read_text() == imported[1]["config"]
+
+    # Rotation derives new keys, which are rebuilt as well
+    result = cli("keys", "rotate", "wg0", "alice")
+    assert result.code == 0
+    [rotated] = [json.loads(line) for line in result.stdout.splitlines()]
+    assert rotated["config"] != imported[0]["config"]
+    result = cli("client", "config", "wg0", "alice")
+    assert json.loads(result.stdout) == rotated
+
+    # The seed survives a dump and restore
+    dump_path = tmp_path / "dump.jsonl"
+    assert cli("db", "dump", str(dump_path)).code == 0
+    target = ["--db-path", str(tmp_path / "target.sqlite")]
+    assert cli(*target, "db", "restore", str(dump_path)).code == 0
+    result = cli(*target, "client", "config", "wg0", "alice")
+    assert json.loads(result.stdout) == rotated
+
+
+def test_client_config_logs_to_stderr(cli, tmp_path, real_logging):
+    args = ["interface", "add", "wg0", "--endpoint", "vpn.example.com:51820"]
+    assert cli(*args, "--ipv4", "10.0.0.1/24", "--derive-keys").code == 0
+    for alias in ("alice", "bob"):
+        assert cli("client", "add", "wg0", alias).code == 0
+
+    with real_logging():
+        result = cli("client", "config", "wg0")
+    assert result.code == 0
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [r["client"] for r in records] == ["alice", "bob"]
+    assert "Rebuilt 2 client configs" in result.stderr
+
+
+def test_client_config_without_seed(cli, add_interface):
+    add_interface()
+    assert cli("client", "add", "wg0", "alice").code == 0
+    assert cli("client", "config", "wg0").code == 1
+
+    # Rotation can switch an interface to derived keys
+    result = cli("keys", "rotate", "wg0", "--derive-keys")
+    assert result.code == 0
+    assert cli("client", "config", "wg0").stdout == result.stdout
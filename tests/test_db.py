@@ -0,0 +1,540 @@
+import json
+import sqlite3
+from unittest import mock
+
+import pytest
+
+from wg_gen.__main__ import main
+from wg_gen.db import (
+    PARTITION_FILE_SUFFIXES,
+    SCHEMA_VERSION,
+    Client,
+    Interface,
+    Partitions,
+    changes_since,
+    current_revision,
+    db_connection,
+    init_db,
+    interface_cache,
+    iter_client_rows,
+    key_pool_size,
+    load_interface_tuples,
+    load_interfaces,
+    schema_version,
+)
+
+
+LEGACY_SCHEMA = """
+CREATE TABLE interfaces (
+    name TEXT PRIMARY KEY UNIQUE NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ipv4 TEXT DEFAULT NULL,
+    ipv6 TEXT DEFAULT NULL,
+    address_shift INTEGER NOT NULL DEFAULT 1,
+    private_key TEXT NOT NULL,
+    public_key TEXT NOT NULL,
+    mtu INTEGER NOT NULL,
+    listen_port INTEGER,
+    endpoint TEXT NOT NULL,
+    dns TEXT NOT NULL,
+    allowed_ips TEXT NOT NULL,
+    persistent_keepalive INTEGER NOT NULL
+);
+CREATE TABLE clients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    interface TEXT NOT NULL,
+    alias TEXT NOT NULL,
+    public_key TEXT NOT NULL,
+    preshared_key TEXT DEFAULT NULL,
+    ipv4 TEXT DEFAULT NULL,
+    ipv6 TEXT DEFAULT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (interface) REFERENCES interfaces(name),
+    UNIQUE (interface, alias)
+);
+INSERT INTO interfaces VALUES (
+    'wg0', '2024-01-01 00:00:00', '10.0.0.1/24', 'fd00::1/64', 2,
+    'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=',
+    'AQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQE=',
+    1420, 51820, 'vpn.example.com', '1.1.1.1,2606:4700:4700::1111',
+    '0.0.0.0/0,2000::/3', 15
+);
+INSERT INTO clients(
+    interface, alias, public_key, preshared_key, ipv4, ipv6, created_at
+) VALUES (
+    'wg0', 'alice', 'AgICAgICAgICAgICAgICAgICAgICAgICAgICAgICAgI=',
+    'AwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwM=',
+    '10.0.0.2', 'fd00::2', '2024-01-01 00:00:00'
+);
+"""
+
+
+def index_names(conn: sqlite3.Connection) -> set[str]:
+    return {
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND name NOT LIKE 'sqlite_autoindex_%'"
+        )
+    }
+
+
+def test_init_db_fresh():
+    conn = sqlite3.connect(":memory:")
+    init_db(conn)
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert {
+        "clients_interface_id",
+        "clients_public_key",
+        "clients_ipv4",
+        "clients_ipv6",
+    } <= index_names(conn)
+
+
+def test_init_db_migrates_legacy(tmp_path, cli):
+    db_path = tmp_path / "db.sqlite"
+    conn = sqlite3.connect(db_path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+
+    conn = sqlite3.connect(db_path)
+    init_db(conn)
+    conn.commit()
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert "clients_interface_id" in index_names(conn)
+    public_key, ipv4, ipv6 = conn.execute(
+        "SELECT public_key, ipv4, ipv6 FROM clients"
+    ).fetchone()
+    assert public_key == b"\x02" * 32
+    assert ipv4 == 0x0A000002
+    assert len(ipv6) == 16
+    conn.close()
+
+    result = cli("-f", "json", "client", "list")
+    assert result.code == 0
+    assert json.loads(result.stdout) == [
+        {
+            "interface": "wg0",
+            "client": "alice",
+            "ipv4": "10.0.0.2",
+            "ipv6": "fd00::2",
+            "public_key": "AgICAgICAgICAgICAgICAgICAgICAgICAgICAgICAgI=",
+        }
+    ]
+
+    result = cli("-f", "json", "interface", "list")
+    interface = json.loads(result.stdout)[0]
+    assert interface["ipv4"] == "10.0.0.1/24"
+    assert interface["ipv6"] == "fd00::1/64"
+    assert interface["public_key"] == "AQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQE="
+    assert interface["dns"] == ["1.1.1.1", "2606:4700:4700::1111"]
+    assert interface["allowed_ips"] == ["0.0.0.0/0", "2000::/3"]
+    assert interface["address_shift"] == "2"
+
+    result = cli("client", "add", "wg0", "bob")
+    assert result.code == 0
+    assert "10.0.0.3" in result.stdout
+
+
+def test_init_db_frees_legacy_gaps(tmp_path, cli):
+    # Removed clients left .3 and .4 unused, .6 was the next address
+    conn = sqlite3.connect(tmp_path / "db.sqlite")
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute("UPDATE interfaces SET address_shift = 6")
+    conn.execute(
+        "INSERT INTO clients(interface, alias, public_key, ipv4, ipv6) "
+        "VALUES ('wg0', 'carol', ?, '10.0.0.5', 'fd00::5')",
+        ("BAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQ=",),
+    )
+    conn.commit()
+    conn.close()
+
+    interface = json.loads(cli("-f", "json", "interface", "list").stdout)[0]
+    assert interface["address_shift"] == "5"
+    for alias, address in [("dave", "10.0.0.3"), ("erin", "10.0.0.4")]:
+        result = cli("client", "add", "wg0", alias)
+        assert result.code == 0
+        assert f"Address = {address}," in result.stdout
+    result = cli("client", "add", "wg0", "frank")
+    assert "Address = 10.0.0.6," in result.stdout
+
+
+def test_init_db_current_schema_runs_no_ddl():
+    conn = sqlite3.connect(":memory:")
+    init_db(conn)
+
+    statements: list[str] = []
+    conn.set_trace_callback(statements.append)
+    init_db(conn)
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_init_db_newer_schema():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    with pytest.raises(RuntimeError):
+        init_db(conn)
+
+
+def test_database_uses_wal(cli, tmp_path):
+    assert cli("interface", "list").code == 0
+    conn = sqlite3.connect(tmp_path / "db.sqlite")
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_readers_do_not_wait_for_writer(cli, add_interface, tmp_path):
+    add_interface()
+    cli("client", "add", "wg0", "alice")
+
+    writer = sqlite3.connect(tmp_path / "db.sqlite", isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        result = cli("-f", "json", "client", "list")
+        assert result.code == 0
+        assert "alice" in result.stdout
+
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            cli("--sqlite-busy-timeout", "0", "client", "add", "wg0", "bob")
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_readonly_command_can_not_write(tmp_path):
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM clients")
+
+
+def test_existing_config_is_not_rewritten(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.delenv("WG_GEN_CONFIG", raising=False)
+    config_path = tmp_path / ".local/share/wg-gen/config.ini"
+    config_path.parent.mkdir(parents=True)
+    config_path.write_text("[DEFAULT]\noutput_format = json\n")
+
+    with pytest.raises(SystemExit):
+        main("interface", "list")
+
+    assert config_path.read_text() == "[DEFAULT]\noutput_format = json\n"
+    assert (tmp_path / ".local/share/wg-gen/database.sqlite3").exists()
+
+
+def test_streaming_iterators_paginate(cli, add_interface, tmp_path):
+    for idx in range(3):
+        add_interface(name=f"wg{idx}", ipv4=f"10.{idx}.0.1/24", ipv6=None)
+    for name, aliases in [("wg0", "abcde"), ("wg2", "fgh")]:
+        source = tmp_path / f"{name}.csv"
+        source.write_text("alias\n" + "\n".join(aliases) + "\n")
+        assert cli("client", "import", name, str(source)).code == 0
+
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        for batch_size in (1, 2, 1000):
+            interfaces = list(Interface.list(conn, batch_size=batch_size))
+            assert [i.name for i in interfaces] == ["wg0", "wg1", "wg2"]
+            assert all(i.dns for i in interfaces)
+
+            wg0 = interfaces[0]
+            assert [c.alias for c in wg0.clients(conn, batch_size)] == list("abcde")
+
+            loaded = {
+                interface.name: [c.alias for c in clients]
+                for interface, clients in load_interfaces(conn, batch_size)
+            }
+            assert loaded == {"wg0": list("abcde"), "wg1": [], "wg2": list("fgh")}
+
+        # Clients left unconsumed are skipped when moving to the next interface
+        loaded = {
+            interface.name: next(clients).alias
+            for interface, clients in load_interfaces(conn, batch_size=2)
+            if interface.name != "wg1"
+        }
+        assert loaded == {"wg0": "a", "wg2": "f"}
+
+
+def test_records_decode_lazily(cli, add_interface, tmp_path):
+    add_interface(name="wg0", ipv4="10.0.0.1/24", ipv6="fd00::1/64")
+    assert cli("client", "add", "wg0", "alice").code == 0
+
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        client = Client.load(conn, "alice", "wg0")
+        assert not hasattr(client, "__dict__")
+        assert not hasattr(client, "_ipv4")
+        assert str(client.ipv4) == "10.0.0.2"
+        assert client == Client.load(conn, "alice", "wg0")
+
+        [(interface, clients)] = load_interface_tuples(conn)
+        assert interface == Interface.load(conn, "wg0")
+        [row] = clients
+        assert row[:6] == (
+            "wg0",
+            "alice",
+            client.public_key,
+            client.preshared_key,
+            "10.0.0.2",
+            str(client.ipv6),
+        )
+
+        client.ipv4 = None
+        assert client.ipv4 is None
+        assert client != Client.load(conn, "alice", "wg0")
+
+
+def test_interface_cache(cli, add_interface, tmp_path):
+    add_interface(name="wg0", ipv4="10.0.0.1/24", ipv6=None)
+
+    with db_connection(tmp_path / "db.sqlite", cache_size=2) as conn:
+        cache = interface_cache(conn)
+        assert cache is not None
+        interface = Interface.load(conn, "wg0")
+
+        statements: list[str] = []
+        conn.set_trace_callback(statements.append)
+        cached = Interface.load(conn, "wg0")
+        assert cached == interface and cached is not interface
+        assert not any("FROM interfaces" in sql for sql in statements)
+
+        # Allocations are written through
+        cached.create_client(conn, "alice")
+        assert Interface.load(conn, "wg0").address_shift == 2
+
+        # Rolled back changes are dropped
+        conn.rollback()
+        assert len(cache) == 0
+        conn.execute("BEGIN")
+        assert Interface.load(conn, "wg0").address_shift == 1
+        conn.commit()
+
+        # Commits from other connections are noticed
+        other = sqlite3.connect(tmp_path / "db.sqlite")
+        other.execute("UPDATE interfaces SET mtu = 1280")
+        other.commit()
+        other.close()
+        conn.execute("BEGIN")
+        assert Interface.load(conn, "wg0").mtu == 1280
+
+        Interface.load(conn, "wg0").remove(conn)
+        assert len(cache) == 0
+        with pytest.raises(LookupError):
+            Interface.load(conn, "wg0")
+
+
+def test_change_journal(cli, add_interface, tmp_path):
+    add_interface(name="wg0", ipv4="10.0.0.1/24", ipv6=None)
+    add_interface(name="wg1", ipv4="10.1.0.1/24", ipv6=None)
+    for args in [("add", "wg0", "a"), ("add", "wg0", "b"), ("remove", "wg0", "a")]:
+        assert cli("client", *args).code == 0
+    assert cli("interface", "remove", "wg1").code == 0
+
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        assert current_revision(conn) == 6
+        assert Interface.load(conn, "wg0").revision == 5
+        changes = [
+            (c.revision, c.interface, c.alias, c.removed)
+            for c in changes_since(conn, 2, batch_size=2)
+        ]
+    assert changes == [
+        (3, "wg0", "a", False),
+        (4, "wg0", "b", False),
+        (5, "wg0", "a", True),
+        (6, "wg1", None, True),
+    ]
+
+    result = cli("-f", "json", "db", "changes", "--since", "4")
+    assert [row["revision"] for row in json.loads(result.stdout)] == ["5", "6"]
+
+    assert cli("db", "compact").code == 0
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        assert [c.revision for c in changes_since(conn)] == [1, 4, 5, 6]
+
+    assert cli("db", "compact", "--before", "4").code == 0
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        assert [c.revision for c in changes_since(conn)] == [5, 6]
+        assert current_revision(conn) == 6
+
+
+def test_partitioned_layout(cli, tmp_path):
+    def wg_gen(*args):
+        return cli("--partitioned", *args)
+
+    for name, ipv4 in [("wg0", "10.0.0.1/24"), ("wg1", "10.1.0.1/24")]:
+        args = ["interface", "add", name, "--endpoint", "vpn:51820", "--ipv4", ipv4]
+        assert wg_gen(*args).code == 0
+    assert wg_gen("client", "add", "wg0", "alice").code == 0
+    assert wg_gen("client", "add", "wg1", "bob").code == 0
+
+    partitions = Partitions(tmp_path / "db.sqlite")
+    assert partitions.names() == ["wg0", "wg1"]
+
+    # Overlaps are checked against every partition through the catalog
+    args = ["interface", "add", "wg2", "--endpoint", "vpn:51820"]
+    assert wg_gen(*args, "--ipv4", "10.1.0.1/16").code == 1
+    assert not partitions.path("wg2").exists()
+    assert wg_gen("interface", "add", "../x", "--endpoint", "vpn:51820").code == 1
+    assert wg_gen("client", "add", "wg3", "carol").code == 1
+
+    result = wg_gen("-f", "json", "client", "list")
+    clients = [(row["interface"], row["client"]) for row in json.loads(result.stdout)]
+    assert clients == [("wg0", "alice"), ("wg1", "bob")]
+
+    # Writers of different interfaces do not wait for each other
+    with partitions.connect("wg0") as conn:
+        Interface.load(conn, "wg0").create_client(conn, "dave")
+        result = wg_gen("--sqlite-busy-timeout", "0", "client", "add", "wg1", "eve")
+        assert result.code == 0
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            wg_gen("--sqlite-busy-timeout", "0", "client", "add", "wg0", "frank")
+
+    assert wg_gen("interface", "remove", "wg1").code == 0
+    wg1 = partitions.path("wg1")
+    for suffix in PARTITION_FILE_SUFFIXES:
+        assert not wg1.with_name(wg1.name + suffix).exists()
+    assert partitions.names() == ["wg0"]
+    assert wg_gen(*args, "--ipv4", "10.1.0.1/16").code == 0
+    result = wg_gen("-f", "json", "interface", "list")
+    assert [row["interface"] for row in json.loads(result.stdout)] == ["wg0", "wg2"]
+
+
+def test_partition_drop_waits_for_catalog(tmp_path):
+    partitions = Partitions(tmp_path / "db.sqlite", {"busy_timeout": 0})
+    with partitions.connect("wg0", catalog_readonly=False):
+        pass
+    path = partitions.path("wg0")
+
+    catalog = sqlite3.connect(tmp_path / "db.sqlite", isolation_level=None)
+    catalog.execute("BEGIN IMMEDIATE")
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        partitions.drop_if_empty("wg0")
+    assert path.exists()
+    catalog.rollback()
+    assert partitions.drop_if_empty("wg0")
+    assert not path.exists()
+
+    # A writer that opened the file of a partition deleted before it got the
+    # catalog write lock starts over with a new file
+    opened = []
+
+    def connect(db_path, **kwargs):
+        if db_path == path and path not in opened:
+            for suffix in PARTITION_FILE_SUFFIXES:
+                path.with_name(path.name + suffix).unlink(missing_ok=True)
+        opened.append(db_path)
+        return db_connection(db_path, **kwargs)
+
+    with mock.patch("wg_gen.db.db_connection", side_effect=connect):
+        with partitions.connect("wg0", catalog_readonly=False) as conn:
+            conn.execute("INSERT INTO key_pool(private_key, public_key) VALUES (1, 2)")
+    assert opened.count(path) == 2
+    with partitions.connect("wg0") as conn:
+        assert key_pool_size(conn) == 1
+
+
+def test_dump_restore(cli, add_interface, tmp_path):
+    add_interface(name="wg0", ipv4="10.0.0.1/24", ipv6="fd00::1/64")
+    add_interface(name="wg1", ipv4="10.1.0.1/24", ipv6=None)
+    for alias in "abc":
+        assert cli("client", "add", "wg0", alias, "--preshared-key").code == 0
+    assert cli("client", "remove", "wg0", "b").code == 0
+
+    dump_path = tmp_path / "dump.jsonl"
+    assert cli("db", "dump", str(dump_path)).code == 0
+    records = [json.loads(line) for line in dump_path.read_text().splitlines()]
+    assert [r["type"] for r in records] == [
+        "header",
+        "interface",
+        "client",
+        "client",
+        "interface",
+    ]
+    assert records[1]["free_addresses"] == [[2, 2]]
+
+    target = ["--db-path", str(tmp_path / "target.sqlite")]
+    for layout in ([], ["--partitioned"]):
+        assert cli(*target, *layout, "db", "restore", str(dump_path)).code == 0
+        assert cli(*target, *layout, "db", "dump").stdout == dump_path.read_text()
+        # Restoring into a non-empty database fails
+        assert cli(*target, *layout, "db", "restore", str(dump_path)).code == 1
+        target = ["--db-path", str(tmp_path / "partitioned.sqlite")]
+
+    # A broken dump leaves nothing behind
+    broken = tmp_path / "broken.jsonl"
+    broken.write_text("\n".join(json.dumps(r) for r in records[:1] + records[2:]))
+    target = ["--db-path", str(tmp_path / "broken.sqlite")]
+    assert cli(*target, "db", "restore", str(broken)).code == 1
+    assert cli(*target, "-f", "json", "interface", "list").stdout.strip() == "[]"
+
+
+@pytest.mark.parametrize(
+    "condition, params",
+    [
+        ("ipv4 = ?", (1,)),
+        ("ipv6 = ?", (b"\0" * 16,)),
+        ("public_key = ?", (b"\0" * 32,)),
+        ("alias >= ? AND alias < ?", ("a", "b")),
+    ],
+)
+def test_client_lookups_use_indexes(condition, params):
+    conn = sqlite3.connect(":memory:")
+    init_db(conn)
+    plan = conn.execute(
+        f"EXPLAIN QUERY PLAN SELECT * FROM clients WHERE {condition}", params
+    ).fetchall()
+    assert "USING INDEX" in plan[0][-1]
+
+
+def test_client_pages_use_indexes():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    init_db(conn)
+    conn.executemany(
+        "INSERT INTO clients(interface, alias, public_key, created_at) "
+        "VALUES (?, ?, ?, 0)",
+        [
+            (interface, f"c{idx}", idx.to_bytes(32, "big"))
+            for idx, interface in enumerate(["wg1", "wg0", "wg2"] * 4 + ["wg0"] * 3)
+        ],
+    )
+
+    queries: list[str] = []
+    conn.set_trace_callback(queries.append)
+    rows = [(row["interface"], row["id"]) for row in iter_client_rows(conn, None, 3)]
+    conn.set_trace_callback(None)
+    assert rows == sorted(rows)
+    assert len(rows) == 15
+
+    for query in queries:
+        plan = " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}"))
+        assert "TEMP B-TREE" not in plan
+        condition = query.partition("WHERE")[2].partition("ORDER")[0]
+        if "id" in condition:
+            # Pages never rescan the interface from its first row
+            assert "(interface=? AND id>?)" in plan
+
+
+@pytest.mark.parametrize("vacuum", ["incremental", "full"])
+def test_maintain(cli, add_interface, tmp_path, vacuum):
+    add_interface(name="wg0", ipv4="10.0.0.0/16", ipv6=None)
+    source = tmp_path / "clients.csv"
+    source.write_text("alias\n" + "\n".join(f"c{idx}" for idx in range(2000)))
+    assert cli("client", "import", "wg0", str(source), "-o", str(tmp_path)).code == 0
+
+    with db_connection(tmp_path / "db.sqlite") as conn:
+        # Databases made before auto_vacuum was enabled get converted
+        conn.commit()
+        conn.execute("PRAGMA auto_vacuum = NONE")
+        conn.execute("VACUUM")
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM clients")
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+
+    result = cli("-f", "json", "db", "maintain", "--vacuum", vacuum)
+    assert result.code == 0
+    usage = {row["name"]: row for row in json.loads(result.stdout)}
+    assert usage["clients"]["rows"] == "0"
+    assert usage["clients_public_key"]["type"] == "index"
+    assert usage["sqlite_stat1"]["type"] == "table"
+
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+        assert conn.execute("PRAGMA page_count").fetchone()[0] < pages
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
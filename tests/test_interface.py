@@ -500,3 +500,49 @@ def test_interface_list_tsv_empty(cli):
     """TSV output with no interfaces should not crash"""
     result = cli("-f", "tsv", "interface", "list")
     assert result.code == 0
+
+
+def test_interface_overlap_with_enclosed_subnets(cli, add_interface, caplog):
+    add_interface(name="wg0", ipv4="10.0.1.1/24", ipv6=None)
+    add_interface(name="wg1", ipv4="10.0.5.1/24", ipv6=None)
+    add_interface(name="wg2", ipv4="10.1.0.1/24", ipv6=None)
+
+    result = cli(
+        "interface",
+        "add",
+        "wg3",
+        "--ipv4",
+        "10.0.0.1/16",
+        "--endpoint",
+        "vpn.example.com:51820",
+    )
+    assert result.code == 1
+    assert "interface 'wg1' (10.0.5.0/24)" in caplog.text
+
+    result = cli(
+        "interface",
+        "add",
+        "wg3",
+        "--ipv4",
+        "10.0.2.1/24",
+        "--endpoint",
+        "vpn.example.com:51820",
+    )
+    assert result.code == 0
+
+
+def test_interface_change_subnet(cli, add_interface):
+    add_interface(name="wg0", ipv4="10.0.0.1/24", ipv6="fd00::1/64")
+    add_interface(name="wg1", ipv4="10.1.0.1/24", ipv6="fd01::1/64")
+
+    # Moving wg1 onto the subnet of wg0 is rejected
+    add = ["interface", "add", "wg1", "--endpoint", "vpn.example.com:51820"]
+    assert cli(*add, "--ipv4", "10.0.0.1/24", "--ipv6", "fd02::1/64").code == 1
+
+    # Moving wg0 away frees its subnet
+    assert cli(*add[:2], "wg0", *add[3:], "--ipv4", "10.2.0.1/24").code == 0
+    assert cli(*add, "--ipv4", "10.0.0.1/24", "--ipv6", "fd00::1/64").code == 0
+
+    result = cli("-f", "json", "interface", "list")
+    data = {d["interface"]: d["ipv4"] for d in json.loads(result.stdout)}
+    assert data == {"wg0": "10.2.0.1/24", "wg1": "10.0.0.1/24"}
@@ -0,0 +1,240 @@
+import base64
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+from wg_gen.db import db_connection, key_pool_size, take_keys
+from wg_gen.keygen import (
+    PARALLEL_THRESHOLD,
+    derive_keygen,
+    derive_keygen_many,
+    key_seedgen,
+    keygen,
+    keygen_many,
+    preshared_keygen,
+    preshared_keygen_many,
+)
+
+
+def _encode(key: bytes) -> str:
+    return base64.b64encode(key).decode()
+
+
+def public_key(private_key: str) -> str:
+    key = X25519PrivateKey.from_private_bytes(base64.b64decode(private_key))
+    return base64.b64encode(key.public_key().public_bytes_raw()).decode()
+
+
+def test_keygen():
+    private, public = keygen()
+    assert len(base64.b64decode(private)) == 32
+    assert public_key(private) == public
+
+
+@pytest.mark.parametrize(
+    "count, workers", [(0, None), (10, None), (PARALLEL_THRESHOLD + 3, 2)]
+)
+def test_keygen_many(count, workers):
+    keys = keygen_many(count, workers=workers)
+    assert len(keys) == count
+    assert len({private for private, _ in keys}) == count
+    assert all(public_key(private) == public for private, public in keys[:10])
+
+
+def test_keygen_many_executor():
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        keys = keygen_many(50, executor=executor)
+    assert len(set(keys)) == 50
+
+
+def test_derive_keygen():
+    seed = key_seedgen()
+    private, public = derive_keygen(seed, "wg0", "alice", 0)
+    assert public_key(private) == public
+    assert derive_keygen(seed, "wg0", "alice", 0) == (private, public)
+
+    others = [
+        derive_keygen(seed, "wg0", "alice", 1),
+        derive_keygen(seed, "wg0", "bob", 0),
+        derive_keygen(seed, "wg1", "alice", 0),
+        # Length prefixes keep the name and alias apart
+        derive_keygen(seed, "wg0a", "lice", 0),
+        derive_keygen(key_seedgen(), "wg0", "alice", 0),
+    ]
+    assert len({private, *(key for key, _ in others)}) == 6
+
+    clients = [(f"client{idx}", idx % 3) for idx in range(50)]
+    keys = derive_keygen_many(seed, "wg0", clients, workers=1)
+    assert keys[7] == derive_keygen(seed, "wg0", "client7", 1)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        assert derive_keygen_many(seed, "wg0", clients, executor=executor) == keys
+
+
+def test_preshared_keygen():
+    assert len(base64.b64decode(preshared_keygen())) == 32
+    assert preshared_keygen_many(0) == []
+
+    keys = preshared_keygen_many(1000)
+    assert len(set(keys)) == 1000
+    assert all(len(base64.b64decode(key)) == 32 for key in keys)
+
+
+def test_key_pool(cli, add_interface, tmp_path):
+    add_interface()
+    assert cli("keys", "refill", "--size", "5", "--jobs", "1").code == 0
+
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        pool = [
+            _encode(row["public_key"])
+            for row in conn.execute("SELECT public_key FROM key_pool ORDER BY id")
+        ]
+    assert len(pool) == 5
+
+    assert cli("client", "add", "wg0", "alice").code == 0
+    source = tmp_path / "clients.csv"
+    source.write_text("alias\nbob\ncarol\ndave\neve\nfrank\n")
+    assert cli("client", "import", "wg0", str(source), "-o", str(tmp_path)).code == 0
+
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        assert key_pool_size(conn) == 0
+        keys = [
+            _encode(row["public_key"])
+            for row in conn.execute("SELECT public_key FROM clients ORDER BY id")
+        ]
+    # The pool is used oldest first, then keys are generated
+    assert keys[:5] == pool
+    assert keys[5] not in pool
+
+    assert cli("keys", "refill", "--size", "3").code == 0
+    assert cli("keys", "refill", "--size", "2").code == 0
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        assert key_pool_size(conn) == 3
+
+
+def test_key_pool_secure_delete(cli, add_interface, tmp_path):
+    add_interface()
+    assert cli("keys", "refill", "--size", "5", "--jobs", "1").code == 0
+
+    db_path = tmp_path / "db.sqlite"
+    with db_connection(db_path) as conn:
+        pool = [row[0] for row in conn.execute("SELECT private_key FROM key_pool")]
+        # Some builds turn it on by default
+        conn.execute("PRAGMA secure_delete = OFF")
+        assert len(take_keys(conn, 3)) == 3
+        assert conn.execute("PRAGMA secure_delete").fetchone()[0] == 0
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    data = db_path.read_bytes()
+    # Taken private keys are overwritten, the rest of the pool is kept
+    assert [key in data for key in pool] == [False] * 3 + [True] * 2
+
+
+def _clients(cli) -> dict[str, dict]:
+    result = cli("-f", "json", "client", "list")
+    return {client["client"]: client for client in json.loads(result.stdout)}
+
+
+def test_keys_rotate(cli, add_interface, tmp_path):
+    add_interface()
+    source = tmp_path / "clients.csv"
+    source.write_text("alias,preshared_key\nalice,\nbob,yes\ncarol,\n")
+    assert cli("client", "import", "wg0", str(source), "-o", str(tmp_path)).code == 0
+    before = _clients(cli)
+
+    result = cli("keys", "rotate", "wg0", "--jobs", "1")
+    assert result.code == 0
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [r["client"] for r in records] == ["alice", "bob", "carol"]
+
+    after = _clients(cli)
+    for alias, record in zip(["alice", "bob", "carol"], records):
+        assert after[alias]["ipv4"] == before[alias]["ipv4"]
+        assert after[alias]["ipv6"] == before[alias]["ipv6"]
+        assert after[alias]["public_key"] != before[alias]["public_key"]
+        assert after[alias]["public_key"] == record["public_key"]
+        private_key = record["config"].split("PrivateKey = ")[1].split()[0]
+        assert public_key(private_key) == record["public_key"]
+    assert "PresharedKey" in records[1]["config"]
+    assert "PresharedKey" not in records[0]["config"]
+
+
+def test_keys_rotate_subset(cli, add_interface, tmp_path):
+    add_interface()
+    for alias in ("alice", "bob"):
+        assert cli("client", "add", "wg0", alias).code == 0
+    before = _clients(cli)
+    output = tmp_path / "configs"
+
+    result = cli("keys", "rotate", "wg0", "bob", "-o", str(output))
+    assert result.code == 0
+    assert [path.name for path in output.iterdir()] == ["bob.conf"]
+
+    after = _clients(cli)
+    assert after["alice"] == before["alice"]
+    assert after["bob"]["public_key"] != before["bob"]["public_key"]
+
+    # Unknown clients fail the whole rotation
+    assert cli("keys", "rotate", "wg0", "alice", "mallory").code == 1
+    assert _clients(cli) == after
+
+
+def test_keys_rotate_invalid_file_name(cli, add_interface, tmp_path, real_logging):
+    add_interface()
+    for alias in ("alice", "x/y"):
+        assert cli("client", "add", "wg0", alias).code == 0
+    before = _clients(cli)
+    output = tmp_path / "configs"
+
+    # No config is written with a key that was never saved
+    for aliases in ([], ["alice", "x/y"]):
+        assert cli("keys", "rotate", "wg0", *aliases, "-o", str(output)).code == 1
+        assert not output.exists()
+        assert _clients(cli) == before
+
+    with real_logging():
+        result = cli("keys", "rotate", "wg0", "alice")
+    assert result.code == 0
+    [record] = [json.loads(line) for line in result.stdout.splitlines()]
+    assert record["client"] == "alice"
+    assert "Rotated keys of 1 clients" in result.stderr
+
+
+def test_keys_rotate_preshared_only(cli, add_interface, tmp_path):
+    add_interface()
+    assert cli("client", "add", "wg0", "alice").code == 0
+    assert cli("client", "add", "wg0", "bob", "--preshared-key").code == 0
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        psk = conn.execute(
+            "SELECT preshared_key FROM clients WHERE alias = 'bob'"
+        ).fetchone()[0]
+    before = _clients(cli)
+
+    result = cli("keys", "rotate", "wg0", "--preshared-keys-only")
+    assert result.code == 0
+    [record] = [json.loads(line) for line in result.stdout.splitlines()]
+    assert record["client"] == "bob"
+    assert "PrivateKey" not in record["config"]
+    assert "PresharedKey" in record["config"]
+
+    assert _clients(cli) == before
+    with db_connection(tmp_path / "db.sqlite", readonly=True) as conn:
+        assert conn.execute(
+            "SELECT preshared_key FROM clients WHERE alias = 'bob'"
+        ).fetchone()[0] not in (None, psk)
+
+
+def test_keys_rotate_interface_key(cli, add_interface):
+    add_interface()
+    assert cli("client", "add", "wg0", "alice").code == 0
+    before = json.loads(cli("-f", "json", "interface", "list").stdout)
+
+    result = cli("keys", "rotate", "wg0", "--interface-key")
+    assert result.code == 0
+    after = json.loads(cli("-f", "json", "interface", "list").stdout)
+    assert after[0]["public_key"] != before[0]["public_key"]
+    [record] = [json.loads(line) for line in result.stdout.splitlines()]
+    assert f"PublicKey = {after[0]['public_key']}" in record["config"]
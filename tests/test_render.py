@@ -1,3 +1,11 @@
+import fcntl
+import os
+
+import pytest
+
+from wg_gen.cli.render import RenderOutput
+
+
 def test_render_help(cli):
     result = cli("render", "--help")
     assert result.code == 0
@@ -170,3 +178,187 @@ def test_render_systemd_preshared_key(cli, add_interface, tmp_path):
 
     netdev = (output_dir / "wg0.netdev").read_text()
     assert "PresharedKey=" in netdev
+
+
+def test_render_wgquick_clients_per_interface(cli, add_interface, tmp_path):
+    add_interface(name="wg0", ipv4="10.0.0.1/24", ipv6="fd00::1/64")
+    add_interface(name="wg1", ipv4="10.1.0.1/24", ipv6="fd01::1/64")
+    add_interface(name="wg2", ipv4="10.2.0.1/24", ipv6="fd02::1/64")
+    cli("client", "add", "wg0", "alice")
+    cli("client", "add", "wg2", "bob")
+    cli("client", "add", "wg0", "carol")
+
+    output_dir = tmp_path / "wgquick"
+    output_dir.mkdir()
+    cli("render", "wgquick", "--output", str(output_dir))
+
+    wg0 = (output_dir / "wg0.conf").read_text()
+    wg1 = (output_dir / "wg1.conf").read_text()
+    wg2 = (output_dir / "wg2.conf").read_text()
+    assert wg0.index("alice") < wg0.index("carol")
+    assert "bob" not in wg0
+    assert "[Peer]" not in wg1
+    assert wg2.count("[Peer]") == 1
+    assert "bob" in wg2
+
+
+def test_render_systemd_incremental(cli, add_interface, tmp_path, caplog):
+    add_interface("wg0")
+    add_interface("wg1", ipv4="10.1.0.1/24", ipv6=None)
+    output_dir = tmp_path / "systemd"
+    output_dir.mkdir()
+    unrelated = output_dir / "10-eth0.network"
+    unrelated.write_text("[Match]\nName=eth0\n")
+    assert cli("render", "systemd", "--output", str(output_dir)).code == 0
+
+    def mtimes():
+        return {path.name: path.stat().st_mtime_ns for path in output_dir.glob("wg*")}
+
+    before = mtimes()
+    assert sorted(before) == ["wg0.netdev", "wg0.network", "wg1.netdev", "wg1.network"]
+
+    caplog.set_level("INFO")
+    assert cli("render", "systemd", "--output", str(output_dir)).code == 0
+    assert mtimes() == before
+    assert "0 files written, 4 unchanged, 0 removed" in caplog.text
+
+    # Only the netdev of the interface with a new client is written
+    caplog.clear()
+    cli("client", "add", "wg1", "alice")
+    assert cli("render", "systemd", "--output", str(output_dir)).code == 0
+    after = mtimes()
+    assert [name for name in after if after[name] != before[name]] == ["wg1.netdev"]
+    assert "1 files written, 3 unchanged, 0 removed" in caplog.text
+
+    # Files of removed interfaces are cleaned up, other files are kept
+    caplog.clear()
+    assert cli("interface", "remove", "wg0").code == 0
+    assert cli("render", "systemd", "--output", str(output_dir)).code == 0
+    assert sorted(mtimes()) == ["wg1.netdev", "wg1.network"]
+    assert unrelated.exists()
+    assert "0 files written, 2 unchanged, 2 removed" in caplog.text
+
+
+def test_render_wgquick_repairs_files(cli, add_interface, tmp_path):
+    add_interface()
+    output_dir = tmp_path / "wgquick"
+    assert cli("render", "wgquick", "--output", str(output_dir)).code == 0
+    conf = output_dir / "wg0.conf"
+    content = conf.read_text()
+
+    # Edited files and changed modes are restored
+    conf.write_text(content + "# edited\n")
+    assert cli("render", "wgquick", "--output", str(output_dir)).code == 0
+    assert conf.read_text() == content
+
+    conf.chmod(0o644)
+    assert cli("render", "wgquick", "--output", str(output_dir)).code == 0
+    assert conf.stat().st_mode & 0o777 == 0o640
+
+    # Without a manifest the files on disk are compared
+    (output_dir / ".wg-gen-wgquick.json").unlink()
+    mtime = conf.stat().st_mtime_ns
+    assert cli("render", "wgquick", "--output", str(output_dir)).code == 0
+    assert conf.stat().st_mtime_ns == mtime
+
+
+def test_render_output_atomic(tmp_path):
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    (output_dir / ".wg0.conf.abc.wg-gen-tmp").write_text("left behind")
+
+    with RenderOutput(output_dir, ".manifest.json") as output:
+        with output.open("wg0.conf") as f:
+            f.write("first\n")
+        # Nothing is in place before the output is closed
+        assert not (output_dir / "wg0.conf").exists()
+    assert (output_dir / "wg0.conf").read_text() == "first\n"
+    assert (output_dir / "wg0.conf").stat().st_mode & 0o777 == 0o640
+    assert sorted(path.name for path in output_dir.iterdir()) == [
+        ".manifest.json",
+        ".wg-gen.lock",
+        "wg0.conf",
+    ]
+
+    # A failed render leaves the previous files and no temporary files
+    with pytest.raises(RuntimeError):
+        with RenderOutput(output_dir, ".manifest.json") as output:
+            with output.open("wg0.conf") as f:
+                f.write("second\n")
+            with output.open("wg1.conf") as f:
+                f.write("second")
+                raise RuntimeError
+    assert (output_dir / "wg0.conf").read_text() == "first\n"
+    assert sorted(path.name for path in output_dir.iterdir()) == [
+        ".manifest.json",
+        ".wg-gen.lock",
+        "wg0.conf",
+    ]
+
+
+def test_render_output_lock(tmp_path):
+    def locked():
+        fd = os.open(tmp_path / RenderOutput.LOCK_NAME, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    with RenderOutput(tmp_path, ".manifest.json") as output:
+        with output.open("wg0.conf") as f:
+            f.write("wg0")
+        # Another render waits instead of removing the staged files
+        assert locked()
+    assert not locked()
+    assert (tmp_path / "wg0.conf").read_text() == "wg0"
+
+    with pytest.raises(RuntimeError):
+        with RenderOutput(tmp_path, ".manifest.json"):
+            raise RuntimeError
+    assert not locked()
+
+
+def test_render_output_sync(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr("os.sync", lambda: synced.append("sync"))
+    fsync = os.fsync
+    monkeypatch.setattr("os.fsync", lambda fd: synced.append(fd) or fsync(fd))
+
+    def render(content):
+        synced.clear()
+        with RenderOutput(tmp_path, ".manifest.json") as output:
+            for name in ("wg0.conf", "wg1.conf"):
+                with output.open(name) as f:
+                    f.write(content.get(name, name))
+
+    # The written files and the manifest, then the directory, are flushed
+    # without syncing the whole filesystem
+    render({})
+    assert "sync" not in synced and len(synced) == 4
+    # Unchanged files are not flushed again
+    render({"wg1.conf": "changed"})
+    assert "sync" not in synced and len(synced) == 3
+    assert (tmp_path / "wg1.conf").read_text() == "changed"
+
+
+@pytest.mark.parametrize("layout", [[], ["--partitioned"]])
+@pytest.mark.parametrize("command", ["systemd", "wgquick"])
+def test_render_jobs(cli, tmp_path, layout, command):
+    for idx in range(3):
+        args = ["interface", "add", f"wg{idx}", "--endpoint", "vpn.example.com:51820"]
+        assert cli(*layout, *args, "--ipv4", f"10.{idx}.0.1/24").code == 0
+        for alias in range(idx * 2):
+            assert cli(*layout, "client", "add", f"wg{idx}", f"c{alias}").code == 0
+
+    serial, parallel = tmp_path / "serial", tmp_path / "parallel"
+    assert cli(*layout, "render", command, "-o", str(serial)).code == 0
+    assert cli(*layout, "render", command, "-o", str(parallel), "--jobs", "2").code == 0
+
+    files = sorted(path.name for path in serial.iterdir())
+    assert sorted(path.name for path in parallel.iterdir()) == files
+    for name in files:
+        if not name.startswith("."):
+            assert (parallel / name).read_text() == (serial / name).read_text()
@@ -1,12 +1,16 @@
 import configparser
+import contextlib
 import logging
 import os
+import sqlite3
 from pathlib import Path
 
+import rich.console
 import rich.logging
 
 from .cli import Parser
-from .db import db_connection, init_db
+from .cli.base import BaseParser
+from .db import Partitions, db_connection
 
 
 def main(*args):
@@ -18,28 +22,67 @@ def main(*args):
     )
     parser.parse_args(args or None)
 
+    # Logs go to stderr, stdout carries the output of commands
+    handler = rich.logging.RichHandler(
+        console=rich.console.Console(stderr=True),
+        rich_tracebacks=True,
+        show_time=False,
+    )
     logging.basicConfig(
-        level=parser.log_level,
-        handlers=[rich.logging.RichHandler(rich_tracebacks=True, show_time=False)],
-        format="%(message)s",
+        level=parser.log_level, handlers=[handler], format="%(message)s"
     )
 
     if parser.db_path is None:
         db_path = xdg_path / "database.sqlite3"
-        config = configparser.ConfigParser()
-
-        config.set("DEFAULT", "db_path", str(db_path))
         xdg_path.mkdir(parents=True, exist_ok=True)
-        with config_path.open("w") as config_file:
-            config.write(config_file)
+        if not config_path.exists():
+            config = configparser.ConfigParser()
+            config.set("DEFAULT", "db_path", str(db_path))
+            with config_path.open("w") as config_file:
+                config.write(config_file)
         parser.db_path = db_path
 
-    with db_connection(parser.db_path) as conn:
-        init_db(conn)
+    command = parser.current_subparsers[0] if parser.current_subparsers else parser
+    with connect(parser, command) as conn:  # type: ignore[arg-type]
         retcode = parser(conn)
 
     exit(retcode)
 
 
+def connect(
+    parser: Parser, command: BaseParser
+) -> contextlib.AbstractContextManager[sqlite3.Connection]:
+    """Open the database the command works on"""
+    if not parser.partitioned:
+        return db_connection(
+            parser.db_path, readonly=command.readonly, pragmas=parser.sqlite.pragmas()
+        )
+
+    partitions = Partitions(parser.db_path, parser.sqlite.pragmas())
+    interface = command.partition()
+    if interface is not None:
+        try:
+            partitions.path(interface)
+        except ValueError as e:
+            logging.error("%s", e)
+            exit(1)
+    if interface is None:
+        # Commands for every interface write through connections to the
+        # partitions, the catalog itself is only written by maintenance
+        return partitions.catalog(
+            readonly=command.readonly or not command.writes_catalog
+        )
+    if not command.writes_catalog and not partitions.exists(interface):
+        logging.error("Interface %s was not found", interface)
+        exit(1)
+    # Adding and removing interfaces leave no partition without one behind
+    return partitions.connect(
+        interface,
+        readonly=command.readonly,
+        catalog_readonly=not command.writes_catalog,
+        drop_empty=command.writes_catalog,
+    )
+
+
 if __name__ == "__main__":
     main()
@@ -5,10 +5,44 @@ from argclass import Argument
 
 from .base import BaseParser
 from .client import ClientCommands
+from .database import DatabaseCommands
 from .interface import InterfaceCommands
+from .keys import KeysCommands
 from .render import RenderParser
 
 
+class SQLiteGroup(argclass.Group):
+    journal_mode: str = Argument(
+        default="wal",
+        choices=["wal", "delete", "truncate", "persist", "memory"],
+        help="SQLite journal mode, WAL lets readers run alongside a writer",
+    )
+    synchronous: str = Argument(
+        default="normal",
+        choices=["off", "normal", "full", "extra"],
+        help="SQLite synchronous mode",
+    )
+    busy_timeout: int = Argument(
+        default=5000, help="Milliseconds to wait for a locked database"
+    )
+    cache_size: int = Argument(
+        default=-2000,
+        help="SQLite page cache size in pages, or in KiB when negative",
+    )
+    mmap_size: int = Argument(
+        default=0, help="Bytes of the database to access through mmap"
+    )
+
+    def pragmas(self) -> dict[str, str | int]:
+        return {
+            "busy_timeout": self.busy_timeout,
+            "journal_mode": self.journal_mode,
+            "synchronous": self.synchronous,
+            "cache_size": self.cache_size,
+            "mmap_size": self.mmap_size,
+        }
+
+
 class Parser(BaseParser):
     log_level = argclass.LogLevel
     db_path: Path = Argument(default=None, help="Path to the database file")
@@ -19,7 +53,15 @@ class Parser(BaseParser):
         choices=["table", "json", "csv", "tsv"],
         help="Output format",
     )
+    partitioned: bool = Argument(
+        default=False,
+        help="Keep every interface in its own database file next to the "
+        "database, which then only holds the interface networks",
+    )
+    sqlite = SQLiteGroup(title="SQLite options")
 
     interface: InterfaceCommands = InterfaceCommands()
     client: ClientCommands = ClientCommands()
     render: RenderParser = RenderParser(description="Render server config files")
+    keys: KeysCommands = KeysCommands()
+    db: DatabaseCommands = DatabaseCommands()
@@ -5,6 +5,17 @@ import argclass
 
 
 class BaseParser(argclass.Parser):
+    # Commands that never write run in a deferred, query only transaction
+    readonly = False
+    # Commands that add or remove interface networks write to the catalog
+    # of a partitioned layout
+    writes_catalog = False
+
+    def partition(self) -> str | None:
+        """Interface the command works on, selects its database in a
+        partitioned layout. ``None`` means every interface."""
+        return None
+
     def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
         if self.current_subparser is not None:
             return self.current_subparser(conn)  # type: ignore[call-arg]
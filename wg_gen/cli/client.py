@@ -1,8 +1,15 @@
 import configparser
+import csv
 import errno
 import io
+import json
 import logging
+import os
 import sqlite3
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TextIO
 
 import argclass
 
@@ -12,20 +19,110 @@ from rich import get_console
 from rich.panel import Panel
 
 from .base import BaseParser
-from wg_gen.db import Client, Interface
+from wg_gen.db import (
+    DEFAULT_BATCH_SIZE,
+    Client,
+    Interface,
+    find_clients,
+    load_interface_tuples,
+)
 from wg_gen.table import SimpleTable
 
 
+def client_config(interface: Interface, client: Client, private_key: str | None) -> str:
+    """Render the wg-quick configuration for the client side, without
+    ``PrivateKey`` when the device made its own key pair"""
+    config = configparser.RawConfigParser()
+    config.optionxform = str  # type: ignore[assignment]
+
+    config.add_section("Interface")
+    config.add_section("Peer")
+
+    addresses = []
+    if client.ipv4:
+        addresses.append(str(client.ipv4))
+    if client.ipv6:
+        addresses.append(str(client.ipv6))
+
+    config.set("Interface", "Address", ", ".join(addresses))
+    if private_key is not None:
+        config.set("Interface", "PrivateKey", private_key)
+    config.set("Interface", "DNS", ",".join(map(str, interface.dns)))
+    config.set("Interface", "MTU", str(interface.mtu))
+    if client.preshared_key:
+        config.set("Peer", "PresharedKey", client.preshared_key)
+
+    config.set("Peer", "PublicKey", interface.public_key)
+    config.set("Peer", "AllowedIPs", ", ".join(map(str, interface.allowed_ips)))
+    config.set("Peer", "Endpoint", f"{interface.endpoint}:{interface.listen_port}")
+    config.set("Peer", "PersistentKeepalive", str(interface.persistent_keepalive))
+
+    with io.StringIO() as fp:
+        config.write(fp)
+        return fp.getvalue()
+
+
+def invalid_file_names(aliases: Iterable[str]) -> list[str]:
+    """Return the aliases which can not name a ``<alias>.conf`` file"""
+    return sorted(alias for alias in aliases if Path(alias).name != alias)
+
+
+def write_client_configs(
+    interface: Interface,
+    clients: Iterable[tuple[Client, str | None]],
+    output: Path | None,
+) -> int:
+    """Write a config per client to ``<alias>.conf`` files in the ``output``
+    directory, or as JSON Lines to stdout, as the clients are consumed.
+    Return the number of configs written."""
+    if output is not None:
+        output.mkdir(parents=True, exist_ok=True)
+
+    count = 0
+    for client, private_key in clients:
+        config = client_config(interface, client, private_key)
+        count += 1
+        if output is None:
+            record = {
+                "interface": interface.name,
+                "client": client.alias,
+                "ipv4": str(client.ipv4) if client.ipv4 else "",
+                "ipv6": str(client.ipv6) if client.ipv6 else "",
+                "public_key": client.public_key,
+                "config": config,
+            }
+            sys.stdout.write(json.dumps(record) + "\n")
+            continue
+
+        if Path(client.alias).name != client.alias:
+            raise ValueError(f"Alias can not be used as a file name: {client.alias}")
+        # Client configs contain private keys
+        path = output / f"{client.alias}.conf"
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w") as fp:
+            os.fchmod(fp.fileno(), 0o600)
+            fp.write(config)
+    return count
+
+
 class ClientBaseParser(BaseParser):
     """Base class for interface-related commands"""
 
     interface: str = Argument("interface", help="WireGuard interface name")
 
+    def partition(self) -> str | None:
+        return self.interface
+
 
 class ClientAddParser(ClientBaseParser):
     """Add a new client to an interface"""
 
     alias: str = Argument("alias", help="Client alias (unique per interface)")
+    public_key: str | None = Argument(
+        default=None,
+        help="Public key of a key pair made by the device, "
+        "the config is printed without a private key",
+    )
     preshared_key: bool = False
     force: bool = False
     qr: bool = False
@@ -55,38 +152,13 @@ class ClientAddParser(ClientBaseParser):
                 conn,
                 alias=self.alias,
                 preshared_key=self.preshared_key,
+                public_key=self.public_key,
             )
         except ValueError as e:
             logging.error("%s", e)
             return 1
 
-        config = configparser.RawConfigParser()
-        config.optionxform = str  # type: ignore[assignment]
-
-        config.add_section("Interface")
-        config.add_section("Peer")
-
-        addresses = []
-        if client.ipv4:
-            addresses.append(str(client.ipv4))
-        if client.ipv6:
-            addresses.append(str(client.ipv6))
-
-        config.set("Interface", "Address", ", ".join(addresses))
-        config.set("Interface", "PrivateKey", private_key)
-        config.set("Interface", "DNS", ",".join(map(str, interface.dns)))
-        config.set("Interface", "MTU", str(interface.mtu))
-        if client.preshared_key:
-            config.set("Peer", "PresharedKey", client.preshared_key)
-
-        config.set("Peer", "PublicKey", interface.public_key)
-        config.set("Peer", "AllowedIPs", ", ".join(map(str, interface.allowed_ips)))
-        config.set("Peer", "Endpoint", f"{interface.endpoint}:{interface.listen_port}")
-        config.set("Peer", "PersistentKeepalive", str(interface.persistent_keepalive))
-
-        with io.StringIO() as fp:
-            config.write(fp)
-            client_conf = fp.getvalue()
+        client_conf = client_config(interface, client, private_key)
 
         console = get_console()
         if self.qr:
@@ -126,9 +198,211 @@ class ClientRemoveParser(ClientBaseParser):
         return 0
 
 
+class ClientConfigParser(ClientBaseParser):
+    """Rebuild the configs of clients whose keys are derived from the
+    master seed of the interface"""
+
+    readonly = True
+
+    aliases: list[str] = Argument(
+        "aliases",
+        nargs="*",
+        default=[],
+        help="Clients to rebuild, every client with derived keys by default",
+    )
+    output: Path | None = Argument(
+        "--output",
+        "-o",
+        default=None,
+        help="Directory for <alias>.conf client configs, "
+        "JSON Lines are printed to stdout when omitted",
+    )
+    jobs: int | None = Argument(
+        default=None,
+        help="Processes deriving the keys, the number of CPUs by default",
+    )
+
+    def clients(
+        self, conn: sqlite3.Connection, interface: Interface
+    ) -> Iterator[list[Client]]:
+        if not self.aliases:
+            batch: list[Client] = []
+            for client in interface.clients(conn):
+                if client.key_counter is None:
+                    continue
+                batch.append(client)
+                if len(batch) >= DEFAULT_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            return
+
+        missing = set(self.aliases) - interface.existing_aliases(conn, self.aliases)
+        if missing:
+            raise LookupError(f"Clients not found: {', '.join(sorted(missing))}")
+        clients = [Client.load(conn, alias, interface.name) for alias in self.aliases]
+        underived = [client.alias for client in clients if client.key_counter is None]
+        if underived:
+            raise LookupError(
+                f"Keys of clients are not derived: {', '.join(underived)}"
+            )
+        yield clients
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        try:
+            interface = Interface.load(conn, self.interface)
+        except LookupError:
+            logging.error("Interface %s was not found", self.interface)
+            return 1
+
+        if interface.key_seed is None:
+            logging.error("Interface %s does not derive client keys", interface.name)
+            return 1
+
+        configs = (
+            pair
+            for batch in self.clients(conn, interface)
+            for pair in zip(batch, interface.derive_private_keys(batch, self.jobs))
+        )
+        try:
+            count = write_client_configs(interface, configs, self.output)
+        except (LookupError, ValueError) as e:
+            logging.error("%s", e.args[0])
+            return 1
+
+        logging.info("Rebuilt %d client configs of %s", count, interface.name)
+        return 0
+
+
+def read_client_records(
+    fp: TextIO, input_format: str, preshared_key: bool = False
+) -> Iterator[tuple[str, bool, str | None]]:
+    """Read ``(alias, preshared_key, public_key)`` records from CSV or
+    JSON Lines.
+
+    Every record needs an ``alias``, a missing or empty ``preshared_key``
+    falls back to the given default, a missing or empty ``public_key``
+    means a key pair is generated."""
+    records: Iterable[dict[str, Any]]
+    if input_format == "csv":
+        records = csv.DictReader(fp)
+    else:
+        records = (json.loads(line) for line in fp if line.strip())
+
+    for record in records:
+        alias = str(record.get("alias") or "").strip()
+        if not alias:
+            raise ValueError(f"Record without alias: {record!r}")
+        psk = record.get("preshared_key")
+        if psk is None or psk == "":
+            psk = preshared_key
+        elif isinstance(psk, str):
+            psk = psk.strip().lower() in ("1", "true", "yes", "y", "on")
+        public_key = str(record.get("public_key") or "").strip() or None
+        yield alias, bool(psk), public_key
+
+
+class ClientImportParser(ClientBaseParser):
+    """Import many clients at once from CSV or JSON Lines"""
+
+    input: Path = Argument(
+        "input",
+        nargs="?",
+        default=Path("-"),
+        type=Path,
+        help="File with an 'alias' and optional 'preshared_key' and "
+        "'public_key' columns, '-' reads stdin",
+    )
+    input_format: str | None = Argument(
+        default=None,
+        choices=["csv", "jsonl"],
+        help="Input format, detected from the file suffix by default",
+    )
+    preshared_key: bool = False
+    output: Path | None = Argument(
+        "--output",
+        "-o",
+        default=None,
+        help="Directory for <alias>.conf client configs, "
+        "JSON Lines are printed to stdout when omitted",
+    )
+    jobs: int | None = Argument(
+        default=None,
+        help="Processes generating the keys, the number of CPUs by default",
+    )
+
+    def read_records(self) -> list[tuple[str, bool, str | None]]:
+        input_format = self.input_format
+        if input_format is None:
+            input_format = "csv" if self.input.suffix.lower() == ".csv" else "jsonl"
+
+        if str(self.input) == "-":
+            return list(
+                read_client_records(sys.stdin, input_format, self.preshared_key)
+            )
+        with self.input.open(newline="") as fp:
+            return list(read_client_records(fp, input_format, self.preshared_key))
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        try:
+            interface = Interface.load(conn, self.interface)
+        except LookupError:
+            logging.error("Interface %s was not found", self.interface)
+            return 1
+
+        try:
+            records = self.read_records()
+        except (OSError, ValueError) as e:
+            logging.error("Failed to read %s: %s", self.input, e)
+            return 1
+
+        aliases = Counter(alias for alias, _, _ in records)
+        duplicates = sorted(alias for alias, count in aliases.items() if count > 1)
+        if duplicates:
+            logging.error("Duplicate aliases in input: %s", ", ".join(duplicates))
+            return 1
+
+        existing = interface.existing_aliases(conn, aliases)
+        if existing:
+            logging.error(
+                "Clients already exist for interface '%s': %s",
+                self.interface,
+                ", ".join(sorted(existing)),
+            )
+            return 1
+
+        if self.output is not None:
+            invalid = invalid_file_names(aliases)
+            if invalid:
+                logging.error(
+                    "Aliases can not be used as file names: %s", ", ".join(invalid)
+                )
+                return 1
+
+        try:
+            created = interface.create_clients(
+                conn,
+                [(alias, psk) for alias, psk, _ in records],
+                self.jobs,
+                public_keys=[public_key for _, _, public_key in records],
+            )
+        except ValueError as e:
+            logging.error("%s", e)
+            return 1
+
+        write_client_configs(interface, created, self.output)
+        logging.info(
+            "Imported %d clients to interface %s", len(created), interface.name
+        )
+        return 0
+
+
 class ClientListParser(BaseParser):
     """List all clients for an interface"""
 
+    readonly = True
+
     def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
         table = SimpleTable(
             "Interface",
@@ -139,8 +413,8 @@ class ClientListParser(BaseParser):
             title="WireGuard Clients",
         )
 
-        for interface in Interface.list(conn):
-            for client in interface.clients(conn):
+        for interface, clients in load_interface_tuples(conn):
+            for client in clients:
                 table.add_row(
                     interface.name,
                     client.alias,
@@ -153,12 +427,55 @@ class ClientListParser(BaseParser):
         return 0
 
 
+class ClientFindParser(BaseParser):
+    """Find clients on any interface by address, public key or alias prefix"""
+
+    readonly = True
+
+    query: str = Argument(
+        "query", help="IPv4 or IPv6 address, public key or alias prefix"
+    )
+    limit: int = Argument(default=100, help="Maximum number of alias matches")
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        clients = find_clients(conn, self.query, self.limit)
+        if not clients:
+            logging.error("No clients match '%s'", self.query)
+            return 1
+
+        table = SimpleTable(
+            "Interface",
+            "Client",
+            "IPv4",
+            "IPv6",
+            "Public Key",
+            title="WireGuard Clients",
+        )
+        for client in clients:
+            table.add_row(
+                client.interface,
+                client.alias,
+                str(client.ipv4) if client.ipv4 else "",
+                str(client.ipv6) if client.ipv6 else "",
+                client.public_key,
+            )
+
+        table.print(self.__parent__.__parent__.output_format)  # type: ignore[union-attr]
+        return 0
+
+
 class ClientCommands(BaseParser):
     """Manage clients for WireGuard interfaces"""
 
+    readonly = True
+
     add: ClientAddParser = ClientAddParser()
     remove: ClientRemoveParser = ClientRemoveParser()
     list: ClientListParser = ClientListParser()
+    find: ClientFindParser = ClientFindParser()
+    config: ClientConfigParser = ClientConfigParser()
+    # "import" is a keyword, so register the subcommand by name
+    locals()["import"] = ClientImportParser()
 
     def __call__(self, *args, **kwargs):
         self.print_help()
@@ -0,0 +1,226 @@
+import errno
+import itertools
+import json
+import logging
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TextIO
+
+from argclass import Argument
+
+from .base import BaseParser
+from wg_gen.db import (
+    VACUUM_MODES,
+    changes_since,
+    check_dump_header,
+    compact_changes,
+    dump,
+    iter_partitions,
+    maintain,
+    restore,
+)
+from wg_gen.table import SimpleTable
+
+
+class ChangesParser(BaseParser):
+    """List the change journal entries newer than a revision, revisions are
+    counted per interface in a partitioned layout"""
+
+    readonly = True
+
+    since: int = Argument(
+        default=0, help="Show the changes after this revision (default: all)"
+    )
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        table = SimpleTable(
+            "Revision",
+            "Interface",
+            "Client",
+            "Action",
+            "Time",
+            title="Changes",
+        )
+        for partition in iter_partitions(conn):
+            for change in changes_since(partition, self.since):
+                table.add_row(
+                    str(change.revision),
+                    change.interface,
+                    change.alias or "",
+                    "remove" if change.removed else "save",
+                    change.created_at.isoformat(),
+                )
+
+        table.print(self.__parent__.__parent__.output_format)  # type: ignore[union-attr]
+        return 0
+
+
+class CompactParser(BaseParser):
+    """Drop superseded entries from the change journal"""
+
+    before: int | None = Argument(
+        default=None,
+        help="Also drop every entry up to this revision, once all readers have seen it",
+    )
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        removed = sum(
+            compact_changes(partition, self.before)
+            for partition in iter_partitions(conn, readonly=False)
+        )
+        logging.info("Removed %d change journal entries", removed)
+        return 0
+
+
+class DumpParser(BaseParser):
+    """Write every interface and client as JSON Lines"""
+
+    readonly = True
+
+    output: Path = Argument(
+        "output",
+        nargs="?",
+        default=Path("-"),
+        type=Path,
+        help="Dump file, '-' writes to stdout",
+    )
+
+    def write(self, conn: sqlite3.Connection, fp: TextIO) -> None:
+        for record in dump(conn):
+            fp.write(json.dumps(record) + "\n")
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        if str(self.output) == "-":
+            self.write(conn, sys.stdout)
+        else:
+            with self.output.open("w") as fp:
+                self.write(conn, fp)
+        return 0
+
+
+def read_dump(fp: TextIO) -> Iterator[dict[str, Any]]:
+    for line in fp:
+        if line.strip():
+            yield json.loads(line)
+
+
+class RestoreParser(BaseParser):
+    """Load a dump made by 'db dump' into an empty database"""
+
+    input: Path = Argument(
+        "input",
+        nargs="?",
+        default=Path("-"),
+        type=Path,
+        help="Dump file, '-' reads stdin",
+    )
+
+    def restore(self, conn: sqlite3.Connection, fp: TextIO) -> tuple[int, int]:
+        records = read_dump(fp)
+        partitions = getattr(conn, "partitions", None)
+        if partitions is None:
+            return restore(conn, records)
+
+        # Every interface goes to its own partition, with its own transaction
+        interfaces, clients = 0, 0
+        for name, group in itertools.groupby(
+            records, key=lambda record: record.get("name", record.get("interface"))
+        ):
+            if name is None:
+                for record in group:
+                    check_dump_header(record)
+                continue
+            with partitions.connect(
+                name, catalog_readonly=False, drop_empty=True
+            ) as partition:
+                restored = restore(partition, group)
+            interfaces += restored[0]
+            clients += restored[1]
+        return interfaces, clients
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        try:
+            if str(self.input) == "-":
+                interfaces, clients = self.restore(conn, sys.stdin)
+            else:
+                with self.input.open() as fp:
+                    interfaces, clients = self.restore(conn, fp)
+        except (ValueError, KeyError) as e:
+            conn.rollback()
+            logging.error("Can not restore the dump: %s", e)
+            return 1
+
+        logging.info("Restored %d interfaces and %d clients", interfaces, clients)
+        return 0
+
+
+class MaintainParser(BaseParser):
+    """Check integrity, analyze, vacuum and report the table sizes"""
+
+    writes_catalog = True
+
+    vacuum: str = Argument(
+        default="incremental",
+        choices=VACUUM_MODES,
+        help="Reclaim the free pages of deleted rows, a full vacuum "
+        "also defragments but rewrites the whole file",
+    )
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        databases: Iterable[sqlite3.Connection] = iter_partitions(conn, readonly=False)
+        if getattr(conn, "partitions", None) is not None:
+            databases = itertools.chain([conn], databases)
+
+        table = SimpleTable(
+            "Database",
+            "Name",
+            "Type",
+            "Rows",
+            "Pages",
+            "Size",
+            title="Storage Usage",
+        )
+        retcode = 0
+        for database in databases:
+            report = maintain(database, self.vacuum)
+            if not report.healthy:
+                for message in report.integrity:
+                    logging.error("%s: %s", report.database, message)
+                retcode = 1
+            logging.info(
+                "%s: %d pages of %d bytes, %d before, %d free",
+                report.database,
+                report.pages_after,
+                report.page_size,
+                report.pages_before,
+                report.free_pages,
+            )
+            for usage in report.usage:
+                table.add_row(
+                    report.database,
+                    usage.name,
+                    usage.kind,
+                    "" if usage.rows is None else str(usage.rows),
+                    "" if usage.pages is None else str(usage.pages),
+                    "" if usage.size is None else str(usage.size),
+                )
+
+        table.print(self.__parent__.__parent__.output_format)  # type: ignore[union-attr]
+        return retcode
+
+
+class DatabaseCommands(BaseParser):
+    """Database maintenance"""
+
+    readonly = True
+
+    changes: ChangesParser = ChangesParser()
+    compact: CompactParser = CompactParser()
+    dump: DumpParser = DumpParser()
+    restore: RestoreParser = RestoreParser()
+    maintain: MaintainParser = MaintainParser()
+
+    def __call__(self, *args, **kwargs):
+        self.print_help()
+        exit(errno.EINVAL)
@@ -8,8 +8,8 @@ from argclass import Argument, Nargs
 
 from wg_gen.cli import BaseParser
 from wg_gen.cli.client import ClientBaseParser
-from wg_gen.db import Interface
-from wg_gen.keygen import keygen
+from wg_gen.db import Interface, take_keys
+from wg_gen.keygen import key_seedgen
 from wg_gen.table import SimpleTable
 
 
@@ -59,6 +59,8 @@ NON_LOCAL_NETS = frozenset(
 class InterfaceAddParser(BaseParser):
     """Add a new WireGuard interface"""
 
+    writes_catalog = True
+
     name: str = Argument("name", help="Interface name (e.g. wg0)")
     ipv4: ipaddress.IPv4Interface | None = Argument(
         default=None,
@@ -93,9 +95,17 @@ class InterfaceAddParser(BaseParser):
     persistent_keepalive: int = Argument(
         default=15, help="Persistent keepalive seconds"
     )
+    derive_keys: bool = Argument(
+        default=False,
+        help="Derive client keys from a master seed of the interface, "
+        "so 'client config' can rebuild client configs",
+    )
+
+    def partition(self) -> str | None:
+        return self.name
 
     def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
-        private_key, public_key = keygen()
+        [(private_key, public_key)] = take_keys(conn, 1)
         allowed_ips: set[ipaddress.IPv4Network | ipaddress.IPv6Network] = set()
 
         for allowed_ip in self.allowed_ips:
@@ -118,6 +128,7 @@ class InterfaceAddParser(BaseParser):
             persistent_keepalive=self.persistent_keepalive,
             public_key=public_key,
             private_key=private_key,
+            key_seed=key_seedgen() if self.derive_keys else None,
         )
         try:
             interface.save(conn)
@@ -130,6 +141,8 @@ class InterfaceAddParser(BaseParser):
 class InterfaceListParser(BaseParser):
     """List all interfaces"""
 
+    readonly = True
+
     def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
         table = SimpleTable(
             "Interface",
@@ -164,6 +177,8 @@ class InterfaceListParser(BaseParser):
 
 
 class InterfaceRemoveParser(ClientBaseParser):
+    writes_catalog = True
+
     def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
         try:
             interface = Interface.load(conn, self.interface)
@@ -179,6 +194,8 @@ class InterfaceRemoveParser(ClientBaseParser):
 class InterfaceCommands(BaseParser):
     """Manage WireGuard interfaces"""
 
+    readonly = True
+
     add: InterfaceAddParser = InterfaceAddParser()
     remove: InterfaceRemoveParser = InterfaceRemoveParser()
     list: InterfaceListParser = InterfaceListParser()
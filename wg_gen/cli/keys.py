@@ -0,0 +1,138 @@
+import errno
+import logging
+import sqlite3
+import time
+from pathlib import Path
+
+from argclass import Argument
+
+from .base import BaseParser
+from .client import ClientBaseParser, invalid_file_names, write_client_configs
+from wg_gen.db import Interface, iter_partitions, key_pool_size, refill_key_pool
+from wg_gen.keygen import key_seedgen
+
+
+class KeysRefillParser(BaseParser):
+    """Fill the pool of pre-generated key pairs used by new clients"""
+
+    size: int = Argument(default=1000, help="Number of key pairs to keep in the pool")
+    jobs: int | None = Argument(
+        default=None,
+        help="Processes generating the keys, the number of CPUs by default",
+    )
+    interval: float | None = Argument(
+        default=None,
+        help="Keep running and top the pool up every this many seconds",
+    )
+
+    def refill(self, conn: sqlite3.Connection) -> None:
+        for partition in iter_partitions(conn, readonly=False):
+            added = refill_key_pool(partition, self.size, self.jobs)
+            if added:
+                logging.info(
+                    "Added %d key pairs, %d in the pool",
+                    added,
+                    key_pool_size(partition),
+                )
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        self.refill(conn)
+        while self.interval is not None:
+            time.sleep(self.interval)
+            self.refill(conn)
+        return 0
+
+
+class KeysRotateParser(ClientBaseParser):
+    """Replace the keys of the clients of an interface, keeping their
+    addresses, and write their new configs"""
+
+    aliases: list[str] = Argument(
+        "aliases",
+        nargs="*",
+        default=[],
+        help="Clients to rotate, every client of the interface by default",
+    )
+    preshared_keys_only: bool = Argument(
+        default=False,
+        help="Only replace the preshared keys, the client key pairs stay valid",
+    )
+    interface_key: bool = Argument(
+        default=False, help="Also replace the key pair of the interface"
+    )
+    derive_keys: bool = Argument(
+        default=False,
+        help="Derive the new client keys from a master seed of the interface, "
+        "creating the seed when the interface has none",
+    )
+    output: Path | None = Argument(
+        "--output",
+        "-o",
+        default=None,
+        help="Directory for <alias>.conf client configs, "
+        "JSON Lines are printed to stdout when omitted",
+    )
+    jobs: int | None = Argument(
+        default=None,
+        help="Processes generating the keys, the number of CPUs by default",
+    )
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        try:
+            interface = Interface.load(conn, self.interface)
+        except LookupError:
+            logging.error("Interface %s was not found", self.interface)
+            return 1
+
+        # Nothing is written when a config file can not be, or the files
+        # written before would hold keys of a rolled back rotation
+        if self.output is not None:
+            aliases = self.aliases or (
+                row[0]
+                for row in conn.execute(
+                    "SELECT alias FROM clients WHERE interface = ?", (interface.name,)
+                )
+            )
+            invalid = invalid_file_names(aliases)
+            if invalid:
+                logging.error(
+                    "Aliases can not be used as file names: %s", ", ".join(invalid)
+                )
+                return 1
+
+        if self.derive_keys and interface.key_seed is None:
+            interface.key_seed = key_seedgen()
+            interface.save(conn)
+        if self.interface_key:
+            interface.rotate_key(conn)
+
+        # Every batch is written while the previous configs are consumed,
+        # the whole rotation is committed at once when the command succeeds
+        rotated = interface.rotate_client_keys(
+            conn,
+            self.aliases or None,
+            preshared_only=self.preshared_keys_only,
+            workers=self.jobs,
+        )
+        try:
+            count = write_client_configs(interface, rotated, self.output)
+        except (LookupError, ValueError) as e:
+            conn.rollback()
+            logging.error("%s", e.args[0])
+            return 1
+
+        logging.info("Rotated keys of %d clients of %s", count, interface.name)
+        return 0
+
+
+class KeysCommands(BaseParser):
+    """Manage WireGuard keys"""
+
+    readonly = True
+
+    refill: KeysRefillParser = KeysRefillParser()
+    rotate: KeysRotateParser = KeysRotateParser()
+
+    def __call__(self, *args, **kwargs):
+        self.print_help()
+        exit(errno.EINVAL)
@@ -1,140 +1,492 @@
+import contextlib
 import errno
+import fcntl
+import filecmp
+import hashlib
+import io
+import json
 import logging
+import os
 import sqlite3
-from io import StringIO
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    TextIO,
+)
 
 from argclass import Argument
 
-from ..db import Interface
+from ..db import (
+    ClientTuple,
+    Interface,
+    db_connection,
+    iter_client_rows,
+    iter_partitions,
+    load_interface_tuples,
+)
 from .base import BaseParser
 
 
-class SystemdNetworkdParser(BaseParser):
-    output: Path = Argument(
-        "--output", "-o", default=Path("/etc/systemd/network"), help="Output directory"
+class StagedFile(NamedTuple):
+    """File written to a temporary sibling of its final path"""
+
+    name: str
+    temp: Path
+    sha256: str
+    size: int
+    mtime_ns: int
+
+
+class HashingWriter(io.RawIOBase):
+    """Binary file wrapper hashing the data written through it"""
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.hash = hashlib.sha256()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        written = self.raw.write(data)
+        self.hash.update(memoryview(data)[:written])
+        return written
+
+
+class FileStager:
+    """Writes the files of an output directory to temporary siblings with
+    their final mode, through a buffer so the content is never held in
+    memory as a whole"""
+
+    TEMP_SUFFIX = ".wg-gen-tmp"
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, path: Path, mode: int = 0o640):
+        self.path = path
+        self.mode = mode
+        self.staged: list[StagedFile] = []
+
+    @contextlib.contextmanager
+    def open(self, name: str) -> Iterator[TextIO]:
+        """Open a text file to stage, added to :attr:`staged` when closed"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(
+            prefix=f".{name}.", suffix=self.TEMP_SUFFIX, dir=self.path
+        )
+        try:
+            with open(fd, "wb", buffering=0) as raw:
+                os.fchmod(fd, self.mode)
+                writer = HashingWriter(raw)
+                buffered = io.BufferedWriter(writer, self.BUFFER_SIZE)
+                with io.TextIOWrapper(buffered, encoding="utf-8") as f:
+                    yield f
+                    f.flush()
+                stat = os.fstat(fd)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        self.staged.append(
+            StagedFile(
+                name,
+                Path(temp),
+                writer.hash.hexdigest(),
+                stat.st_size,
+                stat.st_mtime_ns,
+            ),
+        )
+
+    def discard(self) -> None:
+        for staged in self.staged:
+            staged.temp.unlink(missing_ok=True)
+        self.staged.clear()
+
+
+class RenderOutput(FileStager):
+    """Output directory of a render command.
+
+    Files are only written when their content differs from the file on
+    disk, so unchanged configs keep their mtime and do not set off reloads.
+    A manifest in the directory keeps the hash and stat of every file
+    written, which saves reading unchanged files back, and lets the files
+    of removed interfaces be cleaned up without touching anything else in
+    the directory.
+
+    Files are staged in temporary siblings with their final mode and the
+    changed ones are renamed into place when the output is closed, after
+    an fsync of each of them, and the directory is synced once after the
+    renames. Readers never see a partly written file or a wrong mode, and
+    a crash leaves either the old or the new file."""
+
+    MANIFEST_FORMAT = 1
+    LOCK_NAME = ".wg-gen.lock"
+
+    def __init__(self, path: Path, manifest: str, mode: int = 0o640):
+        super().__init__(path, mode)
+        # Renders into the same directory run one after another, they share
+        # the temporary files and may share the manifest
+        path.mkdir(parents=True, exist_ok=True)
+        self.lock = os.open(path / self.LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+
+        self.manifest_path = path / manifest
+        self.manifest = self.read_manifest()
+        self.files: dict[str, dict[str, Any]] = {}
+        self.pending: list[tuple[Path, Path]] = []
+        self.written: list[str] = []
+        self.unchanged: list[str] = []
+        self.removed: list[str] = []
+
+        # Left behind by an interrupted run, no other render is running
+        for leftover in path.glob(f".*{self.TEMP_SUFFIX}"):
+            leftover.unlink(missing_ok=True)
+
+    def __enter__(self) -> "RenderOutput":
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        try:
+            if exc_type is None:
+                self.close()
+                return
+            self.discard()
+            for temp, _ in self.pending:
+                temp.unlink(missing_ok=True)
+        finally:
+            # Releases the lock
+            os.close(self.lock)
+
+    def read_manifest(self) -> dict[str, dict[str, Any]]:
+        try:
+            manifest = json.loads(self.manifest_path.read_text())
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning("Ignoring malformed manifest %s", self.manifest_path)
+            return {}
+        if manifest.get("format") != self.MANIFEST_FORMAT:
+            return {}
+        return manifest["files"]
+
+    @contextlib.contextmanager
+    def open(self, name: str) -> Iterator[TextIO]:
+        """Open a text file to write, it only replaces the file on disk
+        when the content differs"""
+        with super().open(name) as f:
+            yield f
+        self.add(self.staged.pop())
+
+    def is_current(self, staged: StagedFile) -> bool:
+        path = self.path / staged.name
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return False
+        if stat.st_mode & 0o777 != self.mode:
+            return False
+
+        known = self.manifest.get(staged.name)
+        if (
+            known is not None
+            and known["size"] == stat.st_size
+            and known["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return known["sha256"] == staged.sha256
+        # Not written by a previous run, or changed since
+        return stat.st_size == staged.size and filecmp.cmp(
+            path, staged.temp, shallow=False
+        )
+
+    def add(self, staged: StagedFile) -> None:
+        """Take over a file staged in the directory, by this output or by
+        a :class:`FileStager` of a worker"""
+        path = self.path / staged.name
+        if self.is_current(staged):
+            logging.debug("Configuration is unchanged: %s", path)
+            staged.temp.unlink()
+            self.unchanged.append(staged.name)
+            stat = path.stat()
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        else:
+            logging.info("Writing configuration to: %s", path)
+            self.pending.append((staged.temp, path))
+            self.written.append(staged.name)
+            size, mtime_ns = staged.size, staged.mtime_ns
+
+        self.files[staged.name] = {
+            "sha256": staged.sha256,
+            "size": size,
+            "mtime_ns": mtime_ns,
+        }
+
+    def close(self) -> None:
+        """Move the written files into place, remove the files of the
+        previous run that were not written again, save the manifest and
+        report what was done"""
+        stale = sorted(self.manifest.keys() - self.files.keys())
+        if self.pending or stale:
+            with super().open(self.manifest_path.name) as f:
+                json.dump(
+                    {"format": self.MANIFEST_FORMAT, "files": self.files},
+                    f,
+                    indent=1,
+                    sort_keys=True,
+                )
+            self.pending.append((self.staged.pop().temp, self.manifest_path))
+
+        if self.pending:
+            # The renames must not reach the disk before the data, only the
+            # changed files are flushed and not the whole filesystem
+            for temp, _ in self.pending:
+                fd = os.open(temp, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            for temp, path in self.pending:
+                os.replace(temp, path)
+            self.pending.clear()
+
+        for name in stale:
+            path = self.path / name
+            logging.info("Removing stale configuration: %s", path)
+            path.unlink(missing_ok=True)
+            self.removed.append(name)
+
+        if self.written or self.removed:
+            fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        logging.info(
+            "%d files written, %d unchanged, %d removed in %s",
+            len(self.written),
+            len(self.unchanged),
+            len(self.removed),
+            self.path,
+        )
+
+
+def write_networkd_network(f: TextIO, interface: Interface) -> None:
+    f.write("[Match]\n")
+    f.write(f"Name={interface.name}\n")
+    f.write("\n")
+
+    f.write("[Link]\n")
+    f.write("ActivationPolicy=always-up\n")
+    f.write("RequiredForOnline=no\n")
+    f.write("\n")
+
+    f.write("[Network]\n")
+    for address in filter(None, [interface.ipv4, interface.ipv6]):
+        f.write(f"Address={address}\n")
+    f.write("\n")
+
+
+def write_networkd_netdev(
+    f: TextIO, interface: Interface, clients: Iterable[ClientTuple]
+) -> None:
+    f.write("[NetDev]\n")
+    f.write("Kind=wireguard\n")
+    f.write(f"Name={interface.name}\n")
+    f.write(f"MTUBytes={interface.mtu}\n")
+    f.write("\n")
+
+    f.write("[WireGuard]\n")
+    f.write(f"ListenPort={interface.listen_port}\n")
+    f.write(f"PrivateKey={interface.private_key}\n")
+    f.write("\n")
+
+    for client in clients:
+        f.write(f"# Client: {client.alias}\n")
+        f.write("[WireGuardPeer]\n")
+        f.write(
+            "AllowedIPs={}\n".format(
+                ",".join(map(str, filter(None, [client.ipv4, client.ipv6]))),
+            ),
+        )
+        f.write(f"PublicKey={client.public_key}\n")
+        if client.preshared_key:
+            f.write(f"PresharedKey={client.preshared_key}\n")
+        f.write(f"PersistentKeepalive={interface.persistent_keepalive}\n")
+        f.write("\n")
+
+
+def write_wgquick_config(
+    f: TextIO, interface: Interface, clients: Iterable[ClientTuple]
+) -> None:
+    f.write("[Interface]\n")
+    f.write(f"ListenPort={interface.listen_port}\n")
+    f.write(f"PrivateKey={interface.private_key}\n")
+    f.write(f"MTU={interface.mtu}\n")
+    f.write(
+        "Address={}\n".format(
+            ",".join(map(str, filter(None, [interface.ipv4, interface.ipv6]))),
+        ),
     )
+    f.write("\n")
 
-    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
-        output_path = self.output.resolve()
-        logging.info("Generating systemd-networkd configuration to %s", output_path)
-
-        for interface in Interface.list(conn):
-            with StringIO() as f:
-                f.write("[Match]\n")
-                f.write(f"Name={interface.name}\n")
-                f.write("\n")
-
-                f.write("[Link]\n")
-                f.write("ActivationPolicy=always-up\n")
-                f.write("RequiredForOnline=no\n")
-                f.write("\n")
-
-                f.write("[Network]\n")
-                for address in filter(None, [interface.ipv4, interface.ipv6]):
-                    f.write(f"Address={address}\n")
-                f.write("\n")
-                network_content = f.getvalue()
-
-            with StringIO() as f:
-                f.write("[NetDev]\n")
-                f.write("Kind=wireguard\n")
-                f.write(f"Name={interface.name}\n")
-                f.write(f"MTUBytes={interface.mtu}\n")
-                f.write("\n")
-
-                f.write("[WireGuard]\n")
-                f.write(f"ListenPort={interface.listen_port}\n")
-                f.write(f"PrivateKey={interface.private_key}\n")
-                f.write("\n")
-
-                for client in interface.clients(conn):
-                    f.write(f"# Client: {client.alias}\n")
-                    f.write("[WireGuardPeer]\n")
-                    f.write(
-                        "AllowedIPs={}\n".format(
-                            ",".join(
-                                map(str, filter(None, [client.ipv4, client.ipv6]))
-                            ),
-                        ),
-                    )
-                    f.write(f"PublicKey={client.public_key}\n")
-                    if client.preshared_key:
-                        f.write(f"PresharedKey={client.preshared_key}\n")
-                    f.write(f"PersistentKeepalive={interface.persistent_keepalive}\n")
-                    f.write("\n")
-
-                netdev_content = f.getvalue()
-
-            netdev_path = output_path / f"{interface.name}.netdev"
-            network_path = output_path / f"{interface.name}.network"
-
-            for path, content in [
-                (netdev_path, netdev_content),
-                (network_path, network_content),
-            ]:
-                path.parent.mkdir(parents=True, exist_ok=True)
-                logging.info(
-                    "Writing configuration for %s to: %s", interface.name, path
+    for client in clients:
+        f.write(f"# Client: {client.alias}\n")
+        f.write("[Peer]\n")
+        f.write(
+            "AllowedIPs={}\n".format(
+                ",".join(map(str, filter(None, [client.ipv4, client.ipv6]))),
+            ),
+        )
+        f.write(f"PublicKey={client.public_key}\n")
+        f.write(f"PersistentKeepalive={interface.persistent_keepalive}\n")
+        if client.preshared_key:
+            f.write(f"PresharedKey={client.preshared_key}\n")
+
+        f.write("\n")
+
+
+Opener = Callable[[str], contextlib.AbstractContextManager[TextIO]]
+Renderer = Callable[[Opener, Interface, Iterable[ClientTuple]], None]
+
+
+def render_systemd(
+    open_file: Opener, interface: Interface, clients: Iterable[ClientTuple]
+) -> None:
+    with open_file(f"{interface.name}.netdev") as f:
+        write_networkd_netdev(f, interface, clients)
+    with open_file(f"{interface.name}.network") as f:
+        write_networkd_network(f, interface)
+
+
+def render_wgquick(
+    open_file: Opener, interface: Interface, clients: Iterable[ClientTuple]
+) -> None:
+    with open_file(f"{interface.name}.conf") as f:
+        write_wgquick_config(f, interface, clients)
+
+
+def render_interface(
+    render: Renderer,
+    path: Path,
+    pragmas: Mapping[str, str | int],
+    name: str,
+    output: Path,
+    mode: int,
+) -> list[StagedFile]:
+    """Render an interface in a worker process, from a snapshot of its own
+    connection to the database or partition at the path, to files staged
+    in the output directory"""
+    stager = FileStager(output, mode)
+    try:
+        with db_connection(path, readonly=True, pragmas=pragmas) as conn:
+            interface = Interface.load(conn, name)
+            clients = (
+                ClientTuple.from_row(row) for row in iter_client_rows(conn, name)
+            )
+            render(stager.open, interface, clients)
+    except BaseException:
+        stager.discard()
+        raise
+    return stager.staged
+
+
+def interface_sizes(conn: sqlite3.Connection) -> list[tuple[int, str, Path]]:
+    """Return the number of clients, name and database path of every
+    interface, largest first"""
+    result = []
+    for partition in iter_partitions(conn):
+        [path] = [
+            row["file"]
+            for row in partition.execute("PRAGMA database_list")
+            if row["name"] == "main"
+        ]
+        for name, count in partition.execute(
+            "SELECT name, (SELECT count(*) FROM clients WHERE interface = name) "
+            "FROM interfaces"
+        ):
+            result.append((count, name, Path(path)))
+    result.sort(key=lambda item: (-item[0], item[1]))
+    return result
+
+
+class RenderBaseParser(BaseParser):
+    readonly = True
+
+    jobs: int = Argument(
+        default=1,
+        help="Processes rendering interfaces concurrently, "
+        "each reading from its own database snapshot",
+    )
+
+    title = ""
+    manifest = ""
+    render = staticmethod(render_wgquick)
+
+    def render_all(self, conn: sqlite3.Connection, output: RenderOutput) -> None:
+        """Render every interface to the output"""
+        if self.jobs <= 1:
+            for interface, clients in load_interface_tuples(conn):
+                self.render(output.open, interface, clients)
+            return
+
+        pragmas = self.__parent__.__parent__.sqlite.pragmas()  # type: ignore[union-attr]
+        # Largest interfaces first, so the run takes about as long as the
+        # largest one when there are enough workers
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [
+                executor.submit(
+                    render_interface,
+                    self.render,
+                    path,
+                    pragmas,
+                    name,
+                    output.path,
+                    output.mode,
                 )
-                path.write_text(content)
-                path.chmod(0o640)
+                for _, name, path in interface_sizes(conn)
+            ]
+            for future in as_completed(futures):
+                for staged in future.result():
+                    output.add(staged)
+
+    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
+        output_path = self.output.resolve()  # type: ignore[attr-defined]
+        logging.info("Generating %s configuration to %s", self.title, output_path)
+
+        with RenderOutput(output_path, self.manifest) as output:
+            self.render_all(conn, output)
         return 0
 
 
-class WGQuickParser(BaseParser):
+class SystemdNetworkdParser(RenderBaseParser):
     output: Path = Argument(
-        "--output", "-o", default=Path("/etc/wireguard"), help="Output directory"
+        "--output", "-o", default=Path("/etc/systemd/network"), help="Output directory"
     )
 
-    def __call__(self, conn: sqlite3.Connection) -> int:  # type: ignore[override]
-        output_path = self.output.resolve()
-        logging.info("Generating wg-quick configuration to %s", output_path)
-
-        for interface in Interface.list(conn):
-            with StringIO() as f:
-                f.write("[Interface]\n")
-                f.write(f"ListenPort={interface.listen_port}\n")
-                f.write(f"PrivateKey={interface.private_key}\n")
-                f.write(f"MTU={interface.mtu}\n")
-                f.write(
-                    "Address={}\n".format(
-                        ",".join(
-                            map(str, filter(None, [interface.ipv4, interface.ipv6]))
-                        ),
-                    ),
-                )
-                f.write("\n")
-
-                for client in interface.clients(conn):
-                    f.write(f"# Client: {client.alias}\n")
-                    f.write("[Peer]\n")
-                    f.write(
-                        "AllowedIPs={}\n".format(
-                            ",".join(
-                                map(str, filter(None, [client.ipv4, client.ipv6]))
-                            ),
-                        ),
-                    )
-                    f.write(f"PublicKey={client.public_key}\n")
-                    f.write(f"PersistentKeepalive={interface.persistent_keepalive}\n")
-                    if client.preshared_key:
-                        f.write(f"PresharedKey={client.preshared_key}\n")
-
-                    f.write("\n")
-
-                config_content = f.getvalue()
-
-            config_path = output_path / f"{interface.name}.conf"
-            config_path.parent.mkdir(parents=True, exist_ok=True)
-            logging.info("Writing configuration to: %s", config_path)
-            config_path.write_text(config_content)
-            config_path.chmod(0o640)
+    title = "systemd-networkd"
+    manifest = ".wg-gen-systemd.json"
+    render = staticmethod(render_systemd)
 
-        return 0
+
+class WGQuickParser(RenderBaseParser):
+    output: Path = Argument(
+        "--output", "-o", default=Path("/etc/wireguard"), help="Output directory"
+    )
+
+    title = "wg-quick"
+    manifest = ".wg-gen-wgquick.json"
+    render = staticmethod(render_wgquick)
 
 
 class RenderParser(BaseParser):
+    readonly = True
+
     systemd = SystemdNetworkdParser()
     wgquick = WGQuickParser()
 
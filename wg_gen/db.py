@@ -1,16 +1,49 @@
+import base64
+import binascii
 import contextlib
+import copy
 import ipaddress
+import itertools
+import os
+import re
+import socket
 import sqlite3
-from dataclasses import dataclass, field
-from datetime import datetime
+import sys
+from collections import Counter, OrderedDict
+from concurrent.futures import Executor
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Iterator
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    TypeVar,
+    overload,
+)
 
-from .keygen import keygen, preshared_keygen
+from .keygen import (
+    derive_keygen_many,
+    keygen_executor,
+    keygen_many,
+    preshared_keygen,
+    preshared_keygen_many,
+)
 
 
-def init_db(conn: sqlite3.Connection):
-    cur = conn.cursor()
+# Keeps the number of bound parameters of ``IN (...)`` queries below the
+# SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds
+QUERY_CHUNK_SIZE = 500
+
+T = TypeVar("T")
+
+
+def migrate_initial(cur: sqlite3.Cursor) -> None:
+    """Create the tables, databases made before versioning already have them"""
     # interfaces table
     cur.execute(
         """
@@ -49,69 +82,1230 @@ def init_db(conn: sqlite3.Connection):
         )""",
     )
 
-    conn.commit()
+    # free client address offsets below interfaces.address_shift
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS free_addresses (
+            interface TEXT NOT NULL,
+            first INTEGER NOT NULL,
+            last INTEGER NOT NULL,
+            PRIMARY KEY (interface, first),
+            FOREIGN KEY (interface) REFERENCES interfaces(name)
+        ) WITHOUT ROWID""",
+    )
+
+
+def migrate_indexes(cur: sqlite3.Cursor) -> None:
+    """Index the client lookups and the per interface scans ordered by id"""
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS clients_interface_id ON clients(interface, id)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS clients_public_key ON clients(public_key)")
+    cur.execute("CREATE INDEX IF NOT EXISTS clients_ipv4 ON clients(ipv4)")
+    cur.execute("CREATE INDEX IF NOT EXISTS clients_ipv6 ON clients(ipv6)")
+
+
+def network_range(
+    address: ipaddress.IPv4Interface | ipaddress.IPv6Interface | tuple[Any, int],
+) -> tuple[int, bytes, bytes, int]:
+    """Return the ``(family, first, last, prefix)`` row of the
+    ``interface_networks`` table for an interface address"""
+    network = ipaddress.ip_interface(address).network
+    return (
+        network.version,
+        network.network_address.packed,
+        network.broadcast_address.packed,
+        network.prefixlen,
+    )
+
+
+def _parse_timestamp(value: str) -> int:
+    return int(datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp())
+
+
+def migrate_binary_storage(cur: sqlite3.Cursor) -> None:
+    """Store keys as raw bytes, addresses as integers (IPv4) or 16 byte blobs
+    (IPv6), timestamps as epoch seconds and move DNS servers and allowed IPs
+    of the interfaces into child tables."""
+    cur.execute(
+        """
+        CREATE TABLE interfaces_new (
+            name TEXT PRIMARY KEY NOT NULL,
+            created_at INTEGER NOT NULL,
+            ipv4 INTEGER DEFAULT NULL,
+            ipv4_prefix INTEGER DEFAULT NULL,
+            ipv6 BLOB DEFAULT NULL,
+            ipv6_prefix INTEGER DEFAULT NULL,
+            address_shift INTEGER NOT NULL DEFAULT 1,
+            private_key BLOB NOT NULL,
+            public_key BLOB NOT NULL,
+            mtu INTEGER NOT NULL,
+            listen_port INTEGER,
+            endpoint TEXT NOT NULL,
+            persistent_keepalive INTEGER NOT NULL
+        )
+        """,
+    )
+    cur.execute(
+        """
+        CREATE TABLE interface_dns (
+            interface TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            address BLOB NOT NULL,
+            PRIMARY KEY (interface, position),
+            FOREIGN KEY (interface) REFERENCES interfaces(name)
+        ) WITHOUT ROWID""",
+    )
+    cur.execute(
+        """
+        CREATE TABLE interface_allowed_ips (
+            interface TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            network BLOB NOT NULL,
+            prefix INTEGER NOT NULL,
+            PRIMARY KEY (interface, position),
+            FOREIGN KEY (interface) REFERENCES interfaces(name)
+        ) WITHOUT ROWID""",
+    )
+    cur.execute(
+        """
+        CREATE TABLE clients_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            interface TEXT NOT NULL,
+            alias TEXT NOT NULL,
+            public_key BLOB NOT NULL,
+            preshared_key BLOB DEFAULT NULL,
+            ipv4 INTEGER DEFAULT NULL,
+            ipv6 BLOB DEFAULT NULL,
+            created_at INTEGER NOT NULL,
+            FOREIGN KEY (interface) REFERENCES interfaces(name),
+            UNIQUE (interface, alias)
+        )""",
+    )
+
+    conn = cur.connection
+    dns = []
+    allowed_ips = []
+    interfaces = []
+    for (
+        name,
+        created_at,
+        ipv4,
+        ipv6,
+        address_shift,
+        private_key,
+        public_key,
+        mtu,
+        listen_port,
+        endpoint,
+        dns_list,
+        allowed_ips_list,
+        persistent_keepalive,
+    ) in conn.execute(
+        "SELECT name, created_at, ipv4, ipv6, address_shift, private_key, "
+        "public_key, mtu, listen_port, endpoint, dns, allowed_ips, "
+        "persistent_keepalive FROM interfaces"
+    ):
+        ipv4_iface = ipaddress.IPv4Interface(ipv4) if ipv4 else None
+        ipv6_iface = ipaddress.IPv6Interface(ipv6) if ipv6 else None
+        interfaces.append(
+            (
+                name,
+                _parse_timestamp(created_at),
+                int(ipv4_iface.ip) if ipv4_iface else None,
+                ipv4_iface.network.prefixlen if ipv4_iface else None,
+                ipv6_iface.ip.packed if ipv6_iface else None,
+                ipv6_iface.network.prefixlen if ipv6_iface else None,
+                address_shift,
+                base64.b64decode(private_key),
+                base64.b64decode(public_key),
+                mtu,
+                listen_port,
+                endpoint,
+                persistent_keepalive,
+            )
+        )
+        for position, address in enumerate(filter(None, dns_list.split(","))):
+            dns.append((name, position, ipaddress.ip_address(address).packed))
+        for position, network in enumerate(filter(None, allowed_ips_list.split(","))):
+            net = ipaddress.ip_network(network)
+            allowed_ips.append(
+                (name, position, net.network_address.packed, net.prefixlen)
+            )
+
+    cur.executemany(
+        "INSERT INTO interfaces_new VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        interfaces,
+    )
+    cur.executemany("INSERT INTO interface_dns VALUES (?, ?, ?)", dns)
+    cur.executemany(
+        "INSERT INTO interface_allowed_ips VALUES (?, ?, ?, ?)", allowed_ips
+    )
+    cur.executemany(
+        "INSERT INTO clients_new VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                id_,
+                interface,
+                alias,
+                base64.b64decode(public_key),
+                base64.b64decode(preshared_key) if preshared_key else None,
+                int(ipaddress.IPv4Address(ipv4)) if ipv4 else None,
+                ipaddress.IPv6Address(ipv6).packed if ipv6 else None,
+                _parse_timestamp(created_at),
+            )
+            for (
+                id_,
+                interface,
+                alias,
+                public_key,
+                preshared_key,
+                ipv4,
+                ipv6,
+                created_at,
+            ) in conn.execute(
+                "SELECT id, interface, alias, public_key, preshared_key, ipv4, "
+                "ipv6, created_at FROM clients"
+            )
+        ),
+    )
+
+    cur.execute("DROP TABLE clients")
+    cur.execute("DROP TABLE interfaces")
+    cur.execute("ALTER TABLE interfaces_new RENAME TO interfaces")
+    cur.execute("ALTER TABLE clients_new RENAME TO clients")
+    # Indexes went away with the old clients table
+    migrate_indexes(cur)
+
+
+def migrate_network_index(cur: sqlite3.Cursor) -> None:
+    """Index the interface subnets as address ranges for overlap checks"""
+    cur.execute(
+        """
+        CREATE TABLE interface_networks (
+            family INTEGER NOT NULL,
+            first BLOB NOT NULL,
+            last BLOB NOT NULL,
+            prefix INTEGER NOT NULL,
+            interface TEXT NOT NULL,
+            PRIMARY KEY (family, first),
+            FOREIGN KEY (interface) REFERENCES interfaces(name)
+        ) WITHOUT ROWID""",
+    )
+    cur.execute(
+        "CREATE INDEX interface_networks_interface ON interface_networks(interface)"
+    )
+
+    rows = []
+    for name, ipv4, ipv4_prefix, ipv6, ipv6_prefix in cur.connection.execute(
+        "SELECT name, ipv4, ipv4_prefix, ipv6, ipv6_prefix FROM interfaces"
+    ):
+        if ipv4 is not None:
+            rows.append((name, network_range((ipv4, ipv4_prefix))))
+        if ipv6 is not None:
+            rows.append((name, network_range((ipv6, ipv6_prefix))))
+    cur.executemany(
+        "INSERT INTO interface_networks(family, first, last, prefix, interface) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(*network, name) for name, network in rows],
+    )
+
+
+def migrate_change_journal(cur: sqlite3.Cursor) -> None:
+    """Add the per-interface revision and the change journal"""
+    cur.execute("ALTER TABLE interfaces ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    # AUTOINCREMENT keeps revisions monotonic after the journal is compacted
+    cur.execute(
+        """
+        CREATE TABLE changes (
+            revision INTEGER PRIMARY KEY AUTOINCREMENT,
+            interface TEXT NOT NULL,
+            alias TEXT,
+            removed INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL
+        )""",
+    )
+    cur.execute("CREATE INDEX changes_object ON changes(interface, alias, revision)")
+
+
+def migrate_alias_index(cur: sqlite3.Cursor) -> None:
+    """Index client aliases for lookups across interfaces"""
+    cur.execute("CREATE INDEX clients_alias ON clients(alias, interface)")
+
+
+def migrate_key_pool(cur: sqlite3.Cursor) -> None:
+    """Add the pool of pre-generated key pairs"""
+    cur.execute(
+        """
+        CREATE TABLE key_pool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            private_key BLOB NOT NULL,
+            public_key BLOB NOT NULL
+        )""",
+    )
+
+
+def migrate_key_derivation(cur: sqlite3.Cursor) -> None:
+    """Add the master seed client keys can be derived from and the key
+    counters of the interfaces and of the clients with derived keys"""
+    cur.execute("ALTER TABLE interfaces ADD COLUMN key_seed BLOB")
+    cur.execute(
+        "ALTER TABLE interfaces ADD COLUMN key_counter INTEGER NOT NULL DEFAULT 0"
+    )
+    cur.execute("ALTER TABLE clients ADD COLUMN key_counter INTEGER")
+
+
+def migrate_free_address_gaps(cur: sqlite3.Cursor) -> None:
+    """Rebuild the free address ranges from the gaps between the client
+    addresses, databases made before the allocator have none for the
+    clients removed back then"""
+    conn = cur.connection
+    cur.execute("DELETE FROM free_addresses")
+    interfaces = conn.execute(
+        "SELECT name, ipv4, ipv6, address_shift FROM interfaces"
+    ).fetchall()
+    for name, ipv4, ipv6, address_shift in interfaces:
+        offsets: set[int] = set()
+        if ipv4 is not None:
+            offsets.update(
+                address - ipv4
+                for (address,) in conn.execute(
+                    "SELECT ipv4 FROM clients WHERE interface = ? AND ipv4 IS NOT NULL",
+                    (name,),
+                )
+            )
+        if ipv6 is not None:
+            server = int.from_bytes(ipv6, "big")
+            offsets.update(
+                int.from_bytes(address, "big") - server
+                for (address,) in conn.execute(
+                    "SELECT ipv6 FROM clients WHERE interface = ? AND ipv6 IS NOT NULL",
+                    (name,),
+                )
+            )
+        if not offsets:
+            continue
+
+        gaps = []
+        previous = 0
+        for offset in sorted(offsets):
+            if not 0 < offset < address_shift:
+                continue
+            if offset > previous + 1:
+                gaps.append((name, previous + 1, offset - 1))
+            previous = offset
+        cur.executemany(
+            "INSERT INTO free_addresses(interface, first, last) VALUES (?, ?, ?)",
+            gaps,
+        )
+        # Offsets above the last client are folded back, as when released
+        cur.execute(
+            "UPDATE interfaces SET address_shift = ? WHERE name = ?",
+            (previous + 1, name),
+        )
+
+
+# Schema migrations, the database is at version N after the first N of them
+# were applied. Append new migrations, never change or reorder applied ones.
+MIGRATIONS: list[Callable[[sqlite3.Cursor], None]] = [
+    migrate_initial,
+    migrate_indexes,
+    migrate_binary_storage,
+    migrate_network_index,
+    migrate_change_journal,
+    migrate_alias_index,
+    migrate_key_pool,
+    migrate_key_derivation,
+    migrate_free_address_gaps,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db(conn: sqlite3.Connection) -> None:
+    """Bring the schema up to :data:`SCHEMA_VERSION`.
+
+    Runs inside the caller's transaction and does nothing when the schema
+    is current."""
+    version = schema_version(conn)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than "
+            f"the supported version {SCHEMA_VERSION}",
+        )
+
+    cur = conn.cursor()
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(cur)
+        cur.execute(f"PRAGMA user_version = {target:d}")
+
+
+# Rows fetched per query by the streaming iterators
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_interface_rows(
+    conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[list[sqlite3.Row]]:
+    """Yield batches of ``interfaces`` rows ordered by name.
+
+    Pages with keyset pagination on the name, no statement is kept open
+    between batches."""
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM interfaces ORDER BY name LIMIT ?", (batch_size,))
+    while rows := cur.fetchall():
+        yield rows
+        cur.execute(
+            "SELECT * FROM interfaces WHERE name > ? ORDER BY name LIMIT ?",
+            (rows[-1]["name"], batch_size),
+        )
+
+
+def iter_client_rows(
+    conn: sqlite3.Connection,
+    interface: str | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[sqlite3.Row]:
+    """Yield ``clients`` rows ordered by interface and id, or only the rows
+    of one interface ordered by id.
+
+    Fetches ``batch_size`` rows at a time with keyset pagination on
+    ``(interface, id)``, no statement is kept open between batches. Pages
+    within an interface seek on both columns of the index and the next
+    interface is looked up once the current one is done. A row value
+    comparison would only bound the ``interface`` column and rescan the
+    current interface from its first row for every page."""
+    cur = conn.cursor()
+    if interface is None:
+        cur.execute(
+            "SELECT * FROM clients ORDER BY interface, id LIMIT ?", (batch_size,)
+        )
+    else:
+        cur.execute(
+            "SELECT * FROM clients WHERE interface = ? ORDER BY id LIMIT ?",
+            (interface, batch_size),
+        )
+
+    rows = cur.fetchall()
+    while rows:
+        yield from rows
+        last = rows[-1]
+        cur.execute(
+            "SELECT * FROM clients WHERE interface = ? AND id > ? ORDER BY id LIMIT ?",
+            (last["interface"], last["id"], batch_size),
+        )
+        rows = cur.fetchall()
+        if not rows and interface is None:
+            # The interface is done, continue with the next one
+            cur.execute(
+                "SELECT * FROM clients WHERE interface > ? "
+                "ORDER BY interface, id LIMIT ?",
+                (last["interface"], batch_size),
+            )
+            rows = cur.fetchall()
+
+
+def _batched(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class OrderedGroups:
+    """Hands out rows ordered by ``interface`` one interface at a time,
+    interfaces must be requested in ascending order."""
+
+    def __init__(self, rows: Iterable[sqlite3.Row]):
+        self.rows = iter(rows)
+        self.pending = next(self.rows, None)
+
+    def take(self, interface: str) -> Iterator[sqlite3.Row]:
+        """Lazily yield the rows of the interface, rows which were not
+        consumed before the next interface is requested are skipped."""
+        # Rows sorting before the requested interface belong to interfaces
+        # which were not requested or no longer exist, skip them.
+        while self.pending is not None and self.pending["interface"] <= interface:
+            row = self.pending
+            self.pending = next(self.rows, None)
+            if row["interface"] == interface:
+                yield row
+
+
+class InterfaceCache:
+    """LRU cache of loaded interfaces for a single connection.
+
+    Entries are fully decoded once and handed out as copies. The cache is
+    dropped whenever ``PRAGMA data_version`` reports a commit made by another
+    connection, changes made through :class:`Interface` methods on the
+    owning connection are written through."""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.data_version: int | None = None
+        self.entries: OrderedDict[str, "Interface"] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, conn: sqlite3.Connection, name: str) -> "Interface | None":
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            self.entries.clear()
+            self.data_version = data_version
+        interface = self.entries.get(name)
+        if interface is None:
+            return None
+        self.entries.move_to_end(name)
+        return copy.copy(interface)
+
+    def put(self, interface: "Interface") -> None:
+        interface = copy.copy(interface)
+        for name in interface.FIELDS:
+            # Decode everything once instead of in every returned copy
+            getattr(interface, name)
+        self.entries[interface.name] = interface
+        self.entries.move_to_end(interface.name)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def discard(self, name: str) -> None:
+        self.entries.pop(name, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def set_revision(self, name: str, revision: int) -> None:
+        interface = self.entries.get(name)
+        if interface is not None:
+            interface.revision = revision
+
+
+class Connection(sqlite3.Connection):
+    """Connection which can carry an :class:`InterfaceCache`.
+
+    Rolling back drops the cache, it may hold uncommitted changes."""
+
+    interface_cache: InterfaceCache | None = None
+    # Set on the catalog connection of a partitioned layout
+    partitions: "Partitions | None" = None
+
+    def rollback(self) -> None:
+        super().rollback()
+        if self.interface_cache is not None:
+            self.interface_cache.clear()
+
+
+def interface_cache(conn: sqlite3.Connection) -> InterfaceCache | None:
+    """Return the interface cache of the connection, if it has one"""
+    return getattr(conn, "interface_cache", None)
+
+
+DEFAULT_PRAGMAS: Mapping[str, str | int] = {
+    "busy_timeout": 5000,
+    "journal_mode": "wal",
+    "synchronous": "normal",
+}
 
 
 @contextlib.contextmanager
-def db_connection(db_path: Path):
-    conn = sqlite3.connect(str(db_path))
+def db_connection(
+    db_path: Path,
+    readonly: bool = False,
+    pragmas: Mapping[str, str | int] = DEFAULT_PRAGMAS,
+    cache_size: int = 0,
+    catalog: Path | None = None,
+    catalog_readonly: bool = True,
+) -> Iterator[sqlite3.Connection]:
+    """Open the database, migrate it if needed and run a transaction.
+
+    Writers take the write lock up front with ``BEGIN IMMEDIATE``, readonly
+    connections use a deferred transaction and ``query_only``, so in WAL
+    mode they never wait for writers nor block them.
+
+    A positive ``cache_size`` attaches an :class:`InterfaceCache` of that
+    many entries to the connection. ``catalog`` is attached as the
+    ``catalog`` schema, a read-only catalog takes no write lock."""
+    conn = sqlite3.connect(
+        str(db_path), isolation_level=None, factory=Connection, uri=True
+    )
     conn.row_factory = sqlite3.Row
-    conn.execute("BEGIN IMMEDIATE TRANSACTION")
+    if cache_size > 0:
+        conn.interface_cache = InterfaceCache(cache_size)
+    try:
+        if schema_version(conn) == 0:
+            # Only takes effect on a new database before the journal mode
+            # is set, outside of transactions
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        for name, value in pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}").fetchall()
+
+        if schema_version(conn) != SCHEMA_VERSION:
+            conn.execute("BEGIN IMMEDIATE TRANSACTION")
+            init_db(conn)
+            conn.commit()
+
+        if catalog is not None:
+            mode = "ro" if catalog_readonly else "rw"
+            conn.execute(
+                "ATTACH DATABASE ? AS catalog",
+                (f"{catalog.absolute().as_uri()}?mode={mode}",),
+            )
+
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+            conn.execute("BEGIN DEFERRED TRANSACTION")
+        else:
+            conn.execute("BEGIN IMMEDIATE TRANSACTION")
+
+        try:
+            yield conn
+        except:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+    finally:
+        conn.close()
+
+
+# The database file and the files SQLite keeps next to it
+PARTITION_FILE_SUFFIXES = ("", "-wal", "-shm", "-journal")
+
+
+class Partitions:
+    """Partitioned layout, a catalog database and one database per interface.
+
+    Every interface lives in its own file, so writers of different
+    interfaces never wait for each other and the keys of an interface are
+    kept apart from the others. The catalog holds the ``interface_networks``
+    of all interfaces for the overlap checks and is attached read-only
+    unless the networks change."""
+
+    def __init__(
+        self, catalog_path: Path, pragmas: Mapping[str, str | int] = DEFAULT_PRAGMAS
+    ):
+        self.catalog_path = catalog_path
+        self.directory = catalog_path.parent / f"{catalog_path.stem}.partitions"
+        self.pragmas = pragmas
+
+    def path(self, interface: str) -> Path:
+        if not interface or interface.startswith(".") or "/" in interface:
+            raise ValueError(f"Invalid interface name {interface!r}")
+        return self.directory / f"{interface}.sqlite3"
+
+    def exists(self, interface: str) -> bool:
+        return self.path(interface).exists()
+
+    def names(self) -> list[str]:
+        """Names of the partitioned interfaces in order"""
+        return sorted(path.stem for path in self.directory.glob("*.sqlite3"))
+
+    @contextlib.contextmanager
+    def catalog(self, readonly: bool = True) -> Iterator[sqlite3.Connection]:
+        """Connect to the catalog, :func:`iter_partitions` of this connection
+        visits every partition"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with db_connection(
+            self.catalog_path, readonly=readonly, pragmas=self.pragmas
+        ) as conn:
+            conn.partitions = self  # type: ignore[attr-defined]
+            yield conn
+
+    @contextlib.contextmanager
+    def connect(
+        self,
+        interface: str,
+        readonly: bool = False,
+        catalog_readonly: bool | None = True,
+        drop_empty: bool = False,
+    ) -> Iterator[sqlite3.Connection]:
+        """Connect to the partition of the interface, with the catalog
+        attached unless ``catalog_readonly`` is ``None``. With ``drop_empty``
+        the partition is deleted afterwards when it holds no interface, as
+        after a removal or a failed add."""
+        path = self.path(interface)
+        if catalog_readonly is not None:
+            # Creates and migrates the catalog before it is attached
+            with self.catalog():
+                pass
+
+        try:
+            while True:
+                # drop_if_empty() of another process may delete the file
+                # this one opened before the catalog write lock was taken,
+                # catalog writers reconnect when the file is not the one
+                # at the path anymore once they hold the lock
+                fd = None
+                if catalog_readonly is False:
+                    fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0o600)
+                try:
+                    with db_connection(
+                        path,
+                        readonly=readonly,
+                        pragmas=self.pragmas,
+                        catalog=None if catalog_readonly is None else self.catalog_path,
+                        catalog_readonly=catalog_readonly is not False,
+                    ) as conn:
+                        if fd is None or _is_file_at(fd, path):
+                            conn.partition_of = (self, interface)  # type: ignore[attr-defined]
+                            yield conn
+                            return
+                finally:
+                    if fd is not None:
+                        os.close(fd)
+        finally:
+            if drop_empty:
+                self.drop_if_empty(interface)
+
+    def drop_if_empty(self, interface: str) -> bool:
+        """Delete the partition of the interface, with its WAL and shared
+        memory files, when it holds no interface. The key pool and the free
+        pages that held the keys of the interface go with it.
+
+        Runs under the catalog write lock, which every writer adding an
+        interface holds as well, so none of them writes the file meanwhile."""
+        path = self.path(interface)
+        timeout = int(self.pragmas.get("busy_timeout", 5000)) / 1000
+        catalog = sqlite3.connect(
+            f"{self.catalog_path.absolute().as_uri()}?mode=rw",
+            timeout=timeout,
+            isolation_level=None,
+            uri=True,
+        )
+        try:
+            catalog.execute("BEGIN IMMEDIATE")
+            if not path.exists():
+                return False
+            conn = sqlite3.connect(path, timeout=timeout)
+            try:
+                empty = not conn.execute("SELECT 1 FROM interfaces LIMIT 1").fetchone()
+            except sqlite3.OperationalError:
+                # Not even migrated
+                empty = True
+            finally:
+                conn.close()
+            if empty:
+                for suffix in PARTITION_FILE_SUFFIXES:
+                    Path(f"{path}{suffix}").unlink(missing_ok=True)
+            return empty
+        finally:
+            catalog.close()
+
+
+def _is_file_at(fd: int, path: Path) -> bool:
     try:
+        return os.path.samestat(os.fstat(fd), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def iter_partitions(
+    conn: sqlite3.Connection, readonly: bool = True
+) -> Iterator[sqlite3.Connection]:
+    """Yield the connection itself or, for the catalog of a partitioned
+    layout, a connection to every partition in turn"""
+    partitions: Partitions | None = getattr(conn, "partitions", None)
+    if partitions is None:
         yield conn
-    except:
+        return
+    for name in partitions.names():
+        with partitions.connect(
+            name, readonly=readonly, catalog_readonly=None
+        ) as partition:
+            yield partition
+
+
+def catalog_attached(conn: sqlite3.Connection) -> bool:
+    return any(row[1] == "catalog" for row in conn.execute("PRAGMA database_list"))
+
+
+class Change(NamedTuple):
+    """Row of the change journal, ``alias`` is ``None`` for changes of the
+    interface itself"""
+
+    revision: int
+    interface: str
+    alias: str | None
+    removed: bool
+    created_at: datetime
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Change":
+        return cls(
+            row["revision"],
+            row["interface"],
+            row["alias"],
+            bool(row["removed"]),
+            datetime.fromtimestamp(row["created_at"]),
+        )
+
+
+def current_revision(conn: sqlite3.Connection) -> int:
+    """Return the revision of the latest change, 0 when nothing has changed"""
+    row = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'changes'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def record_changes(
+    conn: sqlite3.Connection, changes: Iterable[tuple[str, str | None, bool]]
+) -> int:
+    """Append ``(interface, alias, removed)`` rows to the change journal and
+    bump the revision of the touched interfaces. Returns the new revision."""
+    now = int(datetime.now().timestamp())
+    rows = [(interface, alias, removed, now) for interface, alias, removed in changes]
+    if not rows:
+        return current_revision(conn)
+
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO changes(interface, alias, removed, created_at) VALUES (?, ?, ?, ?)",
+        rows,
+    )
+    revision = current_revision(conn)
+    names = sorted({row[0] for row in rows})
+    cur.executemany(
+        "UPDATE interfaces SET revision = ? WHERE name = ?",
+        [(revision, name) for name in names],
+    )
+
+    cache = interface_cache(conn)
+    if cache is not None:
+        for name in names:
+            cache.set_revision(name, revision)
+    return revision
+
+
+def changes_since(
+    conn: sqlite3.Connection,
+    revision: int = 0,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[Change]:
+    """Stream the journal entries newer than ``revision`` in order"""
+    while True:
+        rows = conn.execute(
+            "SELECT * FROM changes WHERE revision > ? ORDER BY revision LIMIT ?",
+            (revision, batch_size),
+        ).fetchall()
+        for row in rows:
+            yield Change.from_row(row)
+        if len(rows) < batch_size:
+            return
+        revision = rows[-1]["revision"]
+
+
+def compact_changes(conn: sqlite3.Connection, before: int | None = None) -> int:
+    """Drop superseded journal entries and return how many were removed.
+
+    Only the latest entry is kept for every interface and client, and the
+    entries of a removed interface are dropped up to its removal. With
+    ``before`` the entries up to that revision are dropped entirely, for
+    when every reader has caught up with it."""
+    cur = conn.cursor()
+    removed = 0
+    if before is not None:
+        cur.execute("DELETE FROM changes WHERE revision <= ?", (before,))
+        removed += cur.rowcount
+    cur.execute(
+        """
+        DELETE FROM changes WHERE revision NOT IN (
+            SELECT max(revision) FROM changes GROUP BY interface, alias
+        )
+        """,
+    )
+    removed += cur.rowcount
+    cur.execute(
+        """
+        DELETE FROM changes WHERE revision < (
+            SELECT max(latest.revision) FROM changes AS latest
+            WHERE latest.interface = changes.interface
+                AND latest.alias IS NULL
+                AND latest.removed
+        )
+        """,
+    )
+    removed += cur.rowcount
+    return removed
+
+
+def key_pool_size(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT count(*) FROM key_pool").fetchone()[0]
+
+
+def take_keys(
+    conn: sqlite3.Connection,
+    count: int,
+    workers: int | None = None,
+    executor: Executor | None = None,
+) -> list[tuple[str, str]]:
+    """Take ``count`` key pairs from the pool, oldest first, and generate
+    the ones the pool is short of.
+
+    Runs in the caller's write transaction, so no other writer can take
+    the same keys between the select and the delete."""
+    cur = conn.cursor()
+    rows = cur.execute(
+        "SELECT id, private_key, public_key FROM key_pool ORDER BY id LIMIT ?",
+        (count,),
+    ).fetchall()
+    if rows:
+        # Private keys of taken pairs must not linger in free pages
+        secure_delete = cur.execute("PRAGMA secure_delete").fetchone()[0]
+        cur.execute("PRAGMA secure_delete = ON")
+        try:
+            # The lowest ids were taken, so they are all up to the last one
+            cur.execute("DELETE FROM key_pool WHERE id <= ?", (rows[-1]["id"],))
+        finally:
+            cur.execute(f"PRAGMA secure_delete = {secure_delete:d}")
+    keys = [(_encode_key(row[1]), _encode_key(row[2])) for row in rows]
+    if len(keys) < count:
+        keys.extend(keygen_many(count - len(keys), workers, executor))
+    return keys
+
+
+# Canonical base64 of 32 bytes, the last character only carries 4 bits
+PUBLIC_KEY = r"[A-Za-z0-9+/]{42}[AEIMQUYcgkosw048]="
+PUBLIC_KEY_PATTERN = re.compile(PUBLIC_KEY)
+PUBLIC_KEYS_PATTERN = re.compile(f"(?:{PUBLIC_KEY}\n)*")
+
+
+def validate_public_keys(keys: Sequence[str]) -> None:
+    """Check the format and length of many base64 keys in a single regular
+    expression pass, raises :class:`ValueError` naming the first bad key"""
+    joined = "".join(f"{key}\n" for key in keys)
+    # A key with a line break of its own would match as several lines
+    if joined.count("\n") == len(keys) and PUBLIC_KEYS_PATTERN.fullmatch(joined):
+        return
+    for key in keys:
+        if not PUBLIC_KEY_PATTERN.fullmatch(key):
+            raise ValueError(f"Invalid public key {key!r}")
+
+
+def public_keys_in_use(conn: sqlite3.Connection, keys: Iterable[str]) -> set[str]:
+    """Return which of the public keys belong to existing clients, looked up
+    through the ``clients_public_key`` index.
+
+    On a partition the other partitions are looked up as well, so keys are
+    unique across interfaces in both layouts. Adds to different partitions
+    do not share a lock, two of them racing with the same key both pass."""
+    raw = [base64.b64decode(key) for key in keys]
+    result = _public_keys_in(conn, raw)
+    partition_of: tuple[Partitions, str] | None = getattr(conn, "partition_of", None)
+    if partition_of is not None:
+        partitions, interface = partition_of
+        for name in partitions.names():
+            if name == interface:
+                continue
+            with partitions.connect(
+                name, readonly=True, catalog_readonly=None
+            ) as partition:
+                result |= _public_keys_in(partition, raw)
+    return result
+
+
+def _public_keys_in(conn: sqlite3.Connection, raw: Sequence[bytes]) -> set[str]:
+    result: set[str] = set()
+    cur = conn.cursor()
+    for idx in range(0, len(raw), QUERY_CHUNK_SIZE):
+        chunk = raw[idx : idx + QUERY_CHUNK_SIZE]
+        cur.execute(
+            "SELECT DISTINCT public_key FROM clients "
+            f"WHERE public_key IN ({', '.join('?' * len(chunk))})",
+            chunk,
+        )
+        result.update(_encode_key(row[0]) for row in cur)
+    return result
+
+
+def check_public_keys(conn: sqlite3.Connection, keys: Sequence[str]) -> None:
+    """Validate client supplied public keys and check that they are unique
+    in the input and in the database"""
+    validate_public_keys(keys)
+    counts = Counter(keys)
+    duplicates = sorted(key for key, count in counts.items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Duplicate public keys: {', '.join(duplicates)}")
+    in_use = public_keys_in_use(conn, keys)
+    if in_use:
+        raise ValueError(f"Public keys already in use: {', '.join(sorted(in_use))}")
+
+
+def refill_key_pool(
+    conn: sqlite3.Connection, size: int, workers: int | None = None
+) -> int:
+    """Fill the key pool up to ``size`` key pairs, returns how many were added.
+
+    The keys are generated outside of a transaction and inserted in a short
+    write transaction of their own, the pending transaction of the
+    connection is committed first."""
+    if conn.in_transaction:
+        conn.commit()
+    missing = size - key_pool_size(conn)
+    if missing <= 0:
+        return 0
+    keys = keygen_many(missing, workers)
+
+    conn.execute("BEGIN IMMEDIATE TRANSACTION")
+    try:
+        # Another process may have refilled the pool meanwhile
+        missing = size - key_pool_size(conn)
+        conn.executemany(
+            "INSERT INTO key_pool(private_key, public_key) VALUES (?, ?)",
+            [
+                (base64.b64decode(private), base64.b64decode(public))
+                for private, public in keys[: max(missing, 0)]
+            ],
+        )
+    except BaseException:
         conn.rollback()
         raise
-    else:
-        conn.commit()
-    finally:
-        conn.close()
+    conn.commit()
+    return max(missing, 0)
 
 
-@dataclass(frozen=False)
-class Interface:
-    name: str
-    ipv4: ipaddress.IPv4Interface | None
-    ipv6: ipaddress.IPv6Interface | None
-    private_key: str
-    public_key: str
-    mtu: int
-    listen_port: int
-    endpoint: str
-    dns: list[ipaddress.IPv4Address | ipaddress.IPv6Address]
-    allowed_ips: list[ipaddress.IPv4Network | ipaddress.IPv6Network] = field(
-        default_factory=list
+class lazy(Generic[T]):
+    """Like :class:`functools.cached_property` for classes with ``__slots__``.
+
+    The wrapped method decodes the value from the raw database row on first
+    access, the result is kept in the ``_<name>`` slot. Assigning stores the
+    value in the slot directly."""
+
+    def __init__(self, decode: Callable[[Any], T]):
+        self.decode = decode
+        self.__doc__ = decode.__doc__
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.slot = f"_{name}"
+
+    @overload
+    def __get__(self, instance: None, owner: type | None = None) -> "lazy[T]": ...
+
+    @overload
+    def __get__(self, instance: object, owner: type | None = None) -> T: ...
+
+    def __get__(self, instance: object | None, owner: type | None = None) -> Any:
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            value = self.decode(instance)
+            setattr(instance, self.slot, value)
+            return value
+
+    def __set__(self, instance: object, value: T) -> None:
+        setattr(instance, self.slot, value)
+
+
+class Record:
+    """Base of the slotted record types, compares and prints by ``FIELDS``"""
+
+    __slots__ = ()
+    FIELDS: tuple[str, ...] = ()
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{type(self).__name__}({values})"
+
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.FIELDS)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __copy__(self) -> "Record":
+        result = type(self).__new__(type(self))
+        slots: tuple[str, ...] = type(self).__slots__
+        for slot in slots:
+            try:
+                value = getattr(self, slot)
+            except AttributeError:
+                continue
+            setattr(result, slot, value.copy() if isinstance(value, list) else value)
+        return result
+
+
+def _encode_key(value: bytes) -> str:
+    return binascii.b2a_base64(value, newline=False).decode()
+
+
+class Interface(Record):
+    """WireGuard interface, the fields of loaded interfaces are decoded from
+    the database row on first access"""
+
+    __slots__ = (
+        "name",
+        "mtu",
+        "listen_port",
+        "endpoint",
+        "address_shift",
+        "persistent_keepalive",
+        "key_seed",
+        "key_counter",
+        "revision",
+        "_row",
+        "_dns_rows",
+        "_allowed_ips_rows",
+        "_ipv4",
+        "_ipv6",
+        "_private_key",
+        "_public_key",
+        "_dns",
+        "_allowed_ips",
+        "_created_at",
+    )
+    FIELDS = (
+        "name",
+        "ipv4",
+        "ipv6",
+        "private_key",
+        "public_key",
+        "mtu",
+        "listen_port",
+        "endpoint",
+        "dns",
+        "allowed_ips",
+        "address_shift",
+        "persistent_keepalive",
+        "key_seed",
+        "key_counter",
+        "created_at",
     )
-    address_shift: int = 1
-    persistent_keepalive: int = 15
-    created_at: datetime = field(default_factory=datetime.now)
+
+    _row: sqlite3.Row
+    _dns_rows: list[sqlite3.Row]
+    _allowed_ips_rows: list[sqlite3.Row]
+
+    def __init__(
+        self,
+        name: str,
+        ipv4: ipaddress.IPv4Interface | None,
+        ipv6: ipaddress.IPv6Interface | None,
+        private_key: str,
+        public_key: str,
+        mtu: int,
+        listen_port: int,
+        endpoint: str,
+        dns: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+        allowed_ips: list[ipaddress.IPv4Network | ipaddress.IPv6Network] | None = None,
+        address_shift: int = 1,
+        persistent_keepalive: int = 15,
+        created_at: datetime | None = None,
+        key_seed: bytes | None = None,
+        key_counter: int = 0,
+    ):
+        self.name = name
+        self.ipv4 = ipv4
+        self.ipv6 = ipv6
+        self.private_key = private_key
+        self.public_key = public_key
+        self.mtu = mtu
+        self.listen_port = listen_port
+        self.endpoint = endpoint
+        self.dns = dns
+        self.allowed_ips = [] if allowed_ips is None else allowed_ips
+        self.address_shift = address_shift
+        self.persistent_keepalive = persistent_keepalive
+        self.created_at = datetime.now() if created_at is None else created_at
+        self.key_seed = key_seed
+        self.key_counter = key_counter
+        self.revision = 0
+
+    @lazy
+    def ipv4(self) -> ipaddress.IPv4Interface | None:
+        if self._row["ipv4"] is None:
+            return None
+        return ipaddress.IPv4Interface((self._row["ipv4"], self._row["ipv4_prefix"]))
+
+    @lazy
+    def ipv6(self) -> ipaddress.IPv6Interface | None:
+        if self._row["ipv6"] is None:
+            return None
+        return ipaddress.IPv6Interface((self._row["ipv6"], self._row["ipv6_prefix"]))
+
+    @lazy
+    def private_key(self) -> str:
+        return _encode_key(self._row["private_key"])
+
+    @lazy
+    def public_key(self) -> str:
+        return _encode_key(self._row["public_key"])
+
+    @lazy
+    def dns(self) -> list[ipaddress.IPv4Address | ipaddress.IPv6Address]:
+        return [ipaddress.ip_address(row["address"]) for row in self._dns_rows]
+
+    @lazy
+    def allowed_ips(self) -> list[ipaddress.IPv4Network | ipaddress.IPv6Network]:
+        return [
+            ipaddress.ip_network((row["network"], row["prefix"]))
+            for row in self._allowed_ips_rows
+        ]
+
+    @lazy
+    def created_at(self) -> datetime:
+        return datetime.fromtimestamp(self._row["created_at"])
 
     @classmethod
     def load(cls, conn: sqlite3.Connection, interface_name: str) -> "Interface":
-        """Load an interface from the database"""
+        """Load an interface from the database, or from the interface cache
+        of the connection"""
+        cache = interface_cache(conn)
+        if cache is not None:
+            cached = cache.get(conn, interface_name)
+            if cached is not None:
+                return cached
+
         cur = conn.cursor()
         cur.execute("SELECT * FROM interfaces WHERE name = ?", (interface_name,))
         result = cur.fetchone()
         if not result:
             raise LookupError("Interface not found")
-
-        return cls(
-            name=result["name"],
-            created_at=datetime.strptime(result["created_at"], "%Y-%m-%d %H:%M:%S"),
-            ipv4=ipaddress.IPv4Interface(result["ipv4"]) if result["ipv4"] else None,
-            ipv6=ipaddress.IPv6Interface(result["ipv6"]) if result["ipv6"] else None,
-            address_shift=result["address_shift"],
-            private_key=result["private_key"],
-            public_key=result["public_key"],
-            mtu=result["mtu"],
-            listen_port=result["listen_port"],
-            endpoint=result["endpoint"],
-            dns=list(map(ipaddress.ip_address, result["dns"].split(","))),
-            allowed_ips=list(
-                map(ipaddress.ip_network, result["allowed_ips"].split(","))
-            ),
-            persistent_keepalive=result["persistent_keepalive"],
+        cur.execute(
+            "SELECT address FROM interface_dns WHERE interface = ? ORDER BY position",
+            (interface_name,),
+        )
+        dns = cur.fetchall()
+        cur.execute(
+            "SELECT network, prefix FROM interface_allowed_ips "
+            "WHERE interface = ? ORDER BY position",
+            (interface_name,),
         )
+        interface = cls.from_row(result, dns, cur.fetchall())
+        if cache is not None:
+            cache.put(interface)
+        return interface
+
+    @classmethod
+    def from_row(
+        cls,
+        result: sqlite3.Row,
+        dns: Iterable[sqlite3.Row],
+        allowed_ips: Iterable[sqlite3.Row],
+    ) -> "Interface":
+        """Build an interface from a row of the ``interfaces`` table and its
+        rows of the ``interface_dns`` and ``interface_allowed_ips`` tables"""
+        interface = cls.__new__(cls)
+        interface.name = result["name"]
+        interface.mtu = result["mtu"]
+        interface.listen_port = result["listen_port"]
+        interface.endpoint = result["endpoint"]
+        interface.address_shift = result["address_shift"]
+        interface.persistent_keepalive = result["persistent_keepalive"]
+        interface.key_seed = result["key_seed"]
+        interface.key_counter = result["key_counter"]
+        interface.revision = result["revision"]
+        interface._row = result
+        interface._dns_rows = list(dns)
+        interface._allowed_ips_rows = list(allowed_ips)
+        return interface
 
     def check_address_space(self) -> None:
         """Check that server address is in the network and there is room
@@ -131,33 +1325,57 @@ class Interface:
                     f"for client addresses (server address {self.ipv6.ip})",
                 )
 
+    def networks(self) -> list[tuple[int, bytes, bytes, int]]:
+        """Return the rows of the ``interface_networks`` table"""
+        networks = []
+        if self.ipv4:
+            networks.append(network_range(self.ipv4))
+        if self.ipv6:
+            networks.append(network_range(self.ipv6))
+        return networks
+
     def check_ip_conflicts(self, conn: sqlite3.Connection) -> None:
-        """Check that IPv4/IPv6 subnets don't overlap with other interfaces"""
+        """Check that IPv4/IPv6 subnets don't overlap with other interfaces.
+
+        Subnets of the other interfaces never overlap each other, so of
+        the ranges starting at or below the end of a subnet only the
+        highest one can reach into it. That one is found through the
+        ``interface_networks`` primary key, of the catalog when attached."""
+        table = "interface_networks"
+        if catalog_attached(conn):
+            table = "catalog.interface_networks"
         cur = conn.cursor()
-        cur.execute(
-            "SELECT name, ipv4, ipv6 FROM interfaces WHERE name != ?",
-            (self.name,),
-        )
-        for row in cur.fetchall():
-            if self.ipv4 and row["ipv4"]:
-                existing_v4 = ipaddress.IPv4Interface(row["ipv4"])
-                if self.ipv4.network.overlaps(existing_v4.network):
-                    raise ValueError(
-                        f"IPv4 subnet {self.ipv4.network} overlaps with "
-                        f"interface '{row['name']}' ({existing_v4.network})",
-                    )
-            if self.ipv6 and row["ipv6"]:
-                existing_v6 = ipaddress.IPv6Interface(row["ipv6"])
-                if self.ipv6.network.overlaps(existing_v6.network):
-                    raise ValueError(
-                        f"IPv6 subnet {self.ipv6.network} overlaps with "
-                        f"interface '{row['name']}' ({existing_v6.network})",
-                    )
+        for family, first, last, prefix in self.networks():
+            cur.execute(
+                f"SELECT interface, first, last, prefix FROM {table} "
+                "WHERE family = ? AND first <= ? AND interface != ? "
+                "ORDER BY first DESC LIMIT 1",
+                (family, last, self.name),
+            )
+            row = cur.fetchone()
+            if row is None or row["last"] < first:
+                continue
+            network = ipaddress.ip_network((first, prefix))
+            existing = ipaddress.ip_network((row["first"], row["prefix"]))
+            raise ValueError(
+                f"IPv{family} subnet {network} overlaps with "
+                f"interface '{row['interface']}' ({existing})",
+            )
 
     def save(self, conn: sqlite3.Connection) -> None:
         """Save the interface to the database"""
         self.check_address_space()
-        self.check_ip_conflicts(conn)
+
+        networks = self.networks()
+        stored = conn.execute(
+            "SELECT family, first, last, prefix FROM interface_networks "
+            "WHERE interface = ? ORDER BY family",
+            (self.name,),
+        ).fetchall()
+        networks_changed = [tuple(row) for row in stored] != networks
+        if networks_changed:
+            self.check_ip_conflicts(conn)
+
         cur = conn.cursor()
         cur.execute(
             """
@@ -165,85 +1383,336 @@ class Interface:
                 name,
                 created_at,
                 ipv4,
+                ipv4_prefix,
                 ipv6,
+                ipv6_prefix,
                 address_shift,
                 private_key,
                 public_key,
                 mtu,
                 listen_port,
                 endpoint,
-                dns,
-                allowed_ips,
-                persistent_keepalive
+                persistent_keepalive,
+                key_seed,
+                key_counter
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO UPDATE
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO UPDATE
             SET created_at = excluded.created_at,
                 ipv4 = excluded.ipv4,
+                ipv4_prefix = excluded.ipv4_prefix,
                 ipv6 = excluded.ipv6,
+                ipv6_prefix = excluded.ipv6_prefix,
                 address_shift = excluded.address_shift,
                 private_key = excluded.private_key,
                 public_key = excluded.public_key,
                 mtu = excluded.mtu,
                 listen_port = excluded.listen_port,
                 endpoint = excluded.endpoint,
-                dns = excluded.dns,
-                allowed_ips = excluded.allowed_ips,
-                persistent_keepalive = excluded.persistent_keepalive
+                persistent_keepalive = excluded.persistent_keepalive,
+                key_seed = excluded.key_seed,
+                key_counter = excluded.key_counter
             """,
             (
                 self.name,
-                self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                str(self.ipv4) if self.ipv4 else None,
-                str(self.ipv6) if self.ipv6 else None,
+                int(self.created_at.timestamp()),
+                int(self.ipv4.ip) if self.ipv4 else None,
+                self.ipv4.network.prefixlen if self.ipv4 else None,
+                self.ipv6.ip.packed if self.ipv6 else None,
+                self.ipv6.network.prefixlen if self.ipv6 else None,
                 self.address_shift,
-                self.private_key,
-                self.public_key,
+                base64.b64decode(self.private_key),
+                base64.b64decode(self.public_key),
                 self.mtu,
                 self.listen_port,
                 self.endpoint,
-                ",".join(map(str, self.dns)),
-                ",".join(map(str, self.allowed_ips)),
                 self.persistent_keepalive,
+                self.key_seed,
+                self.key_counter,
             ),
         )
+        cur.execute("DELETE FROM interface_dns WHERE interface = ?", (self.name,))
+        cur.executemany(
+            "INSERT INTO interface_dns(interface, position, address) VALUES (?, ?, ?)",
+            [
+                (self.name, position, ipaddress.ip_address(address).packed)
+                for position, address in enumerate(self.dns)
+            ],
+        )
+        cur.execute(
+            "DELETE FROM interface_allowed_ips WHERE interface = ?", (self.name,)
+        )
+        cur.executemany(
+            "INSERT INTO interface_allowed_ips(interface, position, network, prefix) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (
+                    self.name,
+                    position,
+                    network.network_address.packed,
+                    network.prefixlen,
+                )
+                for position, network in enumerate(self.allowed_ips)
+            ],
+        )
+
+        if networks_changed:
+            schemas = ["main", "catalog"] if catalog_attached(conn) else ["main"]
+            for schema in schemas:
+                cur.execute(
+                    f"DELETE FROM {schema}.interface_networks WHERE interface = ?",
+                    (self.name,),
+                )
+                cur.executemany(
+                    f"INSERT INTO {schema}.interface_networks"
+                    "(family, first, last, prefix, interface) VALUES (?, ?, ?, ?, ?)",
+                    [(*network, self.name) for network in networks],
+                )
+
+        self.revision = record_changes(conn, [(self.name, None, False)])
+        self.update_cache(conn)
+
+    def update_cache(self, conn: sqlite3.Connection) -> None:
+        """Write the interface through to the cache of the connection"""
+        cache = interface_cache(conn)
+        if cache is not None:
+            cache.put(self)
 
-    def generate_client_ipv4(self) -> ipaddress.IPv4Interface | None:
+    def generate_client_ipv4(
+        self, shift: int | None = None
+    ) -> ipaddress.IPv4Interface | None:
         if not self.ipv4:
             return None
-        result = self.ipv4 + self.address_shift
+        result = self.ipv4 + (self.address_shift if shift is None else shift)
         if result.ip not in self.ipv4.network:
             raise ValueError(
                 f"IPv4 address pool exhausted for {self.ipv4.network}",
             )
         return result
 
-    def generate_client_ipv6(self) -> ipaddress.IPv6Interface | None:
+    def generate_client_ipv6(
+        self, shift: int | None = None
+    ) -> ipaddress.IPv6Interface | None:
         if not self.ipv6:
             return None
-        result = self.ipv6 + self.address_shift
+        result = self.ipv6 + (self.address_shift if shift is None else shift)
         if result.ip not in self.ipv6.network:
             raise ValueError(
                 f"IPv6 address pool exhausted for {self.ipv6.network}",
             )
         return result
 
+    def take_key_counter(self, conn: sqlite3.Connection) -> int:
+        """Return the key counter for the next derivation of client keys and
+        advance it, so a key pair is never derived twice for an alias"""
+        [counter] = conn.execute(
+            "SELECT key_counter FROM interfaces WHERE name = ?", (self.name,)
+        ).fetchone()
+        conn.execute(
+            "UPDATE interfaces SET key_counter = ? WHERE name = ?",
+            (counter + 1, self.name),
+        )
+        self.key_counter = counter + 1
+        self.update_cache(conn)
+        return counter
+
+    def client_keys(
+        self,
+        conn: sqlite3.Connection,
+        aliases: Sequence[str],
+        workers: int | None = None,
+        executor: Executor | None = None,
+    ) -> tuple[list[tuple[str, str]], int | None]:
+        """Return new key pairs for the clients with the aliases and their
+        key counter. Keys are derived from the master seed of the interface
+        with a fresh counter, or taken from the key pool with a ``None``
+        counter when the interface has no seed."""
+        if self.key_seed is None:
+            return take_keys(conn, len(aliases), workers, executor), None
+        counter = self.take_key_counter(conn)
+        keys = derive_keygen_many(
+            self.key_seed,
+            self.name,
+            [(alias, counter) for alias in aliases],
+            workers,
+            executor,
+        )
+        return keys, counter
+
+    def derive_private_keys(
+        self, clients: Sequence["Client"], workers: int | None = None
+    ) -> list[str | None]:
+        """Derive the private keys of the clients again, ``None`` for the
+        clients whose keys were not derived from the master seed"""
+        derived = [
+            (client.alias, client.key_counter)
+            for client in clients
+            if client.key_counter is not None
+        ]
+        if self.key_seed is None or not derived:
+            return [None] * len(clients)
+        keys = iter(derive_keygen_many(self.key_seed, self.name, derived, workers))
+        return [
+            None if client.key_counter is None else next(keys)[0] for client in clients
+        ]
+
+    def client_shift(self, client: "Client") -> int | None:
+        """Return the offset of the client addresses from the server address"""
+        if self.ipv4 and client.ipv4:
+            return int(client.ipv4) - int(self.ipv4.ip)
+        if self.ipv6 and client.ipv6:
+            return int(client.ipv6) - int(self.ipv6.ip)
+        return None
+
+    def allocate_address(
+        self, conn: sqlite3.Connection
+    ) -> tuple[ipaddress.IPv4Address | None, ipaddress.IPv6Address | None]:
+        """Allocate the lowest free client address pair"""
+        return self.allocate_addresses(conn, 1)[0]
+
+    def allocate_addresses(
+        self, conn: sqlite3.Connection, count: int
+    ) -> list[tuple[ipaddress.IPv4Address | None, ipaddress.IPv6Address | None]]:
+        """Allocate the ``count`` lowest free client address pairs.
+
+        Freed offsets below ``address_shift`` are kept as ranges in the
+        ``free_addresses`` table and are walked in primary key order.
+        When they run out the pool grows by bumping ``address_shift``.
+        Nothing is changed when the pool is exhausted."""
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT first, last FROM free_addresses WHERE interface = ? ORDER BY first",
+            (self.name,),
+        )
+
+        shifts: list[int] = []
+        consumed: list[tuple[str, int]] = []
+        partial: tuple[int, int] | None = None
+        for free in cur:
+            needed = count - len(shifts)
+            if needed <= 0:
+                break
+            if free["last"] - free["first"] < needed:
+                shifts.extend(range(free["first"], free["last"] + 1))
+                consumed.append((self.name, free["first"]))
+            else:
+                shifts.extend(range(free["first"], free["first"] + needed))
+                partial = (free["first"] + needed, free["first"])
+        cur.close()
+
+        bumped = count - len(shifts)
+        shifts.extend(range(self.address_shift, self.address_shift + bumped))
+
+        addresses = []
+        for shift in shifts:
+            ipv4_iface = self.generate_client_ipv4(shift)
+            ipv6_iface = self.generate_client_ipv6(shift)
+            addresses.append(
+                (
+                    ipv4_iface.ip if ipv4_iface else None,
+                    ipv6_iface.ip if ipv6_iface else None,
+                )
+            )
+
+        cur = conn.cursor()
+        cur.executemany(
+            "DELETE FROM free_addresses WHERE interface = ? AND first = ?",
+            consumed,
+        )
+        if partial is not None:
+            cur.execute(
+                "UPDATE free_addresses SET first = ? WHERE interface = ? AND first = ?",
+                (partial[0], self.name, partial[1]),
+            )
+        if bumped:
+            self.address_shift += bumped
+            cur.execute(
+                "UPDATE interfaces SET address_shift = ? WHERE name = ?",
+                (self.address_shift, self.name),
+            )
+            self.update_cache(conn)
+        return addresses
+
+    def release_address(self, conn: sqlite3.Connection, shift: int) -> None:
+        """Return an allocated offset to the pool.
+
+        The offset is merged with adjacent free ranges, a range reaching
+        the top of the pool is folded back into ``address_shift``."""
+        if not 0 < shift < self.address_shift:
+            return
+
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT first, last FROM free_addresses WHERE interface = ? "
+            "AND first <= ? ORDER BY first DESC LIMIT 1",
+            (self.name, shift),
+        )
+        below = cur.fetchone()
+        if below and below["last"] >= shift:
+            # Already free
+            return
+
+        first, last = shift, shift
+        if below and below["last"] == shift - 1:
+            first = below["first"]
+            cur.execute(
+                "DELETE FROM free_addresses WHERE interface = ? AND first = ?",
+                (self.name, first),
+            )
+
+        cur.execute(
+            "SELECT last FROM free_addresses WHERE interface = ? AND first = ?",
+            (self.name, shift + 1),
+        )
+        above = cur.fetchone()
+        if above:
+            last = above["last"]
+            cur.execute(
+                "DELETE FROM free_addresses WHERE interface = ? AND first = ?",
+                (self.name, shift + 1),
+            )
+
+        if last == self.address_shift - 1:
+            self.address_shift = first
+            cur.execute(
+                "UPDATE interfaces SET address_shift = ? WHERE name = ?",
+                (self.address_shift, self.name),
+            )
+            self.update_cache(conn)
+        else:
+            cur.execute(
+                "INSERT INTO free_addresses(interface, first, last) VALUES (?, ?, ?)",
+                (self.name, first, last),
+            )
+
     def create_client(
         self,
         conn: sqlite3.Connection,
         alias: str,
         preshared_key: bool = False,
-    ) -> tuple["Client", str]:
-        psk: str | None = preshared_keygen() if preshared_key else None
-
-        ipv4_iface = self.generate_client_ipv4()
-        ipv6_iface = self.generate_client_ipv6()
-        ipv4 = ipv4_iface.ip if ipv4_iface else None
-        ipv6 = ipv6_iface.ip if ipv6_iface else None
+        public_key: str | None = None,
+    ) -> tuple["Client", str | None]:
+        """Create or replace a client. With the ``public_key`` of a key pair
+        made by the device no keys are generated and no private key is
+        returned."""
+        try:
+            previous: Client | None = Client.load(conn, alias, self.name)
+        except LookupError:
+            previous = None
 
-        self.address_shift += 1
-        self.save(conn)
+        private: str | None
+        counter: int | None = None
+        if public_key is None:
+            [(private, public)], counter = self.client_keys(conn, [alias])
+        else:
+            validate_public_keys([public_key])
+            # Replacing a client keeps its key valid
+            if previous is None or previous.public_key != public_key:
+                if public_keys_in_use(conn, [public_key]):
+                    raise ValueError(f"Public key {public_key} is already in use")
+            private, public = None, _encode_key(base64.b64decode(public_key))
 
-        private, public = keygen()
+        ipv4, ipv6 = self.allocate_address(conn)
+        psk: str | None = preshared_keygen() if preshared_key else None
 
         client = Client(
             interface=self.name,
@@ -252,24 +1721,226 @@ class Interface:
             preshared_key=psk,
             ipv4=ipv4,
             ipv6=ipv6,
+            key_counter=counter,
         )
         client.save(conn)
+
+        if previous is not None:
+            shift = self.client_shift(previous)
+            if shift is not None:
+                self.release_address(conn, shift)
+
         return client, private
 
-    def clients(self, conn: sqlite3.Connection) -> Iterator["Client"]:
+    def create_clients(
+        self,
+        conn: sqlite3.Connection,
+        clients: Sequence[tuple[str, bool]],
+        workers: int | None = None,
+        public_keys: Sequence[str | None] | None = None,
+    ) -> list[tuple["Client", str | None]]:
+        """Create many clients at once from ``(alias, preshared_key)`` pairs.
+
+        Addresses are allocated for the whole batch, the keys are taken
+        from the key pool or generated with ``workers`` processes and the
+        rows are inserted with a single ``executemany``. Aliases must not
+        exist yet, see :meth:`existing_aliases`.
+
+        ``public_keys`` lists a key made by the device, or ``None``, for
+        every client. Those clients get no key pair generated and no
+        private key returned."""
+        if public_keys is None:
+            public_keys = [None] * len(clients)
+        supplied = [key for key in public_keys if key is not None]
+        check_public_keys(conn, supplied)
+
+        addresses = self.allocate_addresses(conn, len(clients))
+        generated, counter = self.client_keys(
+            conn,
+            [alias for (alias, _), key in zip(clients, public_keys) if key is None],
+            workers,
+        )
+        keys = iter(generated)
+        psks = iter(preshared_keygen_many(sum(psk for _, psk in clients)))
+        result: list[tuple[Client, str | None]] = []
+        for (alias, preshared_key), (ipv4, ipv6), public_key in zip(
+            clients, addresses, public_keys
+        ):
+            private: str | None = None
+            key_counter: int | None = None
+            if public_key is None:
+                private, public_key = next(keys)
+                key_counter = counter
+            else:
+                public_key = _encode_key(base64.b64decode(public_key))
+            client = Client(
+                interface=self.name,
+                alias=alias,
+                public_key=public_key,
+                preshared_key=next(psks) if preshared_key else None,
+                ipv4=ipv4,
+                ipv6=ipv6,
+                key_counter=key_counter,
+            )
+            result.append((client, private))
+
+        Client.save_many(conn, [client for client, _ in result])
+        return result
+
+    def existing_aliases(
+        self, conn: sqlite3.Connection, aliases: Iterable[str]
+    ) -> set[str]:
+        """Return which of the given aliases already exist on the interface"""
+        result: set[str] = set()
+        aliases = list(aliases)
         cur = conn.cursor()
-        cur.execute(
-            "SELECT alias FROM clients WHERE interface = ? ORDER BY id", (self.name,)
+        for idx in range(0, len(aliases), QUERY_CHUNK_SIZE):
+            chunk = aliases[idx : idx + QUERY_CHUNK_SIZE]
+            cur.execute(
+                "SELECT alias FROM clients WHERE interface = ? AND alias IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                (self.name, *chunk),
+            )
+            result.update(row["alias"] for row in cur)
+        return result
+
+    def rotate_key(self, conn: sqlite3.Connection) -> None:
+        """Replace the key pair of the interface, its master seed is kept"""
+        [(self.private_key, self.public_key)] = take_keys(conn, 1)
+        self.save(conn)
+
+    def rotate_client_keys(
+        self,
+        conn: sqlite3.Connection,
+        aliases: Sequence[str] | None = None,
+        preshared_only: bool = False,
+        workers: int | None = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> Iterator[tuple["Client", str | None]]:
+        """Replace the keys of the clients, or of the given aliases, and
+        yield them with their new private keys as they are updated.
+
+        Key pairs are derived from the master seed of the interface, or
+        come from the key pool, using one process pool for the whole run.
+        Clients with a preshared key get a new one.
+        With ``preshared_only`` only preshared keys are replaced and no
+        private keys are yielded. Addresses stay the same. Every batch of
+        ``batch_size`` clients is written with one ``executemany`` in the
+        caller's transaction. Unknown aliases raise :class:`LookupError`
+        before anything is changed."""
+        if aliases is None:
+            total = conn.execute(
+                "SELECT count(*) FROM clients WHERE interface = ?", (self.name,)
+            ).fetchone()[0]
+            batches: Iterable[Sequence[Client]] = _batched(
+                self.clients(conn, batch_size), batch_size
+            )
+        else:
+            aliases = list(dict.fromkeys(aliases))
+            missing = set(aliases) - self.existing_aliases(conn, aliases)
+            if missing:
+                raise LookupError(
+                    f"Clients not found on interface '{self.name}': "
+                    f"{', '.join(sorted(missing))}",
+                )
+            total = len(aliases)
+            batches = (
+                [Client.load(conn, alias, self.name) for alias in chunk]
+                for chunk in _batched(aliases, batch_size)
+            )
+
+        with keygen_executor(0 if preshared_only else total, workers) as executor:
+            for batch in batches:
+                yield from self._rotate_batch(
+                    conn, batch, preshared_only, workers, executor
+                )
+
+    def _rotate_batch(
+        self,
+        conn: sqlite3.Connection,
+        clients: Sequence["Client"],
+        preshared_only: bool,
+        workers: int | None,
+        executor: Executor | None,
+    ) -> list[tuple["Client", str | None]]:
+        if preshared_only:
+            clients = [client for client in clients if client.preshared_key]
+            keys: list[tuple[str | None, str]] = [
+                (None, client.public_key) for client in clients
+            ]
+        else:
+            generated, counter = self.client_keys(
+                conn, [client.alias for client in clients], workers, executor
+            )
+            keys = list(generated)
+            for client in clients:
+                client.key_counter = counter
+        psks = iter(preshared_keygen_many(sum(bool(c.preshared_key) for c in clients)))
+
+        result: list[tuple[Client, str | None]] = []
+        for client, (private, public) in zip(clients, keys):
+            client.public_key = public
+            if client.preshared_key:
+                client.preshared_key = next(psks)
+            result.append((client, private))
+
+        conn.executemany(
+            "UPDATE clients SET public_key = ?, preshared_key = ?, key_counter = ? "
+            "WHERE interface = ? AND alias = ?",
+            [
+                (
+                    base64.b64decode(client.public_key),
+                    base64.b64decode(client.preshared_key)
+                    if client.preshared_key
+                    else None,
+                    client.key_counter,
+                    client.interface,
+                    client.alias,
+                )
+                for client in clients
+            ],
         )
-        for row in cur.fetchall():
-            yield Client.load(conn, row["alias"], self.name)
+        record_changes(conn, [(self.name, client.alias, False) for client in clients])
+        return result
+
+    def clients(
+        self, conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> Iterator["Client"]:
+        """Stream the clients of the interface ordered by id"""
+        for row in iter_client_rows(conn, self.name, batch_size):
+            yield Client.from_row(row)
+
+    @classmethod
+    def list(
+        cls, conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> Iterator["Interface"]:
+        """Stream all interfaces ordered by name, across the partitions of
+        a partitioned layout"""
+        for partition in iter_partitions(conn):
+            yield from cls._list(partition, batch_size)
 
     @classmethod
-    def list(cls, conn: sqlite3.Connection) -> Iterator["Interface"]:
+    def _list(cls, conn: sqlite3.Connection, batch_size: int) -> Iterator["Interface"]:
         cur = conn.cursor()
-        cur.execute("SELECT name FROM interfaces ORDER BY name")
-        for row in cur.fetchall():
-            yield cls.load(conn, row["name"])
+        for rows in iter_interface_rows(conn, batch_size):
+            names = (rows[0]["name"], rows[-1]["name"])
+            cur.execute(
+                "SELECT interface, address FROM interface_dns "
+                "WHERE interface BETWEEN ? AND ? ORDER BY interface, position",
+                names,
+            )
+            dns = OrderedGroups(cur.fetchall())
+            cur.execute(
+                "SELECT interface, network, prefix FROM interface_allowed_ips "
+                "WHERE interface BETWEEN ? AND ? ORDER BY interface, position",
+                names,
+            )
+            allowed_ips = OrderedGroups(cur.fetchall())
+            for row in rows:
+                yield cls.from_row(
+                    row, dns.take(row["name"]), allowed_ips.take(row["name"])
+                )
 
     def remove(self, conn: sqlite3.Connection) -> None:
         """Remove the interface from the database"""
@@ -278,21 +1949,112 @@ class Interface:
             "DELETE FROM clients WHERE interface = ?",
             (self.name,),
         )
+        cur.execute(
+            "DELETE FROM free_addresses WHERE interface = ?",
+            (self.name,),
+        )
+        cur.execute(
+            "DELETE FROM interface_dns WHERE interface = ?",
+            (self.name,),
+        )
+        cur.execute(
+            "DELETE FROM interface_allowed_ips WHERE interface = ?",
+            (self.name,),
+        )
+        cur.execute(
+            "DELETE FROM interface_networks WHERE interface = ?",
+            (self.name,),
+        )
+        if catalog_attached(conn):
+            cur.execute(
+                "DELETE FROM catalog.interface_networks WHERE interface = ?",
+                (self.name,),
+            )
         cur.execute(
             "DELETE FROM interfaces WHERE name = ?",
             (self.name,),
         )
 
+        record_changes(conn, [(self.name, None, True)])
 
-@dataclass(frozen=False)
-class Client:
-    interface: str
-    alias: str
-    public_key: str
-    preshared_key: str | None
-    ipv4: ipaddress.IPv4Address | None
-    ipv6: ipaddress.IPv6Address | None
-    created_at: datetime = field(default_factory=datetime.now)
+        cache = interface_cache(conn)
+        if cache is not None:
+            cache.discard(self.name)
+
+
+class Client(Record):
+    """WireGuard peer of an interface, the fields of loaded clients are
+    decoded from the database row on first access"""
+
+    __slots__ = (
+        "interface",
+        "alias",
+        "key_counter",
+        "_row",
+        "_public_key",
+        "_preshared_key",
+        "_ipv4",
+        "_ipv6",
+        "_created_at",
+    )
+    FIELDS = (
+        "interface",
+        "alias",
+        "public_key",
+        "preshared_key",
+        "ipv4",
+        "ipv6",
+        "key_counter",
+        "created_at",
+    )
+
+    _row: sqlite3.Row
+
+    def __init__(
+        self,
+        interface: str,
+        alias: str,
+        public_key: str,
+        preshared_key: str | None,
+        ipv4: ipaddress.IPv4Address | None,
+        ipv6: ipaddress.IPv6Address | None,
+        created_at: datetime | None = None,
+        key_counter: int | None = None,
+    ):
+        self.interface = interface
+        self.alias = alias
+        self.key_counter = key_counter
+        self.public_key = public_key
+        self.preshared_key = preshared_key
+        self.ipv4 = ipv4
+        self.ipv6 = ipv6
+        self.created_at = datetime.now() if created_at is None else created_at
+
+    @lazy
+    def public_key(self) -> str:
+        return _encode_key(self._row["public_key"])
+
+    @lazy
+    def preshared_key(self) -> str | None:
+        if self._row["preshared_key"] is None:
+            return None
+        return _encode_key(self._row["preshared_key"])
+
+    @lazy
+    def ipv4(self) -> ipaddress.IPv4Address | None:
+        if self._row["ipv4"] is None:
+            return None
+        return ipaddress.IPv4Address(self._row["ipv4"])
+
+    @lazy
+    def ipv6(self) -> ipaddress.IPv6Address | None:
+        if self._row["ipv6"] is None:
+            return None
+        return ipaddress.IPv6Address(self._row["ipv6"])
+
+    @lazy
+    def created_at(self) -> datetime:
+        return datetime.fromtimestamp(self._row["created_at"])
 
     @classmethod
     def load(cls, conn: sqlite3.Connection, alias: str, interface: str) -> "Client":
@@ -304,47 +2066,127 @@ class Client:
         result = cur.fetchone()
         if not result:
             raise LookupError("Client not found")
+        return cls.from_row(result)
 
-        return cls(
-            interface=result["interface"],
-            alias=result["alias"],
-            public_key=result["public_key"],
-            preshared_key=result["preshared_key"],
-            created_at=datetime.strptime(result["created_at"], "%Y-%m-%d %H:%M:%S"),
-            ipv4=ipaddress.IPv4Address(result["ipv4"]) if result["ipv4"] else None,
-            ipv6=ipaddress.IPv6Address(result["ipv6"]) if result["ipv6"] else None,
+    @classmethod
+    def find_by_address(
+        cls,
+        conn: sqlite3.Connection,
+        address: ipaddress.IPv4Address | ipaddress.IPv6Address,
+    ) -> list["Client"]:
+        """Find the clients with the address on any interface"""
+        if address.version == 4:
+            return cls._find(conn, "ipv4 = ?", (int(address),))
+        return cls._find(conn, "ipv6 = ?", (address.packed,))
+
+    @classmethod
+    def find_by_public_key(
+        cls, conn: sqlite3.Connection, public_key: str
+    ) -> list["Client"]:
+        """Find the clients with the public key on any interface"""
+        return cls._find(conn, "public_key = ?", (base64.b64decode(public_key),))
+
+    @classmethod
+    def find_by_alias_prefix(
+        cls, conn: sqlite3.Connection, prefix: str, limit: int = 100
+    ) -> list["Client"]:
+        """Find up to ``limit`` clients whose alias starts with the prefix,
+        ordered by alias. An index range scan, unlike ``LIKE``."""
+        if not prefix:
+            raise ValueError("Empty alias prefix")
+        last = ord(prefix[-1])
+        if last == sys.maxunicode:
+            # Nothing sorts right after it, matches come first in the scan
+            clients = [
+                client
+                for client in cls._find(
+                    conn,
+                    "alias >= ? ORDER BY alias, interface LIMIT ?",
+                    (prefix, limit),
+                )
+                if client.alias.startswith(prefix)
+            ]
+        else:
+            # Surrogates can not be encoded, U+E000 follows U+D7FF in UTF-8
+            upper = prefix[:-1] + chr(0xE000 if last == 0xD7FF else last + 1)
+            clients = cls._find(
+                conn,
+                "alias >= ? AND alias < ? ORDER BY alias, interface LIMIT ?",
+                (prefix, upper, limit),
+            )
+        # Merge the partitions of a partitioned layout
+        clients.sort(key=lambda client: (client.alias, client.interface))
+        return clients[:limit]
+
+    @classmethod
+    def _find(
+        cls, conn: sqlite3.Connection, condition: str, params: Sequence[Any]
+    ) -> list["Client"]:
+        return [
+            cls.from_row(row)
+            for partition in iter_partitions(conn)
+            for row in partition.execute(
+                f"SELECT * FROM clients WHERE {condition}", params
+            ).fetchall()
+        ]
+
+    @classmethod
+    def from_row(cls, result: sqlite3.Row) -> "Client":
+        """Build a client from a row of the ``clients`` table"""
+        client = cls.__new__(cls)
+        client.interface = result["interface"]
+        client.alias = result["alias"]
+        client.key_counter = result["key_counter"]
+        client._row = result
+        return client
+
+    SAVE_QUERY = """
+        INSERT INTO clients(
+            interface,
+            alias,
+            public_key,
+            preshared_key,
+            ipv4,
+            ipv6,
+            created_at,
+            key_counter
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO UPDATE
+        SET created_at = excluded.created_at,
+            public_key = excluded.public_key,
+            preshared_key = excluded.preshared_key,
+            ipv4 = excluded.ipv4,
+            ipv6 = excluded.ipv6,
+            key_counter = excluded.key_counter
+    """
+
+    def to_params(self) -> tuple:
+        """Return the query parameters for :attr:`SAVE_QUERY`"""
+        return (
+            self.interface,
+            self.alias,
+            base64.b64decode(self.public_key),
+            base64.b64decode(self.preshared_key) if self.preshared_key else None,
+            int(self.ipv4) if self.ipv4 else None,
+            self.ipv6.packed if self.ipv6 else None,
+            int(self.created_at.timestamp()),
+            self.key_counter,
         )
 
     def save(self, conn: sqlite3.Connection) -> None:
         """Save the client to the database"""
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO clients(
-                interface,
-                alias,
-                public_key,
-                preshared_key,
-                ipv4,
-                ipv6,
-                created_at
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO UPDATE
-            SET created_at = excluded.created_at,
-                public_key = excluded.public_key,
-                preshared_key = excluded.preshared_key,
-                ipv4 = excluded.ipv4,
-                ipv6 = excluded.ipv6
-            """,
-            (
-                self.interface,
-                self.alias,
-                self.public_key,
-                self.preshared_key,
-                str(self.ipv4) if self.ipv4 else None,
-                str(self.ipv6) if self.ipv6 else None,
-                self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            ),
+        cur.execute(self.SAVE_QUERY, self.to_params())
+        record_changes(conn, [(self.interface, self.alias, False)])
+
+    @classmethod
+    def save_many(cls, conn: sqlite3.Connection, clients: Iterable["Client"]) -> None:
+        """Save many clients with a single ``executemany``"""
+        clients = list(clients)
+        cur = conn.cursor()
+        cur.executemany(cls.SAVE_QUERY, (client.to_params() for client in clients))
+        record_changes(
+            conn, ((client.interface, client.alias, False) for client in clients)
         )
 
     def remove(self, conn: sqlite3.Connection) -> None:
@@ -354,3 +2196,365 @@ class Client:
             "DELETE FROM clients WHERE interface = ? AND alias = ?",
             (self.interface, self.alias),
         )
+        record_changes(conn, [(self.interface, self.alias, True)])
+
+        # Give the addresses back to the interface pool
+        try:
+            interface = Interface.load(conn, self.interface)
+        except LookupError:
+            return
+        shift = interface.client_shift(self)
+        if shift is not None:
+            interface.release_address(conn, shift)
+
+
+def find_clients(
+    conn: sqlite3.Connection, query: str, limit: int = 100
+) -> list[Client]:
+    """Find clients by IPv4 or IPv6 address, public key or alias prefix,
+    whichever the query looks like"""
+    try:
+        address = ipaddress.ip_address(query)
+    except ValueError:
+        pass
+    else:
+        return Client.find_by_address(conn, address)
+
+    try:
+        key = base64.b64decode(query, validate=True)
+    except ValueError:
+        # binascii.Error, or an alias with non-ASCII characters
+        key = b""
+    if len(key) == 32:
+        return Client.find_by_public_key(conn, query)
+    return Client.find_by_alias_prefix(conn, query, limit)
+
+
+class ClientTuple(NamedTuple):
+    """Client fields as strings, decoded without building address objects.
+    ``created_at`` is kept in epoch seconds."""
+
+    interface: str
+    alias: str
+    public_key: str
+    preshared_key: str | None
+    ipv4: str | None
+    ipv6: str | None
+    created_at: int
+    key_counter: int | None = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "ClientTuple":
+        """Build the tuple from a row of the ``clients`` table"""
+        ipv4, ipv6, preshared_key = row["ipv4"], row["ipv6"], row["preshared_key"]
+        return cls(
+            row["interface"],
+            row["alias"],
+            _encode_key(row["public_key"]),
+            None if preshared_key is None else _encode_key(preshared_key),
+            None if ipv4 is None else socket.inet_ntoa(ipv4.to_bytes(4, "big")),
+            None if ipv6 is None else socket.inet_ntop(socket.AF_INET6, ipv6),
+            row["created_at"],
+            row["key_counter"],
+        )
+
+
+def load_interfaces(
+    conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[tuple[Interface, Iterator[Client]]]:
+    """Stream every interface together with its clients.
+
+    Merges ordered, paginated scans of the tables on the interface name
+    instead of querying per interface and per client, so at most
+    ``batch_size`` rows of each table are held at once. Like
+    :func:`itertools.groupby`, the clients of an interface have to be
+    consumed before advancing to the next interface."""
+    return _load_interfaces(conn, batch_size, Client.from_row)
+
+
+def load_interface_tuples(
+    conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[tuple[Interface, Iterator[ClientTuple]]]:
+    """Same as :func:`load_interfaces` with the clients as :class:`ClientTuple`,
+    for loops that only print the client fields"""
+    return _load_interfaces(conn, batch_size, ClientTuple.from_row)
+
+
+def _load_interfaces(
+    conn: sqlite3.Connection,
+    batch_size: int,
+    factory: Callable[[sqlite3.Row], T],
+) -> Iterator[tuple[Interface, Iterator[T]]]:
+    for partition in iter_partitions(conn):
+        clients = OrderedGroups(iter_client_rows(partition, batch_size=batch_size))
+        for interface in Interface.list(partition, batch_size):
+            yield interface, map(factory, clients.take(interface.name))
+
+
+# Version of the dump format, independent of the schema version
+DUMP_FORMAT = 1
+
+
+def _dump_time(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _restore_time(value: str) -> int:
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def dump(
+    conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[dict[str, Any]]:
+    """Stream the database as records for JSON Lines.
+
+    A header record is followed by every interface, each followed by its
+    clients. Memory use does not depend on the number of clients."""
+    yield {"type": "header", "format": DUMP_FORMAT, "schema_version": SCHEMA_VERSION}
+    for partition in iter_partitions(conn):
+        for interface, clients in load_interface_tuples(partition, batch_size):
+            free_addresses = partition.execute(
+                "SELECT first, last FROM free_addresses "
+                "WHERE interface = ? ORDER BY first",
+                (interface.name,),
+            ).fetchall()
+            yield {
+                "type": "interface",
+                "name": interface.name,
+                "ipv4": str(interface.ipv4) if interface.ipv4 else None,
+                "ipv6": str(interface.ipv6) if interface.ipv6 else None,
+                "private_key": interface.private_key,
+                "public_key": interface.public_key,
+                "mtu": interface.mtu,
+                "listen_port": interface.listen_port,
+                "endpoint": interface.endpoint,
+                "dns": [str(address) for address in interface.dns],
+                "allowed_ips": [str(network) for network in interface.allowed_ips],
+                "address_shift": interface.address_shift,
+                "persistent_keepalive": interface.persistent_keepalive,
+                "free_addresses": [list(row) for row in free_addresses],
+                "created_at": _dump_time(int(interface.created_at.timestamp())),
+                "key_seed": (
+                    _encode_key(interface.key_seed) if interface.key_seed else None
+                ),
+                "key_counter": interface.key_counter,
+            }
+            for client in clients:
+                yield {
+                    "type": "client",
+                    "interface": client.interface,
+                    "alias": client.alias,
+                    "public_key": client.public_key,
+                    "preshared_key": client.preshared_key,
+                    "ipv4": client.ipv4,
+                    "ipv6": client.ipv6,
+                    "created_at": _dump_time(client.created_at),
+                    "key_counter": client.key_counter,
+                }
+
+
+def check_dump_header(record: Mapping[str, Any]) -> None:
+    if record.get("format") != DUMP_FORMAT:
+        raise ValueError(f"Unsupported dump format {record.get('format')!r}")
+
+
+def restore(
+    conn: sqlite3.Connection,
+    records: Iterable[Mapping[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> tuple[int, int]:
+    """Load records produced by :func:`dump` into an empty database.
+
+    Clients are inserted with ``executemany`` in batches of ``batch_size``,
+    the secondary indexes of the ``clients`` table are dropped first and
+    rebuilt once at the end. Runs in the caller's transaction and returns
+    the numbers of restored interfaces and clients."""
+    if conn.execute("SELECT 1 FROM interfaces LIMIT 1").fetchone():
+        raise ValueError("The database is not empty")
+
+    cur = conn.cursor()
+    indexes = cur.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'clients' AND sql IS NOT NULL"
+    ).fetchall()
+    for index in indexes:
+        cur.execute(f"DROP INDEX {index['name']}")
+
+    interfaces, clients = 0, 0
+    interface: str | None = None
+    batch: list[tuple] = []
+    for record in records:
+        kind = record.get("type")
+        if kind == "client":
+            if record["interface"] != interface:
+                raise ValueError(
+                    f"Client {record['alias']!r} does not follow "
+                    f"its interface {record['interface']!r}",
+                )
+            batch.append(_client_params(record))
+            if len(batch) >= batch_size:
+                cur.executemany(Client.SAVE_QUERY, batch)
+                clients += len(batch)
+                batch.clear()
+        elif kind == "interface":
+            cur.executemany(Client.SAVE_QUERY, batch)
+            clients += len(batch)
+            batch.clear()
+            interface = _restore_interface(conn, record)
+            interfaces += 1
+        elif kind == "header":
+            check_dump_header(record)
+        else:
+            raise ValueError(f"Unknown record type {kind!r}")
+    cur.executemany(Client.SAVE_QUERY, batch)
+    clients += len(batch)
+
+    for index in indexes:
+        cur.execute(index["sql"])
+    return interfaces, clients
+
+
+def _restore_interface(conn: sqlite3.Connection, record: Mapping[str, Any]) -> str:
+    interface = Interface(
+        name=record["name"],
+        ipv4=ipaddress.IPv4Interface(record["ipv4"]) if record["ipv4"] else None,
+        ipv6=ipaddress.IPv6Interface(record["ipv6"]) if record["ipv6"] else None,
+        private_key=record["private_key"],
+        public_key=record["public_key"],
+        mtu=record["mtu"],
+        listen_port=record["listen_port"],
+        endpoint=record["endpoint"],
+        dns=[ipaddress.ip_address(address) for address in record["dns"]],
+        allowed_ips=[
+            ipaddress.ip_network(network) for network in record["allowed_ips"]
+        ],
+        address_shift=record["address_shift"],
+        persistent_keepalive=record["persistent_keepalive"],
+        created_at=datetime.fromtimestamp(_restore_time(record["created_at"])),
+        key_seed=base64.b64decode(record["key_seed"])
+        if record.get("key_seed")
+        else None,
+        key_counter=record.get("key_counter", 0),
+    )
+    interface.save(conn)
+    conn.executemany(
+        "INSERT INTO free_addresses(interface, first, last) VALUES (?, ?, ?)",
+        [(interface.name, first, last) for first, last in record["free_addresses"]],
+    )
+    return interface.name
+
+
+def _client_params(record: Mapping[str, Any]) -> tuple:
+    """Parameters of :attr:`Client.SAVE_QUERY`, parsed without building
+    address objects"""
+    ipv4, ipv6, preshared_key = record["ipv4"], record["ipv6"], record["preshared_key"]
+    return (
+        record["interface"],
+        record["alias"],
+        base64.b64decode(record["public_key"]),
+        base64.b64decode(preshared_key) if preshared_key else None,
+        int.from_bytes(socket.inet_aton(ipv4), "big") if ipv4 else None,
+        socket.inet_pton(socket.AF_INET6, ipv6) if ipv6 else None,
+        _restore_time(record["created_at"]),
+        record.get("key_counter"),
+    )
+
+
+class StorageUsage(NamedTuple):
+    """Rows and pages of a table or index, ``None`` when unknown"""
+
+    name: str
+    kind: str
+    rows: int | None
+    pages: int | None
+    size: int | None
+
+
+class MaintenanceReport(NamedTuple):
+    database: str
+    integrity: list[str]
+    pages_before: int
+    pages_after: int
+    free_pages: int
+    page_size: int
+    usage: list[StorageUsage]
+
+    @property
+    def healthy(self) -> bool:
+        return self.integrity == ["ok"]
+
+
+VACUUM_MODES = ("none", "incremental", "full")
+
+
+def _pragma(conn: sqlite3.Connection, name: str) -> int:
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def storage_usage(conn: sqlite3.Connection) -> list[StorageUsage]:
+    """Row counts of the tables and page usage of tables and indexes.
+
+    Pages are read from the ``dbstat`` virtual table, they are ``None``
+    when SQLite was built without it."""
+    try:
+        pages = {
+            row[0]: (row[1], row[2])
+            for row in conn.execute(
+                "SELECT name, count(*), sum(pgsize) FROM dbstat GROUP BY name"
+            )
+        }
+    except sqlite3.OperationalError:
+        pages = {}
+
+    usage = []
+    for kind, name in conn.execute(
+        "SELECT type, name FROM sqlite_master "
+        "WHERE type IN ('table', 'index') ORDER BY tbl_name, type DESC, name"
+    ).fetchall():
+        rows = None
+        if kind == "table":
+            rows = conn.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0]
+        page_count, size = pages.get(name, (None, None))
+        usage.append(StorageUsage(name, kind, rows, page_count, size))
+    return usage
+
+
+def maintain(
+    conn: sqlite3.Connection, vacuum: str = "incremental"
+) -> MaintenanceReport:
+    """Check integrity, refresh planner statistics, vacuum and report usage.
+
+    ``VACUUM`` can not run inside a transaction, so the pending transaction
+    of the connection is committed first. Databases created without
+    ``auto_vacuum`` are converted to incremental mode by a full ``VACUUM``
+    once. Nothing is changed when the integrity check fails."""
+    if vacuum not in VACUUM_MODES:
+        raise ValueError(f"Unknown vacuum mode {vacuum!r}")
+    if conn.in_transaction:
+        conn.commit()
+
+    database = Path(conn.execute("PRAGMA database_list").fetchone()[2]).name
+    pages_before = _pragma(conn, "page_count")
+    integrity = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    if integrity == ["ok"]:
+        conn.execute("ANALYZE")
+        if vacuum != "none" and _pragma(conn, "auto_vacuum") != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        elif vacuum == "full":
+            conn.execute("VACUUM")
+        elif vacuum == "incremental":
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        conn.execute("PRAGMA optimize")
+        # Shrink the WAL file, a vacuum writes every page to it
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    return MaintenanceReport(
+        database=database,
+        integrity=integrity,
+        pages_before=pages_before,
+        pages_after=_pragma(conn, "page_count"),
+        free_pages=_pragma(conn, "freelist_count"),
+        page_size=_pragma(conn, "page_size"),
+        usage=storage_usage(conn),
+    )
@@ -1,33 +1,143 @@
 import base64
+import binascii
+import contextlib
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator, Sequence
 
-from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.kdf.hkdf import HKDFExpand
+
+
+# Below this many keys a pool costs more than it saves
+PARALLEL_THRESHOLD = 512
+PRESHARED_KEY_SIZE = 32
+KEY_SEED_SIZE = 32
+DERIVATION_LABEL = b"wg-gen client key"
 
 
 def keygen():
     priv = X25519PrivateKey.generate()
-    priv_b64 = base64.b64encode(
-        priv.private_bytes(
-            serialization.Encoding.Raw,
-            serialization.PrivateFormat.Raw,
-            serialization.NoEncryption(),
-        ),
-    ).decode()
-    pub_b64 = base64.b64encode(
-        priv.public_key().public_bytes(
-            serialization.Encoding.Raw,
-            serialization.PublicFormat.Raw,
-        ),
-    ).decode()
+    priv_b64 = base64.b64encode(priv.private_bytes_raw()).decode()
+    pub_b64 = base64.b64encode(priv.public_key().public_bytes_raw()).decode()
+    return priv_b64, pub_b64
+
+
+def _keygen_chunk(count: int) -> list[tuple[str, str]]:
+    return [keygen() for _ in range(count)]
+
+
+def _chunk_sizes(count: int, workers: int | None) -> list[int]:
+    # A few chunks per worker even out the uneven scheduling
+    chunks = min((workers or os.cpu_count() or 1) * 4, count) or 1
+    size, rest = divmod(count, chunks)
+    return [size + 1] * rest + [size] * (chunks - rest)
+
+
+@contextlib.contextmanager
+def keygen_executor(
+    count: int, workers: int | None = None
+) -> Iterator[Executor | None]:
+    """Process pool to share between the :func:`keygen_many` calls making
+    ``count`` keys in total, ``None`` when they are better made in-process"""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or count < PARALLEL_THRESHOLD:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield executor
+
+
+def keygen_many(
+    count: int,
+    workers: int | None = None,
+    executor: Executor | None = None,
+) -> list[tuple[str, str]]:
+    """Generate ``count`` key pairs like :func:`keygen`.
+
+    Large batches are split into chunks generated by a pool of ``workers``
+    processes, ``os.cpu_count()`` by default, or by the given executor.
+    Small batches and ``workers=1`` stay in the calling process."""
+    if executor is None:
+        with keygen_executor(count, workers) as pool:
+            if pool is None:
+                return _keygen_chunk(count)
+            return keygen_many(count, workers, pool)
+
+    sizes = _chunk_sizes(count, workers)
+    return [pair for chunk in executor.map(_keygen_chunk, sizes) for pair in chunk]
+
+
+def key_seedgen() -> bytes:
+    """Generate the master seed client keys of an interface are derived from"""
+    return os.urandom(KEY_SEED_SIZE)
+
+
+def derive_keygen(
+    seed: bytes, interface: str, alias: str, counter: int
+) -> tuple[str, str]:
+    """Derive the key pair of a client from the master seed of its interface.
+
+    The seed is uniformly random, so it is used as the HKDF pseudorandom
+    key and only the expand step runs, over the length-prefixed interface
+    name, alias and key counter."""
+    info = DERIVATION_LABEL
+    for part in (interface.encode(), alias.encode()):
+        info += len(part).to_bytes(4, "big") + part
+    info += counter.to_bytes(8, "big")
+
+    private = HKDFExpand(hashes.SHA256(), 32, info).derive(seed)
+    priv = X25519PrivateKey.from_private_bytes(private)
+    priv_b64 = base64.b64encode(priv.private_bytes_raw()).decode()
+    pub_b64 = base64.b64encode(priv.public_key().public_bytes_raw()).decode()
     return priv_b64, pub_b64
 
 
-def preshared_keygen():
-    return base64.b64encode(
-        X25519PrivateKey.generate()
-        .public_key()
-        .public_bytes(
-            serialization.Encoding.Raw,
-            serialization.PublicFormat.Raw,
-        ),
-    ).decode()
+def _derive_chunk(
+    seed: bytes, interface: str, clients: Sequence[tuple[str, int]]
+) -> list[tuple[str, str]]:
+    return [
+        derive_keygen(seed, interface, alias, counter) for alias, counter in clients
+    ]
+
+
+def derive_keygen_many(
+    seed: bytes,
+    interface: str,
+    clients: Sequence[tuple[str, int]],
+    workers: int | None = None,
+    executor: Executor | None = None,
+) -> list[tuple[str, str]]:
+    """Derive the key pairs of ``(alias, counter)`` clients like
+    :func:`derive_keygen`, in parallel for large batches like
+    :func:`keygen_many`"""
+    if executor is None:
+        with keygen_executor(len(clients), workers) as pool:
+            if pool is None:
+                return _derive_chunk(seed, interface, clients)
+            return derive_keygen_many(seed, interface, clients, workers, pool)
+
+    chunks, start = [], 0
+    for size in _chunk_sizes(len(clients), workers):
+        chunks.append(clients[start : start + size])
+        start += size
+    results = executor.map(
+        _derive_chunk, [seed] * len(chunks), [interface] * len(chunks), chunks
+    )
+    return [pair for chunk in results for pair in chunk]
+
+
+def preshared_keygen() -> str:
+    return preshared_keygen_many(1)[0]
+
+
+def preshared_keygen_many(count: int) -> list[str]:
+    """Generate ``count`` preshared keys from a single read of the OS CSPRNG"""
+    data = os.urandom(PRESHARED_KEY_SIZE * count)
+    return [
+        binascii.b2a_base64(
+            data[idx : idx + PRESHARED_KEY_SIZE], newline=False
+        ).decode()
+        for idx in range(0, len(data), PRESHARED_KEY_SIZE)
+    ]